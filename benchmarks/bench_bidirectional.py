@@ -0,0 +1,56 @@
+"""
+Benchmark of bidirectional planning against unidirectional planning.
+
+The puck planner crosses the whole obstacle grid of demos/demo_boat_advanced.py,
+either alone or as the forward tree of a BidirectionalPlanner that also grows
+a backward tree from the goal. Every run plans with a min_time of 0, so it
+finishes as soon as it has a plan that reached the goal region, or at the
+largest budget. The time that took is then compared to each budget to get
+the fraction of runs that would have succeeded within it. The mean plan ETA
+of the runs that succeeded within the largest budget is reported too.
+
+"""
+
+################################################# DEPENDENCIES
+
+from __future__ import division
+
+import numpy as np
+
+import lqrrt
+import problems
+
+################################################# PARAMETERS
+
+budgets = [1, 2, 4, 8]  # s
+runs = 10
+
+################################################# PLANNING
+
+def plan(bidirectional, seed):
+    """
+    Returns the time it took to reach the goal (np.inf if it didn't)
+    and the plan ETA, for one run with the given seed.
+
+    """
+    planner = problems.make_puck_planner(max_time=budgets[-1], seed=seed)
+    if bidirectional:
+        planner = lqrrt.BidirectionalPlanner(planner, problems.puck_reverse_dynamics, problems.puck_reverse_lqr)
+    planner.update_plan(problems.puck_x0, problems.puck_sample_space, goal_bias=problems.puck_goal_bias)
+    if bidirectional:
+        planner = planner.planner
+    if not planner.plan_reached_goal:
+        return (np.inf, planner.T)
+    return (planner.stats['time'], planner.T)
+
+
+print("\nPuck planner across the obstacle grid, success within each budget, {} runs".format(runs))
+print("{:>15} ".format("mode") + " ".join("{:>8}".format("{} s".format(budget)) for budget in budgets) +
+      " {:>10}".format("ETA (s)"))
+for bidirectional in (False, True):
+    outcomes = np.array([plan(bidirectional, seed) for seed in xrange(runs)])
+    times, etas = outcomes[:, 0], outcomes[:, 1]
+    print("{:>15} ".format("bidirectional" if bidirectional else "unidirectional") +
+          " ".join("{:>8}".format("{}/{}".format(np.sum(times <= budget), runs)) for budget in budgets) +
+          " {:>10.1f}".format(np.mean(etas[np.isfinite(times)]) if np.any(np.isfinite(times)) else np.nan))
+print("")
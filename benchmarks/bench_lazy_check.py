@@ -0,0 +1,64 @@
+"""
+Benchmark of lazy collision checking.
+
+The boat planner is run on the obstacle grid of demos/demo_boat_advanced.py
+for a fixed time budget with a few lazy_check strides (0 is eager checking),
+both one sample at a time and with batched extensions. For each, the number
+of states given to the feasibility check per planning iteration is reported
+along with iterations per second, final tree size, pruned nodes, how often
+the goal region was reached, and the resulting plan ETA.
+
+"""
+
+################################################# DEPENDENCIES
+
+from __future__ import division
+
+import numpy as np
+
+import problems
+
+################################################# PARAMETERS
+
+strides = [0, 5, 20]
+batch_sizes = [1, 8]
+budget = 5  # s
+runs = 3
+
+################################################# COUNTING
+
+nchecks = [0]
+
+def is_feasible(x, u):
+    nchecks[0] += 1
+    return problems.is_feasible(x, u)
+
+def is_feasible_batch(X, U):
+    nchecks[0] += len(X)
+    return problems.is_feasible_batch(X, U)
+
+################################################# PLANNING
+
+print("\nBoat planner on the obstacle grid, {} s budget, mean of {} runs".format(budget, runs))
+print("{:>6} {:>8} {:>12} {:>10} {:>10} {:>10} {:>10} {:>10}".format("batch", "stride", "checks/iter", "iters/s",
+                                                                   "nodes", "pruned", "reached", "ETA (s)"))
+for batch_size in batch_sizes:
+    for stride in strides:
+        checks = []; rates = []; nnodes = []; npruned = []; reached = []; etas = []
+        for run in xrange(runs):
+            nchecks[0] = 0
+            planner = problems.make_planner(batch_size=batch_size, lazy_check=stride, nn_method='kdtree',
+                                            seed=run)
+            planner.constraints.set_feasibility_function(is_feasible, is_feasible_batch)
+            planner.update_plan(problems.x0, problems.sample_space, goal_bias=problems.goal_bias,
+                                specific_time=budget)
+            checks.append(nchecks[0] / planner.stats['iterations'])
+            rates.append(planner.stats['iterations'] / planner.stats['time'])
+            nnodes.append(planner.tree.size)
+            npruned.append(planner.stats['pruned'])
+            reached.append(planner.plan_reached_goal)
+            etas.append(planner.T)
+        print("{:>6} {:>8} {:>12.1f} {:>10.1f} {:>10.0f} {:>10.0f} {:>10} {:>10.1f}".format(
+              batch_size, stride, np.mean(checks), np.mean(rates), np.mean(nnodes), np.mean(npruned),
+              "{}/{}".format(sum(reached), runs), np.mean(etas)))
+print("")
@@ -0,0 +1,86 @@
+"""
+Benchmark of exact versus approximate nearest-node search.
+
+First, the time of a single nearest-node query is measured on synthetic
+trees of increasing size for brute force search, the exact k-d tree index,
+and the approximate k-d tree index with a few approximation factors.
+
+Then the boat planner is run on the noised obstacle grid of
+demos/demo_boat_advanced.py with each search mode for a fixed time
+budget, reporting planning iterations per second, final tree size,
+how often the goal region was reached, and the resulting plan ETA.
+
+"""
+
+################################################# DEPENDENCIES
+
+from __future__ import division
+import time
+
+import numpy as np
+from lqrrt.neighbors import NearestIndex
+
+import problems
+
+################################################# PARAMETERS
+
+sizes = [1000, 10000, 30000, 100000]
+nqueries = 200
+modes = [('brute', 'brute', 0),
+         ('exact', 'kdtree', 0),
+         ('eps=1', 'kdtree', 1),
+         ('eps=3', 'kdtree', 3)]
+budget = 10  # s
+runs = 3
+
+################################################# QUERY TIMES
+
+def query_time(size, nn_method, nn_eps):
+    """
+    Returns the mean seconds per nearest-node query over a synthetic
+    tree of the given size spread over the boat's sample space.
+
+    """
+    space = np.array(problems.sample_space, dtype=np.float64)
+    space[2] = (-np.pi, np.pi)
+    states = space[:, 0] + np.diff(space).flatten()*np.random.sample((size, problems.nstates))
+    queries = space[:, 0] + np.diff(space).flatten()*np.random.sample((nqueries, problems.nstates))
+    S = problems.S
+
+    if nn_method == 'brute':
+        start = time.time()
+        for x in queries:
+            diffs = states - x
+            np.argmin(np.sum(np.tensordot(diffs, S, axes=1) * diffs, axis=1))
+        return (time.time() - start) / nqueries
+
+    index = NearestIndex(S, eps=nn_eps)
+    index.extend(states)
+    start = time.time()
+    for x in queries:
+        index.nearest(x)
+    return (time.time() - start) / nqueries
+
+print("\nMean nearest-node query time (us)")
+print("{:>10}".format("nodes") + "".join("{:>10}".format(name) for name, _, _ in modes))
+for size in sizes:
+    times = [query_time(size, nn_method, nn_eps) for _, nn_method, nn_eps in modes]
+    print("{:>10}".format(size) + "".join("{:>10.1f}".format(1E6*t) for t in times))
+
+################################################# PLANNING
+
+print("\nBoat planner on the obstacle grid, {} s budget, mean of {} runs".format(budget, runs))
+print("{:>10} {:>12} {:>10} {:>10} {:>10}".format("mode", "iters/s", "nodes", "reached", "ETA (s)"))
+for name, nn_method, nn_eps in modes:
+    rates = []; nnodes = []; reached = []; etas = []
+    for run in xrange(runs):
+        planner = problems.make_planner(nn_method=nn_method, nn_eps=nn_eps, seed=run)
+        planner.update_plan(problems.x0, problems.sample_space, goal_bias=problems.goal_bias,
+                            specific_time=budget)
+        rates.append(planner.stats['iterations'] / planner.stats['time'])
+        nnodes.append(planner.tree.size)
+        reached.append(planner.plan_reached_goal)
+        etas.append(planner.T)
+    print("{:>10} {:>12.1f} {:>10.0f} {:>10} {:>10.1f}".format(name, np.mean(rates), np.mean(nnodes),
+                                                               "{}/{}".format(sum(reached), runs), np.mean(etas)))
+print("")
@@ -0,0 +1,53 @@
+"""
+Benchmark of OR-parallel planning across a process pool.
+
+The boat planner is run on the obstacle grid of demos/demo_boat_advanced.py
+with a ParallelPlanner of one tree per worker for a few worker counts,
+stopping every tree once any of them reaches the goal (stop_on_first with a
+min_time of 0) or at the time budget. Each pool is started once and reused
+for all of its runs. Over the runs, the median wall-clock time to the first
+solution (over the runs that reached the goal) is reported along with how
+often the goal was reached, the mean plan ETA, and the speedup over one
+worker. The number of CPUs is printed too, since speedup can't beat it.
+
+"""
+
+################################################# DEPENDENCIES
+
+from __future__ import division
+import multiprocessing
+
+import numpy as np
+
+import lqrrt
+import problems
+
+################################################# PARAMETERS
+
+ncpus = multiprocessing.cpu_count()
+worker_counts = sorted(set([1, 2, 4, ncpus]))
+budget = 10  # s
+batch_size = 8
+runs = 8
+
+################################################# PLANNING
+
+print("\nBoat planner on the obstacle grid, up to {} s, {} runs each, {} CPUs".format(budget, runs, ncpus))
+print("{:>8} {:>10} {:>10} {:>10} {:>10}".format("workers", "reached", "med (s)", "ETA (s)", "speedup"))
+base_time = None
+for nworkers in worker_counts:
+    planner = problems.make_planner(batch_size=batch_size, nn_method='kdtree', min_time=0, max_time=budget, seed=0)
+    parallel = lqrrt.ParallelPlanner(planner, nworkers=nworkers, stop_on_first=True)
+    times = []; etas = []
+    for run in xrange(runs):
+        parallel.update_plan(problems.x0, problems.sample_space, goal_bias=problems.goal_bias)
+        if planner.plan_reached_goal:
+            times.append(parallel.wall_time)
+            etas.append(planner.T)
+    parallel.close()
+    med = np.median(times) if times else np.nan
+    if base_time is None:
+        base_time = med
+    print("{:>8} {:>10} {:>10.2f} {:>10.1f} {:>10.2f}".format(nworkers, "{}/{}".format(len(times), runs), med,
+          np.mean(etas) if etas else np.nan, base_time / med))
+print("")
@@ -0,0 +1,45 @@
+"""
+Benchmark of RRT*-style rewiring.
+
+The boat planner is run on the obstacle grid of demos/demo_boat_advanced.py
+for a few time budgets with batched extensions, without rewiring and with a couple of rewire
+neighbor counts. For each, the final tree size, how often the goal region
+was reached, and the mean plan ETA over the runs that reached it are
+reported, to show how plan quality trades against tree growth as the
+budget increases.
+
+"""
+
+################################################# DEPENDENCIES
+
+from __future__ import division
+
+import numpy as np
+
+import problems
+
+################################################# PARAMETERS
+
+rewires = [0, 4, 8]
+budgets = [5, 10, 20]  # s
+batch_size = 8
+runs = 3
+
+################################################# PLANNING
+
+print("\nBoat planner on the obstacle grid, mean of {} runs".format(runs))
+print("{:>8} {:>10} {:>10} {:>10} {:>10}".format("rewire", "budget", "nodes", "reached", "ETA (s)"))
+for rewire in rewires:
+    for budget in budgets:
+        nnodes = []; reached = []; etas = []
+        for run in xrange(runs):
+            planner = problems.make_planner(rewire=rewire, batch_size=batch_size, nn_method='kdtree', seed=run)
+            planner.update_plan(problems.x0, problems.sample_space, goal_bias=problems.goal_bias,
+                                specific_time=budget)
+            nnodes.append(planner.tree.size)
+            reached.append(planner.plan_reached_goal)
+            if planner.plan_reached_goal:
+                etas.append(planner.T)
+        print("{:>8} {:>10} {:>10.0f} {:>10} {:>10.1f}".format(rewire, budget, np.mean(nnodes),
+              "{}/{}".format(sum(reached), runs), np.mean(etas) if etas else np.nan))
+print("")
@@ -0,0 +1,85 @@
+"""
+Benchmark of the standard random sampler.
+
+Samples are drawn for the boat planner on the obstacle grid of
+demos/demo_boat_advanced.py with a few block sizes, where a block
+size of 1 draws and checks one candidate at a time. For each, the
+time per served sample and the rejection rate are reported, both
+with the batch feasibility check and with the one-state check.
+
+Then a GridSampler is given a rasterized version of the obstacle grid
+and the same is reported for it, along with how long it took to index
+the grid from scratch and to patch in a small change.
+
+"""
+
+################################################# DEPENDENCIES
+
+from __future__ import division
+import time
+
+import numpy as np
+
+import lqrrt
+import problems
+
+################################################# PARAMETERS
+
+block_sizes = [1, 16, 64, 256]
+nsamples = 20000
+
+################################################# MEASUREMENT
+
+planner = problems.make_planner()
+checks = [('batch', problems.is_feasible_batch),
+          ('one-state', None)]
+
+print("\nDrawing {} samples on the obstacle grid".format(nsamples))
+print("{:>10} {:>8} {:>14} {:>12}".format("check", "block", "us/sample", "rejected"))
+for name, is_feasible_batch in checks:
+    constraints = lqrrt.Constraints(nstates=problems.nstates, ncontrols=problems.ncontrols,
+                                    goal_buffer=problems.goal_buffer, is_feasible=problems.is_feasible,
+                                    is_feasible_batch=is_feasible_batch)
+    for block_size in block_sizes:
+        np.random.seed(0)
+        sampler = lqrrt.RejectionSampler(problems.sample_space, problems.goal_bias, constraints,
+                                         block_size=block_size)
+        start = time.time()
+        for i in xrange(nsamples):
+            sampler(planner)
+        elapsed = time.time() - start
+        print("{:>10} {:>8} {:>14.1f} {:>12.3f}".format(name, block_size, 1E6*elapsed/nsamples,
+                                                       sampler.rejection_rate))
+print("")
+
+################################################# GRID SAMPLING
+
+# Rasterized obstacle grid, free where the boat's middle clears every obstacle by half its width
+cpm = 4  # cells per m
+origin = np.array([-10, -10])
+rows, cols = np.mgrid[0:80*cpm, 0:80*cpm]
+centers_x = origin[0] + (cols + 0.5)/cpm
+centers_y = origin[1] + (rows + 0.5)/cpm
+free = np.ones(rows.shape, dtype=bool)
+for ob in problems.obs:
+    free &= np.sqrt((centers_x - ob[0])**2 + (centers_y - ob[1])**2) > ob[2] + problems.boat_width/2
+
+constraints = lqrrt.Constraints(nstates=problems.nstates, ncontrols=problems.ncontrols,
+                                goal_buffer=problems.goal_buffer, is_feasible=problems.is_feasible,
+                                is_feasible_batch=problems.is_feasible_batch)
+np.random.seed(0)
+sampler = lqrrt.GridSampler(problems.sample_space, problems.goal_bias, constraints)
+sampler.set_grid(free, origin, cpm)
+full_build = sampler.build_time
+free[40:44, 40:44] = False  # a new little obstacle
+sampler.set_grid(free, origin, cpm)
+patch_build = sampler.build_time
+start = time.time()
+for i in xrange(nsamples):
+    sampler(planner)
+elapsed = time.time() - start
+
+print("Grid sampler on a {}x{} grid".format(*free.shape))
+print("{:>10} {:>8} {:>14.1f} {:>12.3f}".format("batch", sampler.block_size, 1E6*elapsed/nsamples,
+                                               sampler.rejection_rate))
+print("Build time: {:.2f} ms full, {:.2f} ms patched\n".format(1E3*full_build, 1E3*patch_build))
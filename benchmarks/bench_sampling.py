@@ -0,0 +1,47 @@
+"""
+Benchmark of uniform versus scrambled Halton sampling.
+
+The boat planner is run on the obstacle grid of demos/demo_boat_advanced.py
+with each sampling option, stopping as soon as a plan reaches the goal
+(min_time of 0) or at the time budget. Over many seeds, the distribution
+of the time to first solution is reported (quartiles over the runs that
+reached the goal) along with how often the goal was reached and the mean
+number of planning iterations it took.
+
+"""
+
+################################################# DEPENDENCIES
+
+from __future__ import division
+
+import numpy as np
+
+import problems
+
+################################################# PARAMETERS
+
+samplings = ['uniform', 'halton']
+budget = 10  # s
+batch_size = 8
+runs = 10
+
+################################################# PLANNING
+
+print("\nBoat planner on the obstacle grid, up to {} s, {} runs each".format(budget, runs))
+print("{:>8} {:>10} {:>8} {:>8} {:>8} {:>10}".format("sampling", "reached", "q1 (s)", "med (s)", "q3 (s)", "iters"))
+for sampling in samplings:
+    times = []; iterations = []
+    for run in xrange(runs):
+        planner = problems.make_planner(sampling=sampling, batch_size=batch_size, nn_method='kdtree',
+                                        min_time=0, max_time=budget, seed=run)
+        planner.update_plan(problems.x0, problems.sample_space, goal_bias=problems.goal_bias)
+        if planner.plan_reached_goal:
+            times.append(planner.stats['first_plan_time'])
+            iterations.append(planner.stats['iterations'])
+    if times:
+        q1, med, q3 = np.percentile(times, [25, 50, 75])
+    else:
+        q1 = med = q3 = np.nan
+    print("{:>8} {:>10} {:>8.2f} {:>8.2f} {:>8.2f} {:>10.0f}".format(sampling, "{}/{}".format(len(times), runs),
+          q1, med, q3, np.mean(iterations) if iterations else np.nan))
+print("")
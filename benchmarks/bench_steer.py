@@ -0,0 +1,72 @@
+"""
+Benchmark of the steering routine that simulates each tree extension.
+
+A boat planner grows a tree for a moment, and then the same set of
+extensions (from random nodes toward random samples) is steered with
+and without pure_callbacks. For each mode, the number of arrays copied
+through np.copy and the mean time are reported per extension. The
+rollouts themselves are written into the planner's preallocated buffer
+either way, so the difference is the defensive copies.
+
+"""
+
+################################################# DEPENDENCIES
+
+from __future__ import division
+import time
+
+import numpy as np
+
+import problems
+
+################################################# PARAMETERS
+
+grow_time = 2  # s
+nextensions = 2000
+modes = [('copying', False),
+         ('pure', True)]
+
+################################################# COUNTING
+
+class CopyCounter(object):
+    """
+    Replaces np.copy with a version that counts its calls.
+
+    """
+    def __init__(self):
+        self.count = 0
+        self._copy = np.copy
+
+    def __call__(self, *args, **kwargs):
+        self.count += 1
+        return self._copy(*args, **kwargs)
+
+    def __enter__(self):
+        np.copy = self
+        return self
+
+    def __exit__(self, *args):
+        np.copy = self._copy
+
+################################################# MEASUREMENT
+
+np.random.seed(0)
+planner = problems.make_planner(seed=0)
+planner.update_plan(problems.x0, problems.sample_space, goal_bias=problems.goal_bias,
+                    specific_time=grow_time)
+
+space = np.array(problems.sample_space, dtype=np.float64)
+IDs = np.random.randint(0, planner.tree.size-1, nextensions)  # last node is the close-out, without an lqr
+targets = space[:, 0] + np.diff(space).flatten()*np.random.sample((nextensions, problems.nstates))
+
+print("\nSteering {} extensions on a tree of {} nodes".format(nextensions, planner.tree.size))
+print("{:>10} {:>14} {:>14}".format("mode", "copies/ext", "us/ext"))
+for name, pure in modes:
+    with CopyCounter() as counter:
+        planner.set_system(pure_callbacks=pure)
+        start = time.time()
+        for ID, xtar in zip(IDs, targets):
+            planner._steer(ID, xtar)
+        elapsed = time.time() - start
+    print("{:>10} {:>14.1f} {:>14.1f}".format(name, counter.count/nextensions, 1E6*elapsed/nextensions))
+print("")
@@ -0,0 +1,47 @@
+"""
+Benchmark of growing one tree with several threads.
+
+The boat planner is run on the obstacle grid of demos/demo_boat_advanced.py
+for a fixed time budget with a few thread counts, each thread extending
+toward its own batch of samples every planning iteration. For each, the
+number of nodes added per second is reported along with the final tree
+size, how often the goal region was reached, and the resulting plan ETA.
+The number of CPUs is printed too, since threads can't beat it.
+
+"""
+
+################################################# DEPENDENCIES
+
+from __future__ import division
+import multiprocessing
+
+import numpy as np
+
+import problems
+
+################################################# PARAMETERS
+
+thread_counts = [1, 2, 4]
+batch_size = 8
+budget = 5  # s
+runs = 3
+
+################################################# PLANNING
+
+print("\nBoat planner on the obstacle grid, {} s budget, mean of {} runs, {} CPUs".format(budget, runs,
+                                                                                         multiprocessing.cpu_count()))
+print("{:>8} {:>10} {:>10} {:>10} {:>10}".format("threads", "nodes/s", "nodes", "reached", "ETA (s)"))
+for threads in thread_counts:
+    rates = []; nnodes = []; reached = []; etas = []
+    for run in xrange(runs):
+        planner = problems.make_planner(threads=threads, batch_size=batch_size, nn_method='kdtree',
+                                        pure_callbacks=True, seed=run)
+        planner.update_plan(problems.x0, problems.sample_space, goal_bias=problems.goal_bias,
+                            specific_time=budget)
+        rates.append(planner.tree.size / planner.stats['time'])
+        nnodes.append(planner.tree.size)
+        reached.append(planner.plan_reached_goal)
+        etas.append(planner.T)
+    print("{:>8} {:>10.1f} {:>10.0f} {:>10} {:>10.1f}".format(threads, np.mean(rates), np.mean(nnodes),
+          "{}/{}".format(sum(reached), runs), np.mean(etas)))
+print("")
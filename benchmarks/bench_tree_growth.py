@@ -0,0 +1,63 @@
+"""
+Benchmark of lqrrt tree growth.
+
+Grows trees of increasing size with random nodes and edges shaped
+like the ones the boat planner produces, and reports the insertion
+rate over the whole growth and over its last tenth. Amortized O(1)
+insertion means both rates should stay flat as the tree gets bigger.
+The memory allocated per node is reported too, storing policies both
+per node and lazily (recomputed from the node state on demand).
+
+"""
+
+################################################# DEPENDENCIES
+
+from __future__ import division
+import time
+
+import numpy as np
+from lqrrt.tree import Tree
+
+################################################# PARAMETERS
+
+nstates = 6
+ncontrols = 3
+edge_length = 20
+sizes = [1000, 3000, 10000, 30000, 100000]
+
+################################################# BENCHMARK
+
+def grow(size, lqr_policy=None):
+    """
+    Returns the nodes/second over all of growing a tree to the given
+    size, over just its last tenth, and the bytes allocated per node.
+
+    """
+    seed_lqr = (np.eye(nstates), np.zeros((ncontrols, nstates)))
+    tree = Tree(np.zeros(nstates), seed_lqr, lqr_policy=lqr_policy)
+    states = np.random.sample((size, nstates))
+    x_seq = list(np.random.sample((edge_length, nstates)))
+    u_seq = list(np.random.sample((edge_length, ncontrols)))
+    Ks = np.random.sample((size, ncontrols, nstates))
+    pIDs = [np.random.randint(i) for i in xrange(1, size)]
+    tail = size - size//10
+
+    start = time.time()
+    for ID, pID in enumerate(pIDs, 1):
+        if ID == tail:
+            tail_start = time.time()
+        tree.add_node(pID, states[ID], (seed_lqr[0], Ks[ID]), x_seq, u_seq)
+    stop = time.time()
+
+    assert tree.size == size
+    return ((size-1) / (stop-start), (size-tail) / (stop-tail_start), tree.nbytes / size)
+
+policy = lambda x: (np.eye(nstates), np.zeros((ncontrols, nstates)))
+
+print("\n{:>10} {:>16} {:>16} {:>14} {:>14}".format("nodes", "nodes/s (all)", "nodes/s (tail)",
+                                                    "bytes/node", "(lazy lqr)"))
+for size in sizes:
+    rate_all, rate_tail, nbytes = grow(size)
+    nbytes_lazy = grow(size, policy)[2]
+    print("{:>10} {:>16.0f} {:>16.0f} {:>14.0f} {:>14.0f}".format(size, rate_all, rate_tail, nbytes, nbytes_lazy))
+print("")
@@ -0,0 +1,371 @@
+"""
+Planning problems shared by the benchmarks.
+
+The boat problem is the one from demos/demo_boat_advanced.py (four
+thrusters, car-like heading control, noised grid of round obstacles)
+without the simulation and plotting. The obstacle noise is seeded so
+that every benchmark plans through the same harbor. None of the system
+functions modify their arguments, so they can be used with pure_callbacks.
+
+State:   [x, y, h, vx, vy, vh]  (m, m, rad, m/s, m/s, rad/s)
+Effort:  [ux, uy, uh]           (N, N, N*m)
+
+"""
+
+################################################# DEPENDENCIES
+
+from __future__ import division
+import numpy as np
+import numpy.linalg as npl
+import lqrrt
+
+################################################# PHYSICAL PARAMETERS
+
+m = 500  # kg
+I = 500  # kg*m^2
+invM = np.array([1/m, 1/m, 1/I])
+
+velmax_pos = np.array([2.5, 1, 0.7])  # (m/s, m/s, rad/s), body-frame forward
+velmax_neg = np.array([-0.8, -1, -0.7])  # (m/s, m/s, rad/s), body-frame backward
+thrust_max = np.array([220, 220, 220, 220])  # N, per thruster
+
+thruster_positions = np.array([[-1.9000,  1.0000, -0.0123],
+                               [-1.9000, -1.0000, -0.0123],
+                               [ 1.6000,  0.6000, -0.0123],
+                               [ 1.6000, -0.6000, -0.0123]])
+thruster_directions = np.array([[ 0.7071,  0.7071,  0.0000],
+                                [ 0.7071, -0.7071,  0.0000],
+                                [ 0.7071, -0.7071,  0.0000],
+                                [ 0.7071,  0.7071,  0.0000]])
+thrust_levers = np.cross(thruster_positions, thruster_directions)
+B = np.concatenate((thruster_directions.T, thrust_levers.T))[[0, 1, 5]]
+invB = npl.pinv(B)
+
+Fx_max = B.dot(thrust_max * [1, 1, 1, 1])[0]
+Fy_max = B.dot(thrust_max * [1, -1, -1, 1])[1]
+Mz_max = B.dot(thrust_max * [-1, 1, -1, 1])[2]
+D_pos = np.abs([Fx_max, Fy_max, Mz_max] / velmax_pos)
+D_neg = np.abs([Fx_max, Fy_max, Mz_max] / velmax_neg)
+
+boat_length = 210 * 0.0254  # m
+boat_width = 96 * 0.0254  # m
+boat_buffer = 0.25  # m
+vps_spacing = 1  # m
+
+vps_grid_x, vps_grid_y = np.mgrid[slice(-(boat_length+boat_buffer)/2, (boat_length+boat_buffer)/2+vps_spacing, vps_spacing),
+                                  slice(-(boat_width+boat_buffer)/2, (boat_width+boat_buffer)/2+vps_spacing, vps_spacing)]
+vps = np.vstack((vps_grid_x.flatten(), vps_grid_y.flatten()))
+
+################################################# DYNAMICS
+
+nstates = 6
+ncontrols = 3
+
+magic_rudder = 4000
+
+def dynamics(x, u, dt):
+    """
+    Returns next state given last state x, wrench u, and timestep dt.
+
+    """
+    R = np.array([
+                  [np.cos(x[2]), -np.sin(x[2]), 0],
+                  [np.sin(x[2]),  np.cos(x[2]), 0],
+                  [           0,             0, 1]
+                ])
+
+    D = np.copy(D_neg)
+    for i, v in enumerate(x[3:]):
+        if v >= 0:
+            D[i] = D_pos[i]
+
+    vw = R[:2, :2].dot(x[3:5])
+    ang = np.arctan2(vw[1], vw[0])
+    c = np.cos(x[2])
+    s = np.sin(x[2])
+    cg = np.cos(ang)
+    sg = np.sin(ang)
+    u = u + [0, 0, magic_rudder*np.arctan2(sg*c - cg*s, cg*c + sg*s)]
+
+    u = B.dot(np.clip(invB.dot(u), -thrust_max, thrust_max))
+
+    xdot = np.concatenate((R.dot(x[3:]), invM*(u - D*x[3:])))
+    xnext = x + xdot*dt
+
+    if x[3] > 0:
+        xnext[5] = np.clip(np.abs(xnext[3]/velmax_pos[0]), 0, 1) * xnext[5]
+    elif x[3] < 0:
+        xnext[5] = np.clip(np.abs(xnext[3]/velmax_neg[0]), 0, 1) * xnext[5]
+    if xnext[3] < 0:
+        xnext[3] = 0
+
+    return xnext
+
+def dynamics_batch(X, U, dt):
+    """
+    Returns the array of next states given an array of
+    last states X, an array of wrenches U, and timestep dt.
+
+    """
+    c = np.cos(X[:, 2])
+    s = np.sin(X[:, 2])
+    V = X[:, 3:]
+
+    D = np.where(V >= 0, D_pos, D_neg)
+
+    ang = np.arctan2(s*V[:, 0] + c*V[:, 1], c*V[:, 0] - s*V[:, 1])
+    cg = np.cos(ang)
+    sg = np.sin(ang)
+    U = U + np.outer(magic_rudder*np.arctan2(sg*c - cg*s, cg*c + sg*s), [0, 0, 1])
+
+    U = np.clip(U.dot(invB.T), -thrust_max, thrust_max).dot(B.T)
+
+    Xdot = np.empty_like(X)
+    Xdot[:, 0] = c*V[:, 0] - s*V[:, 1]
+    Xdot[:, 1] = s*V[:, 0] + c*V[:, 1]
+    Xdot[:, 2] = V[:, 2]
+    Xdot[:, 3:] = invM*(U - D*V)
+    Xnext = X + Xdot*dt
+
+    velmax = np.where(X[:, 3] > 0, velmax_pos[0], velmax_neg[0])
+    turning = X[:, 3] != 0
+    Xnext[turning, 5] = np.clip(np.abs(Xnext[turning, 3]/velmax[turning]), 0, 1) * Xnext[turning, 5]
+    Xnext[Xnext[:, 3] < 0, 3] = 0
+
+    return Xnext
+
+################################################# CONTROL POLICY
+
+kp = np.diag([120, 20, 0])
+kd = np.diag([120, 20, 0])
+S = np.diag([1, 1, 1, 1, 1, 1])
+
+def lqr(x, u):
+    """
+    Returns cost-to-go matrix S and policy matrix K given local state x and effort u.
+
+    """
+    R = np.array([
+                  [np.cos(x[2]), -np.sin(x[2]), 0],
+                  [np.sin(x[2]),  np.cos(x[2]), 0],
+                  [           0,             0, 1]
+                ])
+    K = np.hstack((kp.dot(R.T), kd))
+    return (S, K)
+
+def lqr_batch(X, U):
+    """
+    Returns cost-to-go matrix S and the array of policy matrices K
+    given an array of local states X and an array of efforts U.
+
+    """
+    c = np.cos(X[:, 2])
+    s = np.sin(X[:, 2])
+    K = np.zeros((len(X), ncontrols, nstates))
+    K[:, 0, 0] = kp[0, 0]*c
+    K[:, 0, 1] = kp[0, 0]*s
+    K[:, 1, 0] = -kp[1, 1]*s
+    K[:, 1, 1] = kp[1, 1]*c
+    K[:, 2, 2] = kp[2, 2]
+    K[:, :, 3:] = kd
+    return (S, K)
+
+def erf(xgoal, x):
+    """
+    Returns error e given two states xgoal and x.
+
+    """
+    e = xgoal - x
+    c = np.cos(x[2])
+    s = np.sin(x[2])
+    cg = np.cos(xgoal[2])
+    sg = np.sin(xgoal[2])
+    e[2] = np.arctan2(sg*c - cg*s, cg*c + sg*s)
+    return e
+
+def erf_batch(Xgoal, X):
+    """
+    Returns the array of errors given two arrays of states Xgoal and X.
+
+    """
+    E = Xgoal - X
+    c = np.cos(X[:, 2])
+    s = np.sin(X[:, 2])
+    cg = np.cos(Xgoal[:, 2])
+    sg = np.sin(Xgoal[:, 2])
+    E[:, 2] = np.arctan2(sg*c - cg*s, cg*c + sg*s)
+    return E
+
+################################################# OBJECTIVES
+
+x0 = np.array([0, 0, np.deg2rad(0), 0, 0, 0])
+goal = [40, 40, np.deg2rad(90), 0, 0, 0]
+goal_buffer = [8, 8, np.inf, np.inf, np.inf, np.inf]
+error_tol = np.copy(goal_buffer)/8
+connect_tol = [0.5, 0.5, np.deg2rad(5), 0.1, 0.1, 0.05]
+
+################################################# CONSTRAINTS
+
+# Noised grid of obstacles [x, y, radius], same every run
+obs_noise = np.random.RandomState(0)
+obs_spacing = 12  # m
+obs_range = (5, 60)
+obs_grid_x, obs_grid_y = np.mgrid[slice(obs_range[0], obs_range[1]+obs_spacing, obs_spacing),
+                                  slice(obs_range[0], obs_range[1]+obs_spacing, obs_spacing)]
+obs = []
+for p in zip(obs_grid_x.flatten(), obs_grid_y.flatten()):
+    p = np.round(p + 3*(obs_noise.rand(2)-0.5), 2)
+    if npl.norm(p - goal[:2]) > 2*boat_length and npl.norm(p - x0[:2]) > 2*boat_length:
+        obs.append(np.concatenate((p, [1])))
+obs = np.array(obs)
+
+velmax_pos_plan = np.array([1.1, 0.4, 0.2])  # (m/s, m/s, rad/s), body-frame forward
+velmax_neg_plan = np.array([-0.65, -0.4, -0.2])  # (m/s, m/s, rad/s), body-frame backward
+
+def is_feasible(x, u):
+    for i, v in enumerate(x[3:]):
+        if v > velmax_pos_plan[i] or v < velmax_neg_plan[i]:
+            return False
+    R = np.array([
+                  [np.cos(x[2]), -np.sin(x[2])],
+                  [np.sin(x[2]),  np.cos(x[2])],
+                ])
+    verts = x[:2] + R.dot(vps).T
+    for ob in obs:
+        if np.any(npl.norm(verts - ob[:2], axis=1) <= ob[2]):
+            return False
+    return True
+
+def is_feasible_batch(X, U):
+    feasible = np.all((X[:, 3:] <= velmax_pos_plan) & (X[:, 3:] >= velmax_neg_plan), axis=1)
+    c = np.cos(X[:, 2:3])
+    s = np.sin(X[:, 2:3])
+    verts_x = X[:, 0:1] + (c*vps[0] - s*vps[1])
+    verts_y = X[:, 1:2] + (s*vps[0] + c*vps[1])
+    for ob in obs:
+        feasible &= ~np.any(np.sqrt((verts_x - ob[0])**2 + (verts_y - ob[1])**2) <= ob[2], axis=1)
+    return feasible
+
+################################################# HEURISTICS
+
+sample_space = [(x0[0], goal[0]),
+                (x0[1], goal[1]),
+                (0, 0),
+                (0.9*velmax_pos_plan[0], velmax_pos_plan[0]),
+                (-abs(velmax_neg_plan[1]), velmax_pos_plan[1]),
+                (-abs(velmax_neg_plan[2]), velmax_pos_plan[2])]
+
+goal_bias = [0.2, 0.2, 0, 0, 0, 0]
+
+FPR = 0.9
+
+################################################# PLANNER
+
+def make_planner(**kwargs):
+    """
+    Returns a fresh boat planner. Keyword arguments
+    override the Planner arguments used by the demo.
+
+    """
+    constraints = lqrrt.Constraints(nstates=nstates, ncontrols=ncontrols,
+                                    goal_buffer=goal_buffer, is_feasible=is_feasible,
+                                    is_feasible_batch=is_feasible_batch)
+    settings = dict(horizon=2, dt=0.1, FPR=FPR,
+                    error_tol=error_tol, connect_tol=connect_tol, erf=erf,
+                    dynamics_batch=dynamics_batch, lqr_batch=lqr_batch, erf_batch=erf_batch,
+                    min_time=2, max_time=3, max_nodes=1E5,
+                    goal0=goal, printing=False)
+    settings.update(kwargs)
+    return lqrrt.Planner(dynamics, lqr, constraints, **settings)
+
+################################################# PUCK PROBLEM
+
+# A point mass with bounded acceleration and speed crossing the whole harbor,
+# to a goal on the far side of the obstacle grid. Unlike the boat, its dynamics
+# can be run backward in time exactly, so it also has reverse dynamics and a
+# policy for them (see lqrrt.BidirectionalPlanner).
+#
+# State:   [x, y, vx, vy]  (m, m, m/s, m/s)
+# Effort:  [ax, ay]        (m/s^2, m/s^2)
+
+puck_nstates = 4
+puck_ncontrols = 2
+puck_radius = 1.5  # m
+puck_accmax = 1  # m/s^2
+puck_velmax = 2  # m/s
+
+puck_kp = 1
+puck_kd = 2
+puck_S = np.diag([1, 1, 4, 4])
+
+def puck_dynamics(x, u, dt):
+    """
+    Returns next state given last state x, acceleration u, and timestep dt.
+
+    """
+    u = np.clip(u, -puck_accmax, puck_accmax)
+    vnext = x[2:] + u*dt
+    return np.concatenate((x[:2] + vnext*dt, vnext))
+
+def puck_reverse_dynamics(x, u, dt):
+    """
+    Returns the last state that puck_dynamics takes
+    to state x given acceleration u and timestep dt.
+
+    """
+    u = np.clip(u, -puck_accmax, puck_accmax)
+    return np.concatenate((x[:2] - x[2:]*dt, x[2:] - u*dt))
+
+def puck_lqr(x, u):
+    """
+    Returns cost-to-go matrix S and policy matrix K given local state x and effort u.
+
+    """
+    return (puck_S, np.hstack((puck_kp*np.eye(2), puck_kd*np.eye(2))))
+
+def puck_reverse_lqr(x, u):
+    """
+    Returns cost-to-go matrix S and policy matrix K for steering
+    puck_reverse_dynamics. Running time backward negates the velocity,
+    so the same gains work with the sign of the velocity gain flipped.
+
+    """
+    return (puck_S, np.hstack((puck_kp*np.eye(2), -puck_kd*np.eye(2))))
+
+def puck_is_feasible(x, u):
+    if np.any(np.abs(x[2:]) > puck_velmax):
+        return False
+    return not np.any(npl.norm(obs[:, :2] - x[:2], axis=1) <= obs[:, 2] + puck_radius)
+
+def puck_is_feasible_batch(X, U):
+    feasible = np.all(np.abs(X[:, 2:]) <= puck_velmax, axis=1)
+    dists = np.sqrt(np.sum((X[:, np.newaxis, :2] - obs[:, :2])**2, axis=2))
+    return feasible & ~np.any(dists <= obs[:, 2] + puck_radius, axis=1)
+
+puck_x0 = np.array([0, 0, 0, 0])
+puck_goal = [59, 59, 0, 0]
+puck_goal_buffer = [2, 2, np.inf, np.inf]
+puck_error_tol = [0.5, 0.5, 0.25, 0.25]
+puck_connect_tol = puck_error_tol
+
+puck_sample_space = [(puck_x0[0], puck_goal[0]),
+                     (puck_x0[1], puck_goal[1]),
+                     (-puck_velmax, puck_velmax),
+                     (-puck_velmax, puck_velmax)]
+
+puck_goal_bias = [0.1, 0.1, 0, 0]
+
+def make_puck_planner(**kwargs):
+    """
+    Returns a fresh puck planner. Keyword arguments
+    override the Planner arguments used here.
+
+    """
+    constraints = lqrrt.Constraints(nstates=puck_nstates, ncontrols=puck_ncontrols,
+                                    goal_buffer=puck_goal_buffer, is_feasible=puck_is_feasible,
+                                    is_feasible_batch=puck_is_feasible_batch)
+    settings = dict(horizon=2, dt=0.1, FPR=0.5, error_tol=puck_error_tol, connect_tol=puck_connect_tol,
+                    min_time=0, max_time=2, max_nodes=1E5,
+                    goal0=puck_goal, printing=False)
+    settings.update(kwargs)
+    return lqrrt.Planner(puck_dynamics, puck_lqr, constraints, **settings)
@@ -224,6 +224,19 @@ def is_feasible(x, u):
             return False
     return True
 
+def is_feasible_batch(X, U):
+    # Reject going too fast
+    feasible = np.all((X[:, 3:] <= velmax_pos_plan) & (X[:, 3:] >= velmax_neg_plan), axis=1)
+    # Boat vertices in world frame, one row of them per state
+    c = np.cos(X[:, 2:3])
+    s = np.sin(X[:, 2:3])
+    verts_x = X[:, 0:1] + (c*vps[0] - s*vps[1])
+    verts_y = X[:, 1:2] + (s*vps[0] + c*vps[1])
+    # Check for collisions over all obstacles, for all states at once
+    for ob in obs:
+        feasible &= ~np.any(np.sqrt((verts_x - ob[0])**2 + (verts_y - ob[1])**2) <= ob[2], axis=1)
+    return feasible
+
 ################################################# HEURISTICS
 
 sample_space = [(x0[0], goal[0]),
@@ -240,7 +253,8 @@ FPR = 0.9
 ################################################# PLAN
 
 constraints = lqrrt.Constraints(nstates=nstates, ncontrols=ncontrols,
-                                goal_buffer=goal_buffer, is_feasible=is_feasible)
+                                goal_buffer=goal_buffer, is_feasible=is_feasible,
+                                is_feasible_batch=is_feasible_batch)
 
 planner = lqrrt.Planner(dynamics, lqr, constraints,
                         horizon=2, dt=0.1, FPR=FPR,
@@ -209,6 +209,18 @@ def is_feasible(x, u):
             return False
     return True
 
+def is_feasible_batch(X, U):
+    feasible = np.ones(len(X), dtype=bool)
+    # Boat vertices in world frame, one row of them per state
+    c = np.cos(X[:, 2:3])
+    s = np.sin(X[:, 2:3])
+    verts_x = X[:, 0:1] + (c*vps[0] - s*vps[1])
+    verts_y = X[:, 1:2] + (s*vps[0] + c*vps[1])
+    # Check for collisions over all obstacles, for all states at once
+    for ob in obs:
+        feasible &= ~np.any(np.sqrt((verts_x - ob[0])**2 + (verts_y - ob[1])**2) <= ob[2], axis=1)
+    return feasible
+
 ################################################# HEURISTICS
 
 sample_space = [(x0[0], goal[0]),
@@ -223,7 +235,8 @@ goal_bias = [0.2, 0.2, 0, 0, 0, 0]
 ################################################# PLAN
 
 constraints = lqrrt.Constraints(nstates=nstates, ncontrols=ncontrols,
-                                goal_buffer=goal_buffer, is_feasible=is_feasible)
+                                goal_buffer=goal_buffer, is_feasible=is_feasible,
+                                is_feasible_batch=is_feasible_batch)
 
 planner = lqrrt.Planner(dynamics, lqr, constraints,
                         horizon=2, dt=0.1, FPR=0.5,
@@ -163,6 +163,12 @@ def is_feasible(x, u):
             return False
     return True
 
+def is_feasible_batch(X, U):
+    feasible = np.ones(len(X), dtype=bool)
+    for ob in obs:
+        feasible &= np.sqrt((X[:, 0] - ob[0])**2 + (X[:, 1] - ob[1])**2) > boat_length/2 + ob[2]
+    return feasible
+
 ################################################# HEURISTICS
 
 sample_space = [(x0[0], goal[0]),
@@ -177,7 +183,8 @@ goal_bias = [0.5, 0.5, 0, 0, 0, 0]
 ################################################# PLAN
 
 constraints = lqrrt.Constraints(nstates=nstates, ncontrols=ncontrols,
-                                goal_buffer=goal_buffer, is_feasible=is_feasible)
+                                goal_buffer=goal_buffer, is_feasible=is_feasible,
+                                is_feasible_batch=is_feasible_batch)
 
 planner = lqrrt.Planner(dynamics, lqr, constraints,
                         horizon=2, dt=0.1, FPR=0.5,
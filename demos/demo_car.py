@@ -179,6 +179,20 @@ def is_feasible(x, u):
             return False
     return True
 
+def is_feasible_batch(X, U):
+    feasible = np.ones(len(X), dtype=bool)
+    # Boat vertices in world frame, one row of them per state
+    c = np.cos(X[:, 2:3])
+    s = np.sin(X[:, 2:3])
+    verts_x = X[:, 0:1] + (c*vps[0] - s*vps[1])
+    verts_y = X[:, 1:2] + (s*vps[0] + c*vps[1])
+    verts_x = np.hstack((verts_x, 2*X[:, 0:1]))
+    verts_y = np.hstack((verts_y, 2*X[:, 1:2]))
+    # Check for collisions over all obstacles, for all states at once
+    for ob in obs:
+        feasible &= ~np.any(np.sqrt((verts_x - ob[0])**2 + (verts_y - ob[1])**2) <= ob[2], axis=1)
+    return feasible
+
 ################################################# HEURISTICS
 
 buff = 40
@@ -195,7 +209,8 @@ xrand_gen = None
 ################################################# PLAN
 
 constraints = lqrrt.Constraints(nstates=nstates, ncontrols=ncontrols,
-                                goal_buffer=goal_buffer, is_feasible=is_feasible)
+                                goal_buffer=goal_buffer, is_feasible=is_feasible,
+                                is_feasible_batch=is_feasible_batch)
 
 planner = lqrrt.Planner(dynamics, lqr, constraints,
                         horizon=5, dt=0.1,
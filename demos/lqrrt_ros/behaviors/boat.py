@@ -56,6 +56,47 @@ def dynamics(x, u, dt):
 
     return xnext
 
+def dynamics_batch(X, U, dt):
+    """
+    Returns the array of next states given an array of last
+    states X, an array of wrenches U, and timestep dt.
+    Each row is what dynamics would return for that row.
+
+    """
+    # Orientations and body-frame velocities
+    c = np.cos(X[:, 2])
+    s = np.sin(X[:, 2])
+    V = X[:, 3:]
+
+    # Construct drag coefficients based on our motion signs
+    D = np.where(V >= 0, D_pos, D_neg)
+
+    # Heading controller for staring at some focus point
+    if focus is not None:
+        vec = focus[:2] - X[:, :2]
+        ang = np.arctan2(vec[:, 1], vec[:, 0])
+        cg = np.cos(ang)
+        sg = np.sin(ang)
+        U[:, 2] = magic_rudder*np.arctan2(sg*c - cg*s, cg*c + sg*s)
+
+    # Actuator saturation with even downscaling
+    thrusts = U.dot(invB.T)
+    ratios = np.min(thrust_max / np.clip(np.abs(thrusts), 1E-6, np.inf), axis=1)
+    saturated = ratios < 1
+    U[saturated] = (ratios[saturated, np.newaxis] * thrusts[saturated]).dot(B.T)
+
+    # M*vdot + D*v = u  and  pdot = R*v
+    Xdot = np.empty_like(X)
+    Xdot[:, 0] = c*V[:, 0] - s*V[:, 1]
+    Xdot[:, 1] = s*V[:, 0] + c*V[:, 1]
+    Xdot[:, 2] = V[:, 2]
+    Xdot[:, 3:] = invM*(U - D*V)
+
+    # First-order integrate
+    Xnext = X + Xdot*dt
+
+    return Xnext
+
 ################################################# POLICY
 
 kp = np.diag([250, 250, 2000])
@@ -75,6 +116,23 @@ def lqr(x, u):
     K = np.hstack((kp.dot(R.T), kd))
     return (S, K)
 
+def lqr_batch(X, U):
+    """
+    Returns cost-to-go matrix S and the array of policy matrices K
+    given an array of local states X and an array of efforts U.
+
+    """
+    c = np.cos(X[:, 2])
+    s = np.sin(X[:, 2])
+    K = np.zeros((len(X), ncontrols, nstates))
+    K[:, 0, 0] = kp[0, 0]*c
+    K[:, 0, 1] = kp[0, 0]*s
+    K[:, 1, 0] = -kp[1, 1]*s
+    K[:, 1, 1] = kp[1, 1]*c
+    K[:, 2, 2] = kp[2, 2]
+    K[:, :, 3:] = kd
+    return (S, K)
+
 ################################################# HEURISTICS
 
 goal_buffer = [real_tol[0], real_tol[1], real_tol[2], np.inf, np.inf, real_tol[5]]
@@ -95,11 +153,14 @@ def gen_ss(seed, goal, buff=[ss_start]*4):
 ################################################# MAIN ATTRIBUTES
 
 constraints = lqrrt.Constraints(nstates=nstates, ncontrols=ncontrols,
-                                goal_buffer=goal_buffer, is_feasible=unset)
+                                goal_buffer=goal_buffer, is_feasible=unset,
+                                periods=periods)
 
 planner = lqrrt.Planner(dynamics, lqr, constraints,
                         horizon=horizon, dt=dt,
                         FPR=FPR, CPF=CPF,
                         error_tol=error_tol, erf=unset,
                         min_time=basic_duration, max_time=basic_duration, max_nodes=max_nodes,
-                        sys_time=unset, printing=False)
+                        sys_time=unset, printing=False, lazy_lqr=True, nn_method='kdtree',
+                        batch_size=batch_size, dynamics_batch=dynamics_batch, lqr_batch=lqr_batch,
+                        max_speed=npl.norm(velmax_pos[:2]))
@@ -58,6 +58,46 @@ def dynamics(x, u, dt):
 
     return xnext
 
+def dynamics_batch(X, U, dt):
+    """
+    Returns the array of next states given an array of last
+    states X, an array of wrenches U, and timestep dt.
+    Each row is what dynamics would return for that row.
+
+    """
+    # Orientations and body-frame velocities
+    c = np.cos(X[:, 2])
+    s = np.sin(X[:, 2])
+    V = X[:, 3:]
+
+    # Construct drag coefficients based on our motion signs
+    D = np.where(V >= 0, D_pos, D_neg)
+
+    # Heading controller trying to keep us car-like
+    ang = np.arctan2(s*V[:, 0] + c*V[:, 1], c*V[:, 0] - s*V[:, 1])
+    cg = np.cos(ang)
+    sg = np.sin(ang)
+    U[:, 2] = magic_rudder*np.arctan2(sg*c - cg*s, cg*c + sg*s)
+
+    # Actuator saturation
+    U = np.clip(U.dot(invB.T), -thrust_max, thrust_max).dot(B.T)
+
+    # M*vdot + D*v = u  and  pdot = R*v
+    Xdot = np.empty_like(X)
+    Xdot[:, 0] = c*V[:, 0] - s*V[:, 1]
+    Xdot[:, 1] = s*V[:, 0] + c*V[:, 1]
+    Xdot[:, 2] = V[:, 2]
+    Xdot[:, 3:] = invM*(U - D*V)
+
+    # First-order integrate
+    Xnext = X + Xdot*dt
+
+    # Impose not driving backwards
+    backwards = Xnext[:, 3] < 0
+    Xnext[backwards, 3] = np.abs(X[backwards, 3])
+
+    return Xnext
+
 ################################################# POLICY
 
 kp = np.diag([150, 150, 0])
@@ -77,6 +117,23 @@ def lqr(x, u):
     K = np.hstack((kp.dot(R.T), kd))
     return (S, K)
 
+def lqr_batch(X, U):
+    """
+    Returns cost-to-go matrix S and the array of policy matrices K
+    given an array of local states X and an array of efforts U.
+
+    """
+    c = np.cos(X[:, 2])
+    s = np.sin(X[:, 2])
+    K = np.zeros((len(X), ncontrols, nstates))
+    K[:, 0, 0] = kp[0, 0]*c
+    K[:, 0, 1] = kp[0, 0]*s
+    K[:, 1, 0] = -kp[1, 1]*s
+    K[:, 1, 1] = kp[1, 1]*c
+    K[:, 2, 2] = kp[2, 2]
+    K[:, :, 3:] = kd
+    return (S, K)
+
 ################################################# HEURISTICS
 
 goal_buffer = [0.5*free_radius, 0.5*free_radius, np.inf, np.inf, np.inf, np.inf]
@@ -97,11 +154,14 @@ def gen_ss(seed, goal, buff=[ss_start]*4):
 ################################################# MAIN ATTRIBUTES
 
 constraints = lqrrt.Constraints(nstates=nstates, ncontrols=ncontrols,
-                                goal_buffer=goal_buffer, is_feasible=unset)
+                                goal_buffer=goal_buffer, is_feasible=unset,
+                                periods=periods)
 
 planner = lqrrt.Planner(dynamics, lqr, constraints,
                         horizon=horizon, dt=dt,
                         FPR=FPR, CPF=CPF,
                         error_tol=error_tol, erf=unset,
                         min_time=basic_duration, max_time=basic_duration, max_nodes=max_nodes,
-                        sys_time=unset, printing=False)
+                        sys_time=unset, printing=False, lazy_lqr=True, nn_method='kdtree',
+                        batch_size=batch_size, dynamics_batch=dynamics_batch, lqr_batch=lqr_batch,
+                        max_speed=npl.norm(velmax_pos[:2]))
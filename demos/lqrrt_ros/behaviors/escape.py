@@ -43,6 +43,39 @@ def dynamics(x, u, dt):
 
     return xnext
 
+def dynamics_batch(X, U, dt):
+    """
+    Returns the array of next states given an array of last
+    states X, an array of wrenches U, and timestep dt.
+    Each row is what dynamics would return for that row.
+
+    """
+    # Orientations and body-frame velocities
+    c = np.cos(X[:, 2])
+    s = np.sin(X[:, 2])
+    V = X[:, 3:]
+
+    # Construct drag coefficients based on our motion signs
+    D = np.where(V >= 0, D_pos, D_neg)
+
+    # Actuator saturation with even downscaling
+    thrusts = U.dot(invB.T)
+    ratios = np.min(thrust_max / np.clip(np.abs(thrusts), 1E-6, np.inf), axis=1)
+    saturated = ratios < 1
+    U[saturated] = (ratios[saturated, np.newaxis] * thrusts[saturated]).dot(B.T)
+
+    # M*vdot + D*v = u  and  pdot = R*v
+    Xdot = np.empty_like(X)
+    Xdot[:, 0] = c*V[:, 0] - s*V[:, 1]
+    Xdot[:, 1] = s*V[:, 0] + c*V[:, 1]
+    Xdot[:, 2] = V[:, 2]
+    Xdot[:, 3:] = invM*(U - D*V)
+
+    # First-order integrate
+    Xnext = X + Xdot*dt
+
+    return Xnext
+
 ################################################# POLICY
 
 kp = np.diag([150, 150, 2000])
@@ -62,6 +95,23 @@ def lqr(x, u):
     K = np.hstack((kp.dot(R.T), kd))
     return (S, K)
 
+def lqr_batch(X, U):
+    """
+    Returns cost-to-go matrix S and the array of policy matrices K
+    given an array of local states X and an array of efforts U.
+
+    """
+    c = np.cos(X[:, 2])
+    s = np.sin(X[:, 2])
+    K = np.zeros((len(X), ncontrols, nstates))
+    K[:, 0, 0] = kp[0, 0]*c
+    K[:, 0, 1] = kp[0, 0]*s
+    K[:, 1, 0] = -kp[1, 1]*s
+    K[:, 1, 1] = kp[1, 1]*c
+    K[:, 2, 2] = kp[2, 2]
+    K[:, :, 3:] = kd
+    return (S, K)
+
 ################################################# HEURISTICS
 
 goal_buffer = [free_radius, free_radius, np.inf, np.inf, np.inf, np.inf]
@@ -82,11 +132,13 @@ def gen_ss(seed, goal, buff=40):
 ################################################# MAIN ATTRIBUTES
 
 constraints = lqrrt.Constraints(nstates=nstates, ncontrols=ncontrols,
-                                goal_buffer=goal_buffer, is_feasible=unset)
+                                goal_buffer=goal_buffer, is_feasible=unset,
+                                periods=periods)
 
 planner = lqrrt.Planner(dynamics, lqr, constraints,
                         horizon=horizon, dt=dt,
                         FPR=FPR, CPF=CPF,
                         error_tol=error_tol, erf=unset,
                         min_time=0, max_time=5, max_nodes=max_nodes,
-                        sys_time=unset, printing=False)
+                        sys_time=unset, printing=False, lazy_lqr=True, nn_method='kdtree',
+                        batch_size=batch_size, dynamics_batch=dynamics_batch, lqr_batch=lqr_batch)
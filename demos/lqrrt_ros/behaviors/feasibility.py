@@ -0,0 +1,68 @@
+"""
+Feasibility functions that check the boat against the occupancy grid
+in shared memory, so planners in other processes can use them too.
+
+Set grid to a SharedGrid (and threshold to the occupancy threshold)
+before starting any processes, like the workers of a ParallelPlanner.
+Every check reads the newest grid, and checks again if that grid
+started being overwritten meanwhile. Anywhere is feasible before the
+first grid is written, but nowhere is while the grid is withdrawn.
+
+"""
+from __future__ import division
+import numpy as np
+
+import params
+
+################################################# SHARED GRID
+
+grid = None
+threshold = 90
+
+################################################# FEASIBILITY
+
+def is_feasible(x, u):
+    """
+    Given a state x and effort u, returns a bool
+    that is only True if that (x, u) is feasible.
+
+    """
+    return is_feasible_batch(np.array([x]), np.array([u]))[0]
+
+def is_feasible_batch(X, U):
+    """
+    Given an array of states X and an array of efforts U, returns
+    a bool array that is only True where that (X[i], U[i]) is feasible.
+    The vehicle points of every state are checked in one go.
+
+    """
+    while True:
+        ogrid, origin, cpm, version = grid.read()
+
+        # If there's no ogrid yet, anywhere is valid, but if the newest one is missing, nowhere is
+        if ogrid is None:
+            if version:
+                return np.zeros(len(X), dtype=bool)
+            return np.ones(len(X), dtype=bool)
+
+        # Vehicle points in world frame, one row of them per state
+        c, s = np.cos(X[:, 2:3]), np.sin(X[:, 2:3])
+        points_x = X[:, 0:1] + (c*params.vps[0] - s*params.vps[1])
+        points_y = X[:, 1:2] + (s*params.vps[0] + c*params.vps[1])
+
+        # Grid indicies, where any state with a point off the grid is infeasible
+        cols = (cpm * (points_x - origin[0])).astype(np.int64)
+        rows = (cpm * (points_y - origin[1])).astype(np.int64)
+        nrows, ncols = ogrid.shape
+        on_grid = np.all((rows < nrows) & (rows >= -nrows) & (cols < ncols) & (cols >= -ncols), axis=1)
+        if not np.all(on_grid):
+            print("WOAH NELLY! Search exceeded ogrid size.")
+            rows, cols = rows[on_grid], cols[on_grid]
+
+        # Greater than threshold is a hit
+        feasible = np.zeros(len(X), dtype=bool)
+        feasible[on_grid] = np.all(ogrid[rows, cols] < threshold, axis=1)
+
+        # Only good if the grid wasn't overwritten while checking
+        if grid.is_intact(version):
+            return feasible
@@ -9,6 +9,7 @@ import numpy as np
 
 nstates = 6
 ncontrols = 3
+periods = [0, 0, 2*np.pi, 0, 0, 0]  # heading wraps around
 
 ################################################# BEHAVIOR CONTROL
 
@@ -28,6 +29,7 @@ CPF = 2
 ss_start = 10  # m
 ss_step = 5  # m
 max_nodes = 1E5
+batch_size = 8  # samples per growth step
 
 ################################################# INERTIA
 
@@ -86,6 +88,11 @@ for i in range(len(vps)):
     vps[i] = [vps_grid_x[i], vps_grid_y[i]]
 vps = vps.T
 
+################################################# OCCUPANCY GRID
+
+# Largest ogrid that can be shared with planners in other processes
+ogrid_max_shape = (1000, 1000)  # (rows, cols)
+
 ################################################# MISC
 
 def unset(*args):
@@ -10,6 +10,7 @@ for moving the reference to some goal (Move.action).
 
 """
 from __future__ import division
+import threading
 import numpy as np
 import numpy.linalg as npl
 import cv2  # for occupancy grid analysis
@@ -22,7 +23,8 @@ from nav_msgs.msg import Odometry, OccupancyGrid
 from geometry_msgs.msg import Point32, PointStamped, Pose, PoseArray, \
                               PoseStamped, WrenchStamped, PolygonStamped
 
-from behaviors import params, car, boat, escape
+import lqrrt
+from behaviors import params, car, boat, escape, feasibility
 from lqrrt_ros.msg import MoveAction, MoveFeedback, MoveResult
 
 # Check scipy version for assume_sorted argument in interp1d
@@ -49,9 +51,12 @@ class LQRRT_Node(object):
         self.revisit_period = 0.05  # s
         self.ogrid = None
         self.ogrid_threshold = float(ogrid_threshold)
+        self.sampler = None
         self.state = None
         self.tracking = None
-        self.busy = False
+        self.update = None
+        self.chained = threading.Event()
+        self.chained.set()
         self.done = True
 
         # Lil helpers
@@ -59,12 +64,19 @@ class LQRRT_Node(object):
         self.intup = lambda arr: tuple(np.array(arr, dtype=np.int64))
         self.get_hood = lambda img, row, col: img[row-1:row+2, col-1:col+2]
 
+        # Feasibility reads the ogrid from shared memory, so planners in other processes can too
+        self.shared_ogrid = lqrrt.SharedGrid(params.ogrid_max_shape)
+        feasibility.grid = self.shared_ogrid
+        feasibility.threshold = self.ogrid_threshold
+        self.is_feasible = feasibility.is_feasible
+        self.is_feasible_batch = feasibility.is_feasible_batch
+
         # Set-up planners
         self.behaviors_list = [car, boat, escape]
         for behavior in self.behaviors_list:
-            behavior.planner.set_system(erf=self.erf)
+            behavior.planner.set_system(erf=self.erf, erf_batch=self.erf_batch)
             behavior.planner.set_runtime(sys_time=self.rostime)
-            behavior.planner.constraints.set_feasibility_function(self.is_feasible)
+            behavior.planner.constraints.set_feasibility_function(self.is_feasible, self.is_feasible_batch)
 
         # Initialize resetable stuff
         self.reset()
@@ -248,21 +260,11 @@ class LQRRT_Node(object):
         # (debug)
         assert self.next_seed is not None
         assert self.next_runtime is not None
-        move_number = 0
+        self.move_number = 0
 
-        # Begin tree-chaining loop
+        # Begin tree-chaining loop, where each move is planned on a worker thread while the last is followed
         while not rospy.is_shutdown():
-            clean_update = self.tree_chain()
-            move_number += 1
-
-            # Print feedback
-            if clean_update and not self.stuck and not self.preempted:
-                print("\nMove {}\n----".format(move_number))
-                print("Behavior: {}".format(self.enroute_behavior.__name__[10:]))
-                print("Reached goal region: {}".format(self.enroute_behavior.planner.plan_reached_goal))
-                print("Goal bias: {}".format(np.round(self.goal_bias, 2)))
-                print("Tree size: {}".format(self.tree.size))
-                print("Move duration: {}".format(np.round(self.next_runtime, 1)))
+            self.tree_chain()
 
             # Check if action goal is complete
             if np.all(np.abs(self.erf(self.goal, self.state)) <= params.real_tol):
@@ -270,12 +272,16 @@ class LQRRT_Node(object):
 
             # Check for abrupt termination
             if self.preempted:
+                self.stop_chain()
                 print("\nTerminated.")
                 self.move_server.set_preempted()
                 self.done = True
                 return False
 
+            rospy.sleep(self.revisit_period)
+
         # Over and out!
+        self.stop_chain()
         remain = np.copy(self.goal)
         self.get_ref = lambda t: remain
         self.get_eff = lambda t: np.zeros(3)
@@ -288,16 +294,15 @@ class LQRRT_Node(object):
 
     def tree_chain(self):
         """
-        Plans an lqRRT and sets things up to chain along
-        another lqRRT when called again.
+        Starts planning an lqRRT on a worker thread and returns right away.
+        When it finishes, cash_in sets things up to chain along another
+        lqRRT when called again. Does nothing while one is still planning.
 
         """
         # Make sure we are not currently in an update
-        if self.busy:
+        if not self.chained.is_set():
             return
-
-        # Thread locking, lol
-        self.busy = True
+        self.chained.clear()
 
         # No issue
         if self.time_till_issue is None:
@@ -329,12 +334,40 @@ class LQRRT_Node(object):
         if self.stuck and self.time_till_issue is None:
             assert self.next_runtime is None
 
-        # Update plan
-        clean_update = self.behavior.planner.update_plan(x0=self.next_seed,
-                                                         sample_space=self.sample_space,
-                                                         goal_bias=self.goal_bias,
-                                                         guide=self.guide,
-                                                         specific_time=self.next_runtime)
+        # Draw sample positions from the free cells of the ogrid
+        if self.sampler is None:
+            self.sampler = lqrrt.GridSampler(self.sample_space, self.goal_bias, self.behavior.planner.constraints)
+            if self.ogrid is not None:
+                self.sampler.set_grid(self.ogrid_free, self.ogrid_origin, self.ogrid_cpm)
+        else:
+            self.sampler.set_space(self.sample_space, self.goal_bias, self.behavior.planner.constraints)
+
+        # Update plan on a worker thread, while the timers keep publishing the current one
+        try:
+            self.update = self.behavior.planner.update_plan_async(x0=self.next_seed,
+                                                                  sample_space=self.sample_space,
+                                                                  goal_bias=self.goal_bias,
+                                                                  guide=self.guide,
+                                                                  xrand_gen=self.sampler,
+                                                                  specific_time=self.next_runtime)
+        except Exception:
+            self.chained.set()
+            raise
+        self.update.add_done_callback(self.cash_in)
+
+
+    def cash_in(self, update):
+        """
+        Done callback of the update started by tree_chain, which
+        takes on its plan (if it finished properly) for the next
+        tree_chain to chain along.
+
+        """
+        try:
+            clean_update = update.result()
+        except Exception as error:
+            print("Update failed: {}".format(error))
+            clean_update = False
 
         # Update finished properly
         if clean_update:
@@ -360,8 +393,7 @@ class LQRRT_Node(object):
             self.u_seq = np.copy(self.behavior.planner.u_seq)
             self.tree = self.behavior.planner.tree
             self.last_update_time = self.rostime()
-            self.get_ref = self.behavior.planner.get_state
-            self.get_eff = self.behavior.planner.get_effort
+            self.get_ref, self.get_eff = self.behavior.planner.interpolators
             self.next_runtime = self.behavior.planner.T
             if self.next_runtime > params.basic_duration:
                 self.next_runtime *= params.fudge_factor
@@ -374,17 +406,34 @@ class LQRRT_Node(object):
             self.publish_path()
             self.publish_expl()
 
+            # Print feedback
+            self.move_number += 1
+            if not self.stuck and not self.preempted:
+                print("\nMove {}\n----".format(self.move_number))
+                print("Behavior: {}".format(self.enroute_behavior.__name__[10:]))
+                print("Reached goal region: {}".format(self.enroute_behavior.planner.plan_reached_goal))
+                print("Goal bias: {}".format(np.round(self.goal_bias, 2)))
+                print("Tree size: {}".format(self.tree.size))
+                print("Move duration: {}".format(np.round(self.next_runtime, 1)))
+
         else:
             print("Update cancelled.")
 
         # Make sure all planners are actually unkilled
         for behavior in self.behaviors_list:
             behavior.planner.unkill()
+        self.chained.set()
 
-        # Unlocking, lol
-        self.busy = False
 
-        return clean_update
+    def stop_chain(self):
+        """
+        Cancels the update that tree_chain started, if it is still
+        planning, and waits until cash_in is done with it.
+
+        """
+        if self.update is not None:
+            self.update.cancel()
+        self.chained.wait()
 
 ################################################# DECISIONS
 
@@ -586,36 +635,6 @@ class LQRRT_Node(object):
 
 ################################################# VERIFICATIONS
 
-    def is_feasible(self, x, u):
-        """
-        Given a state x and effort u, returns a bool
-        that is only True if that (x, u) is feasible.
-
-        """
-        # If there's no ogrid yet, anywhere is valid
-        if self.ogrid is None:
-            return True
-
-        # Body to world
-        c, s = np.cos(x[2]), np.sin(x[2])
-        R = np.array([[c, -s],
-                      [s,  c]])
-
-        # Vehicle points in world frame
-        points = x[:2] + R.dot(params.vps).T
-
-        # Check for collision
-        indicies = (self.ogrid_cpm * (points - self.ogrid_origin)).astype(np.int64)
-        try:
-            grid_values = self.ogrid[indicies[:, 1], indicies[:, 0]]
-        except IndexError:
-            print("WOAH NELLY! Search exceeded ogrid size.")
-            return False
-
-        # Greater than threshold is a hit
-        return np.all(grid_values < self.ogrid_threshold)
-
-
     def reevaluate_plan(self):
         """
         Iterates through the current plan re-checking for
@@ -647,10 +666,9 @@ class LQRRT_Node(object):
             yline = np.linspace(self.goal[1], start[1], npoints)
             hline = [np.arctan2(p_err[1], p_err[0])] * npoints
             sline = np.vstack((xline, yline, hline, np.zeros((3, npoints)))).T
-            for x in sline:
-                if self.is_feasible(x, np.zeros(3)):
-                    self.set_goal(x)
-                    break
+            checks = self.is_feasible_batch(sline, np.zeros((len(sline), 3)))
+            if np.any(checks):
+                self.set_goal(sline[np.argmax(checks)])
             for behavior in self.behaviors_list:
                 behavior.planner.kill_update()
             return
@@ -659,13 +677,13 @@ class LQRRT_Node(object):
         p_seq = np.copy(self.x_seq[iters_passed:])
         if len(p_seq):
             p_seq[:, 3:] = 0
-            for i, (x, u) in enumerate(zip(p_seq, [np.zeros(3)]*len(p_seq))):
-                if not self.is_feasible(x, u):
-                    self.time_till_issue = i*params.dt
-                    for behavior in self.behaviors_list:
-                        behavior.planner.kill_update()
-                    print("\nFound collision on current path!\nTime till collision: {}".format(self.time_till_issue))
-                    return
+            checks = self.is_feasible_batch(p_seq, np.zeros((len(p_seq), 3)))
+            if not np.all(checks):
+                self.time_till_issue = np.argmin(checks)*params.dt
+                for behavior in self.behaviors_list:
+                    behavior.planner.kill_update()
+                print("\nFound collision on current path!\nTime till collision: {}".format(self.time_till_issue))
+                return
 
         # If we are escaping, check if we have a clear path again
         if self.enroute_behavior is escape:
@@ -676,9 +694,7 @@ class LQRRT_Node(object):
             yline = np.linspace(start[1], self.goal[1], npoints)
             hline = [np.arctan2(p_err[1], p_err[0])] * npoints
             sline = np.vstack((xline, yline, hline, np.zeros((3, npoints)))).T
-            checks = []
-            for x in sline:
-                checks.append(self.is_feasible(x, np.zeros(3)))
+            checks = self.is_feasible_batch(sline, np.zeros((len(sline), 3)))
             if np.all(checks):
                 self.time_till_issue = np.inf
                 self.move_type = 'drive'
@@ -701,13 +717,14 @@ class LQRRT_Node(object):
         if self.preempted or not self.move_server.is_active():
             return
 
-        if self.move_server.is_preempt_requested() or (rospy.is_shutdown() and self.busy):
+        updating = self.update is not None and not self.update.done()
+        if self.move_server.is_preempt_requested() or (rospy.is_shutdown() and updating):
             self.preempted = True
             print("\nAction preempted!")
             if self.behavior is not None:
-                print("Killing planners.")
-                for behavior in self.behaviors_list:
-                    behavior.planner.kill_update()
+                print("Cancelling update.")
+                if self.update is not None:
+                    self.update.cancel()
                 while not self.done:
                     rospy.sleep(0.1)
             print("\n")
@@ -736,30 +753,36 @@ class LQRRT_Node(object):
         x = np.array(x, dtype=np.float64)
         xg = np.copy(x); xg[2] = h
         x_seq = []; u_seq = []
-        T = 0; i = 0
         u = np.zeros(3)
 
         # Simulate rotation move
-        while not rospy.is_shutdown():
+        while True:
+            if rospy.is_shutdown():
+                return
 
-            # Stop if pose is infeasible
-            if not self.is_feasible(np.concatenate((x[:3], np.zeros(3))), np.zeros(3)) and len(x_seq):
-                portion = params.FPR*len(x_seq)
-                return (x_seq[:int(portion)], T-portion*dt, False, u_seq[:int(portion)])
-            else:
-                x_seq.append(x)
-                u_seq.append(u)
+            x_seq.append(x)
+            u_seq.append(u)
 
             # Keep rotating towards goal until tolerance is met
             e = self.erf(xg, x)
             if abs(e[2]) <= tol:
-                return (x_seq, T, True, u_seq)
+                break
 
             # Step
             u = 3*boat.lqr(x, u)[1].dot(e)
             x = boat.dynamics(x, u, dt)
-            T += dt
-            i += 1
+
+        # Check all the poses at once (not the starting one),
+        # stopping where the move first becomes infeasible
+        poses = np.zeros((len(x_seq), 6))
+        poses[:, :3] = np.array(x_seq)[:, :3]
+        checks = self.is_feasible_batch(poses, np.zeros((len(poses), 3)))
+        checks[0] = True
+        if not np.all(checks):
+            i = np.argmin(checks)
+            portion = params.FPR*i
+            return (x_seq[:int(portion)], (i-portion)*dt, False, u_seq[:int(portion)])
+        return (x_seq, (len(x_seq)-1)*dt, True, u_seq)
 
 
     def circle_move(self):
@@ -781,6 +804,17 @@ class LQRRT_Node(object):
         return e
 
 
+    def erf_batch(self, Xgoal, X):
+        """
+        Returns the array of errors between each row of the
+        arrays of states Xgoal and X, like erf does for one pair.
+
+        """
+        E = np.subtract(Xgoal, X)
+        E[:, 2] = self.angle_diff(Xgoal[:, 2], X[:, 2])
+        return E
+
+
     def angle_diff(self, agoal, a):
         """
         Takes an angle difference properly on SO2.
@@ -955,12 +989,29 @@ class LQRRT_Node(object):
         """
         Expects an OccupancyGrid message.
         Stores the ogrid array and origin vector.
+        Gives the sampler the free space, dilated by the boat width.
+        Writes it to shared memory for the feasibility checks.
         Reevaluates the current plan since the ogrid changed.
 
         """
         self.ogrid = np.array(msg.data).reshape((msg.info.height, msg.info.width))
         self.ogrid_origin = np.array([msg.info.origin.position.x, msg.info.origin.position.y])
         self.ogrid_cpm = 1 / msg.info.resolution
+
+        # Feasibility checks only see ogrids that fit in params.ogrid_max_shape, and fail everything otherwise
+        try:
+            self.shared_ogrid.write(self.ogrid, self.ogrid_origin, self.ogrid_cpm)
+        except ValueError:
+            self.shared_ogrid.withdraw()
+            print("Ogrid is bigger than params.ogrid_max_shape, so every state is infeasible until one fits!")
+
+        # Free cells for sampling, dilated like in select_exploration
+        occ_img = 255*np.greater(self.ogrid, self.ogrid_threshold).astype(np.uint8)
+        boat_pix = int(self.ogrid_cpm*params.boat_width)
+        boat_pix += boat_pix%2
+        self.ogrid_free = cv2.dilate(occ_img, np.ones((boat_pix, boat_pix), np.uint8)) == 0
+        if self.sampler is not None:
+            self.sampler.set_grid(self.ogrid_free, self.ogrid_origin, self.ogrid_cpm)
         self.reevaluate_plan()
 
 
@@ -1,2 +1,6 @@
 from constraints import Constraints
-from planner import Planner
+from planner import Planner, PlanFuture
+from samplers import RejectionSampler, GridSampler, HaltonSampler
+from parallel import ParallelPlanner
+from shared import SharedGrid
+from bidirectional import BidirectionalPlanner
@@ -0,0 +1,206 @@
+"""
+Class for planning with a forward lqRRT from the seed and a backward lqRRT from the goal.
+
+The forward tree grows from the seed state with the planner's own dynamics,
+as usual. The backward tree grows from the goal state with dynamics that run
+time backward (supplied by the user), so each of its paths, read in reverse,
+is a path that arrives at the goal. Both trees take turns growing, and every
+so often the newest nodes of each tree are paired with their nearest nodes in
+the other tree, and the forward planner tries steering across the closest
+pairs. When a connection works, the backward path beyond it is grafted onto
+the forward tree, reversed, so that the forward tree then reaches the goal
+and the forward planner treats it like any other plan that did (bounding,
+lazy checks, and all).
+
+A connection counts when steering gets within the planner's connect_tol of
+the backward node. The grafted path is then re-simulated forward from where
+the steering actually ended, with the backward path's efforts, so the plan
+is exactly what the dynamics do all the way through (the same way rewired
+subtrees are). If that strays into anything infeasible, the connection is
+dropped.
+
+"""
+
+################################################# DEPENDENCIES
+
+from __future__ import division
+import copy
+
+import numpy as np
+
+################################################# PRIMARY CLASS
+
+class BidirectionalPlanner(object):
+    """
+    To initialize, provide...
+
+    planner: The Planner instance that grows the forward tree. Its settings
+             are used for both trees, and the plan is committed to it, so its
+             get_state(t), get_effort(t), x_seq, u_seq, T, plan_reached_goal,
+             and tree are used just as if it had planned alone.
+
+    reverse_dynamics: Function that returns the previous state given the
+                      current state x, the effort u, and timestep dt. That
+                      is, dynamics(reverse_dynamics(x, u, dt), u, dt) = x.
+
+    reverse_lqr: Function like the planner's lqr, but whose policy steers
+                 reverse_dynamics toward a target state as time runs backward.
+                 It must use the same cost-to-go matrix S as the planner's lqr.
+
+    reverse_dynamics_batch, reverse_lqr_batch: Optional batched versions
+                                               of the two (see Planner).
+                                               Both must be given to be used.
+
+    connect_every: Number of planning iterations between connection attempts.
+                   Defaults to 10.
+
+    connect_tries: Number of the closest cross-tree pairs that are steered
+                   across at each attempt. Defaults to 4.
+
+    The backward tree is grown by the Planner kept as self.backward, which is
+    a copy of the given planner with the reverse functions, its own seed, and
+    no bounding or informed sampling. Its tree is in self.backward.tree.
+    The number of connections made in the last update is kept in nconnections.
+
+    """
+    def __init__(self, planner, reverse_dynamics, reverse_lqr,
+                 reverse_dynamics_batch=None, reverse_lqr_batch=None,
+                 connect_every=10, connect_tries=4):
+        self.planner = planner
+        self.backward = copy.copy(planner)
+        self.backward.set_system(reverse_dynamics, reverse_lqr,
+                                 dynamics_batch=reverse_dynamics_batch, lqr_batch=reverse_lqr_batch)
+        self.backward.set_search(bound=False, max_speed=0)
+        self.backward.set_seed(planner.spawn_seeds(1)[0])
+        self.backward.printing = False
+
+        if int(connect_every) >= 1:
+            self.connect_every = int(connect_every)
+        else:
+            raise ValueError("The connect_every must be at least 1.")
+        if int(connect_tries) >= 1:
+            self.connect_tries = int(connect_tries)
+        else:
+            raise ValueError("The connect_tries must be at least 1.")
+        self.nconnections = 0
+
+    def update_plan(self, x0, sample_space, goal_bias=0,
+                    guide=None, finish_on_goal=False, specific_time=None):
+        """
+        Grows a forward tree from x0 and a backward tree from the planner's
+        goal, taking turns, as if by the planner's update_plan (see its
+        docstring for the arguments, which the backward tree shares with x0
+        taking the place of the goal). Planning stops when the forward
+        planner's budget says so, counting plans through connections.
+        Returns the same thing as the planner's update_plan.
+
+        """
+        forward, backward = self.planner, self.backward
+        if not forward.start(x0, sample_space, goal_bias, guide, None, finish_on_goal, specific_time):
+            return False
+        backward.set_goal(x0)
+        backward.start(forward.goal, sample_space, goal_bias, None, None, False, specific_time)
+        self._nforward, self._nbackward = 1, 1
+        self.nconnections = 0
+
+        # Take turns, trying to connect the trees every so often
+        while not forward.step():
+            backward.step()
+            if not forward.stats['iterations'] % self.connect_every:
+                with forward.lock:
+                    self._connect()
+
+        # Abrupt termination
+        if not forward.killed:
+            forward.finalize()
+        if forward.killed or forward.tree.size > forward.max_nodes:
+            if forward.printing:
+                print("Plan update terminated abruptly!")
+            forward.killed = False
+            return False
+        else:
+            return True
+
+    def kill_update(self):
+        """
+        Raises a flag that will cause an abrupt termination of the update_plan routine.
+
+        """
+        self.planner.kill_update()
+
+#################################################
+
+    def _connect(self):
+        """
+        Pairs the nodes added to each tree since the last attempt with
+        their nearest nodes in the other tree, steers forward across the
+        closest pairs, and grafts the connection that makes the soonest
+        plan onto the forward tree (if it beats the current plan).
+
+        """
+        forward, backward = self.planner, self.backward
+
+        # New nodes of each tree and their nearest nodes in the other
+        fIDs = np.arange(self._nforward, forward.tree.size)
+        bIDs = np.arange(self._nbackward, backward.tree.size)
+        fIDs = fIDs[forward.tree.active[fIDs]]
+        bIDs = bIDs[backward.tree.active[bIDs]]
+        self._nforward, self._nbackward = forward.tree.size, backward.tree.size
+        pairs = [(fID, backward._nearest(forward.tree.state[fID])) for fID in fIDs] + \
+                [(forward._nearest(backward.tree.state[bID]), bID) for bID in bIDs]
+        if not pairs:
+            return
+        pairs = np.array(pairs, dtype=np.int64)
+
+        # The closest pairs by cost-to-go
+        diffs = forward.constraints.wrap(backward.tree.state[pairs[:, 1]] - forward.tree.state[pairs[:, 0]])
+        S = np.array(forward.lqr(forward.goal, np.zeros(forward.ncontrols))[0], dtype=np.float64)
+        costs = np.sum(np.dot(diffs, S) * diffs, axis=1)
+        pairs = pairs[np.argsort(costs)[:self.connect_tries]]
+
+        # Steer across them, keeping the soonest plan that got there
+        best = None
+        targets = backward.tree.state[pairs[:, 1]]
+        for (fID, bID), (x_seq, u_seq) in zip(pairs, forward._steer_many(pairs[:, 0], targets)):
+            if forward._reached(backward.tree.state[bID], x_seq):
+                nsteps = forward.tree.cost[fID] + len(x_seq) + backward.tree.cost[bID]
+                if best is None or nsteps < best[0]:
+                    best = (nsteps, fID, bID, x_seq, u_seq)
+        if best is None or (forward.plan_reached_goal and best[0] + 1 >= len(forward.x_seq)):
+            return
+        nsteps, fID, bID, x_seq, u_seq = best
+
+        # Reversed, each edge of the backward path from pID to ID goes from ID to pID with the same
+        # efforts, which are re-simulated from where the connection ended and then fully checked
+        node_seq = backward.tree.climb(bID)
+        x, graft = x_seq[-1], []
+        for ID in node_seq[:0:-1]:
+            ru_seq = np.copy(backward.tree.u_seq[ID][::-1])
+            rx_seq = forward._reroll(x, ru_seq)
+            graft.append((rx_seq, ru_seq))
+            x = rx_seq[-1]
+        if graft:
+            rx_seqs, ru_seqs = zip(*graft)
+            if not np.all(forward.constraints.feasible_mask(np.concatenate(rx_seqs), np.concatenate(ru_seqs))):
+                return
+
+        # Graft the connection, and then the backward path reversed, onto the forward tree
+        forward._add_node(fID, x_seq[-1], self._lqr(x_seq[-1], u_seq[-1]), x_seq, u_seq)
+        for rx_seq, ru_seq in graft:
+            forward._add_node(forward.tree.size-1, rx_seq[-1], self._lqr(rx_seq[-1], ru_seq[-1]), rx_seq, ru_seq)
+        self._nforward = forward.tree.size
+        self.nconnections += 1
+
+        # The last grafted node is the goal itself (or near it, if the connection was to the goal)
+        if forward._in_goal(forward.tree.state[-1]):
+            forward._consider_plan(forward.tree.size-1)
+
+    def _lqr(self, x, u):
+        """
+        Returns the lqr the forward planner would store for a new
+        node with state x reached by effort u (None with lazy_lqr).
+
+        """
+        if self.planner.lazy_lqr:
+            return None
+        return self.planner.lqr(self.planner._copy(x), self.planner._copy(u))
@@ -26,13 +26,28 @@ class Constraints:
 
     is_feasible: Function that takes a state and effort and returns a bool.
 
+    is_feasible_batch: Optional batched version of is_feasible. It takes an
+                       (N, nstates) array of states X and an (N, ncontrols)
+                       array of efforts U and returns a length N boolean array
+                       that is True where each (X[i], U[i]) is feasible.
+                       Defaults to None, in which case feasible_mask just
+                       calls is_feasible on each row.
+
+    periods: Array of the period of each state dimension, where 0 means
+             that dimension isn't periodic. For example, a heading in
+             radians has period 2*pi. Differences between states along
+             periodic dimensions are wrapped to within half a period,
+             both for nearest-node search and for the goal region.
+             Defaults to None (no periodic dimensions).
+
     """
 
-    def __init__(self, nstates, ncontrols, goal_buffer, is_feasible):
+    def __init__(self, nstates, ncontrols, goal_buffer, is_feasible, periods=None, is_feasible_batch=None):
         self.nstates = nstates
         self.ncontrols = ncontrols
         self.set_buffers(goal_buffer)
-        self.set_feasibility_function(is_feasible)
+        self.set_feasibility_function(is_feasible, is_feasible_batch)
+        self.set_periods(periods)
 
 #################################################
 
@@ -50,12 +65,61 @@ class Constraints:
 
 #################################################
 
-    def set_feasibility_function(self, is_feasible):
+    def set_feasibility_function(self, is_feasible, is_feasible_batch=None):
         """
         See class docstring for argument definitions.
+        Not giving is_feasible_batch means there is no batched version.
 
         """
         if hasattr(is_feasible, '__call__'):
             self.is_feasible = is_feasible
         else:
             raise ValueError("Expected is_feasible to be a function.")
+
+        if is_feasible_batch is None or hasattr(is_feasible_batch, '__call__'):
+            self.is_feasible_batch = is_feasible_batch
+        else:
+            raise ValueError("Expected is_feasible_batch to be None or a function.")
+
+#################################################
+
+    def feasible_mask(self, X, U):
+        """
+        Returns a boolean array that is True where each row of the array of
+        states X is feasible with the corresponding row of the array of efforts U.
+        Uses is_feasible_batch if there is one, and otherwise loops is_feasible.
+
+        """
+        if self.is_feasible_batch is not None:
+            return np.asarray(self.is_feasible_batch(X, U), dtype=bool)
+        return np.array([self.is_feasible(x, u) for x, u in zip(X, U)], dtype=bool)
+
+#################################################
+
+    def set_periods(self, periods=None):
+        """
+        See class docstring for argument definitions.
+        Giving None means no dimension is periodic.
+
+        """
+        if periods is None:
+            self.periods = np.zeros(self.nstates)
+        elif len(periods) == self.nstates:
+            self.periods = np.abs(periods).astype(np.float64)
+        else:
+            raise ValueError("The periods must have same dimensionality as state.")
+
+#################################################
+
+    def wrap(self, diffs):
+        """
+        Wraps the periodic dimensions of a state difference (or of
+        each row of an array of them) into [-period/2, period/2].
+        The given array is modified in place and returned.
+
+        """
+        periodic = self.periods > 0
+        if np.any(periodic):
+            periods = self.periods[periodic]
+            diffs[..., periodic] -= periods * np.round(diffs[..., periodic] / periods)
+        return diffs
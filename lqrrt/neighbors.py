@@ -0,0 +1,420 @@
+"""
+Class for a nearest-node index over the states of an lqrrt tree.
+
+When the cost-to-go matrix S is the same everywhere, the cost-to-go
+(v-x).T * S * (v-x) between two states is just a squared Euclidean
+distance after whitening the states by a factor W where S = W.T * W.
+This index keeps the whitened node states in a k-d tree so that the
+node with the least cost-to-go can be found without visiting every node.
+
+Periodic state dimensions (like a heading) are supported as long as S
+doesn't couple them to any other dimension. Each periodic dimension is
+just scaled by the square root of its diagonal element of S, and the
+k-d tree treats it as a circle whose circumference is the scaled period.
+
+The k-d tree itself is static, so new nodes are first collected in a
+small buffer that is searched by brute force. Whenever the buffer gets
+big compared to the k-d tree, everything is rebuilt into a fresh k-d tree.
+Nodes are identified by their insertion order, which matches tree IDs
+as long as every node added to the tree is also inserted here.
+
+Nodes can be removed (for example when they are pruned from the tree).
+They keep their IDs but are never returned by a query again. Removed
+nodes are skipped over in the k-d tree until there are enough of them
+to be worth a rebuild, which leaves them out of the fresh k-d tree.
+
+Nodes can also be moved (for example when a rewire shifts them a little).
+Nodes in the k-d tree are still found by their old positions until there
+are enough moved ones to be worth a rebuild, so queries are only
+approximate in the meantime.
+
+Every insertion, removal, rebuild, and query holds the index's lock,
+so several threads can use the same index.
+
+"""
+
+################################################# DEPENDENCIES
+
+from __future__ import division
+import threading
+
+import numpy as np
+import numpy.linalg as npl
+from scipy.spatial import cKDTree
+
+# Faster (unbalanced) k-d tree builds where scipy supports them
+try:
+    cKDTree(np.zeros((1, 1)), balanced_tree=False, compact_nodes=False)
+    _build_kwargs = {'balanced_tree': False, 'compact_nodes': False}
+except TypeError:
+    _build_kwargs = {}
+
+################################################# PRIMARY CLASS
+
+class NearestIndex(object):
+    """
+    To initialize, provide...
+
+    S: The constant cost-to-go matrix that defines the metric.
+       It must be symmetric positive semidefinite.
+
+    periods: Array of the period of each state dimension, where 0
+             means not periodic. Defaults to None (nothing periodic).
+
+    leafsize: The number of points in each leaf of the k-d tree.
+
+    rebuild_ratio: The k-d tree is rebuilt once the buffer of
+                   unindexed points exceeds this fraction of the
+                   number of points in the k-d tree.
+
+    min_rebuild: The buffer is never rebuilt into the k-d tree
+                 while it has fewer than this many points.
+
+    eps: Approximation factor for nearest queries. The point returned
+         is at most (1+eps) times farther (in whitened distance) than
+         the true nearest point, so its cost-to-go is at most (1+eps)^2
+         times the least one. Zero gives exact queries, and bigger values
+         let the k-d tree search skip more of its branches.
+
+    """
+    def __init__(self, S, periods=None, leafsize=16, rebuild_ratio=0.1, min_rebuild=256, eps=0):
+
+        self.S = S
+        if periods is None or not np.any(periods):
+            self.W = whitening_factor(S)
+            self.boxsize = None
+        else:
+            self.W, self.boxsize = periodic_whitening_factor(S, periods)
+        self.leafsize = int(leafsize)
+        self.rebuild_ratio = rebuild_ratio
+        self.min_rebuild = int(min_rebuild)
+        self.eps = eps
+
+        # Whitened points, which of them aren't removed, and the number of them
+        # covered by the k-d tree, where _ids maps k-d tree points to point IDs
+        self._points = np.zeros((1024, self.W.shape[0]), dtype=np.float64)
+        self._alive = np.zeros(1024, dtype=bool)
+        self.size = 0
+        self._kdtree = None
+        self._ids = None
+        self._nindexed = 0
+        self._nremoved = 0
+        self._nmoved = 0
+
+        # Held by every insertion, removal, rebuild, and query
+        self.lock = threading.RLock()
+
+#################################################
+
+    def matches(self, S):
+        """
+        Returns True if the given cost-to-go matrix
+        defines the same metric as this index.
+
+        """
+        return S is self.S or np.array_equal(S, self.S)
+
+#################################################
+
+    def insert(self, x):
+        """
+        Adds the state x as the next point in the index.
+
+        """
+        self.extend(np.reshape(x, (1, -1)))
+
+    def extend(self, X):
+        """
+        Adds the rows of the array X as the next points in the index.
+
+        """
+        with self.lock:
+            Z = self._whiten(X)
+            while self.size + len(Z) > len(self._points):
+                points = np.zeros((2*len(self._points), self._points.shape[1]), dtype=np.float64)
+                points[:self.size] = self._points[:self.size]
+                self._points = points
+                alive = np.zeros(len(points), dtype=bool)
+                alive[:self.size] = self._alive[:self.size]
+                self._alive = alive
+            self._points[self.size:self.size+len(Z)] = Z
+            self._alive[self.size:self.size+len(Z)] = True
+            self.size += len(Z)
+
+            # Rebalance by rebuilding when the buffer is too big
+            if self.size - self._nindexed > max(self.min_rebuild, self.rebuild_ratio*self._nindexed):
+                self.rebuild()
+
+    def remove(self, IDs):
+        """
+        Removes the points with the given IDs from all future queries.
+
+        """
+        with self.lock:
+            IDs = np.unique(np.asarray(IDs, dtype=np.int64))
+            IDs = IDs[self._alive[IDs]]
+            self._alive[IDs] = False
+            self._nremoved += np.sum(IDs < self._nindexed)
+
+            # Rebuild once the k-d tree is cluttered with removed points
+            if self._nremoved > max(self.min_rebuild, self.rebuild_ratio*self._nindexed):
+                self.rebuild()
+
+    def move(self, IDs, X):
+        """
+        Moves the points with the given IDs to the rows of the array X.
+
+        """
+        with self.lock:
+            IDs = np.asarray(IDs, dtype=np.int64)
+            self._points[IDs] = self._whiten(np.asarray(X, dtype=np.float64).reshape(len(IDs), -1))
+            self._nmoved += np.sum(IDs < self._nindexed)
+
+            # Rebuild once the k-d tree has too many old positions
+            if self._nmoved > max(self.min_rebuild, self.rebuild_ratio*self._nindexed):
+                self.rebuild()
+
+    def rebuild(self):
+        """
+        Rebuilds the k-d tree over all points that aren't removed.
+
+        """
+        with self.lock:
+            self._nindexed = self.size
+            self._nremoved = 0
+            self._nmoved = 0
+            if np.all(self._alive[:self.size]):
+                self._ids = None
+                points = self._points[:self.size]
+            else:
+                self._ids = np.flatnonzero(self._alive[:self.size])
+                points = self._points[self._ids]
+            if len(points):
+                self._kdtree = cKDTree(points, leafsize=self.leafsize,
+                                       boxsize=self.boxsize, **_build_kwargs)
+            else:
+                self._kdtree = None
+
+#################################################
+
+    def nearest(self, x):
+        """
+        Returns the ID of the point with the least cost-to-go
+        to x, and that cost-to-go, as a tuple (ID, cost).
+        If eps is nonzero, the point might only be near-least.
+
+        """
+        with self.lock:
+            z = self._whiten(np.reshape(x, (1, -1)))[0]
+            best_ID = -1
+            best_dist = np.inf
+
+            # Search the k-d tree
+            if self._kdtree is not None:
+                if self._nremoved:
+                    best_ID, best_dist = self._query_alive(z)
+                else:
+                    best_dist, best_ID = self._kdtree.query(z, eps=self.eps)
+                    if self._ids is not None:
+                        best_ID = self._ids[best_ID]
+
+            # Search the buffer
+            if self.size > self._nindexed:
+                diffs = self._points[self._nindexed:self.size] - z
+                if self.boxsize is not None:
+                    periodic = self.boxsize > 0
+                    boxsize = self.boxsize[periodic]
+                    diffs[:, periodic] -= boxsize * np.round(diffs[:, periodic] / boxsize)
+                dists = np.sum(diffs * diffs, axis=1)
+                dists[~self._alive[self._nindexed:self.size]] = np.inf
+                i = np.argmin(dists)
+                if dists[i] < best_dist**2:
+                    return (self._nindexed + i, dists[i])
+
+            return (int(best_ID), best_dist**2)
+
+    def nearest_many(self, X):
+        """
+        Returns an array of the IDs of the points with the least
+        cost-to-go to each row of the array of states X, and an
+        array of those costs-to-go, as a tuple (IDs, costs).
+
+        """
+        with self.lock:
+            Z = self._whiten(np.asarray(X, dtype=np.float64))
+            IDs = -np.ones(len(Z), dtype=np.int64)
+            costs = np.inf * np.ones(len(Z))
+
+            # Search the k-d tree, redoing queries that found removed points one by one
+            if self._kdtree is not None:
+                dists, IDs = self._kdtree.query(Z, eps=self.eps)
+                if self._ids is not None:
+                    IDs = self._ids[IDs]
+                if self._nremoved:
+                    for i in np.flatnonzero(~self._alive[IDs]):
+                        IDs[i], dists[i] = self._query_alive(Z[i])
+                costs = dists**2
+
+            # Search the buffer
+            if self.size > self._nindexed:
+                diffs = self._points[np.newaxis, self._nindexed:self.size] - Z[:, np.newaxis]
+                if self.boxsize is not None:
+                    periodic = self.boxsize > 0
+                    boxsize = self.boxsize[periodic]
+                    diffs[..., periodic] -= boxsize * np.round(diffs[..., periodic] / boxsize)
+                dists = np.sum(diffs * diffs, axis=2)
+                dists[:, ~self._alive[self._nindexed:self.size]] = np.inf
+                i = np.argmin(dists, axis=1)
+                buffer_costs = dists[np.arange(len(Z)), i]
+                closer = buffer_costs < costs
+                IDs = np.where(closer, self._nindexed + i, IDs)
+                costs = np.where(closer, buffer_costs, costs)
+
+            return (IDs, costs)
+
+    def nearest_k(self, x, k, max_cost=np.inf):
+        """
+        Returns an array of the IDs of the (up to) k points with the
+        least cost-to-go to x that is at most max_cost, sorted from least
+        cost-to-go, and an array of those costs-to-go, as a tuple (IDs, costs).
+
+        """
+        with self.lock:
+            z = self._whiten(np.reshape(x, (1, -1)))[0]
+            IDs = np.zeros(0, dtype=np.int64)
+            dists = np.zeros(0)
+
+            # Search the k-d tree, asking for more neighbors while removed ones crowd them out
+            if self._kdtree is not None:
+                n = self._kdtree.n
+                kq = min(k + self._nremoved, n)
+                while True:
+                    dists, positions = self._kdtree.query(z, k=kq, eps=self.eps)
+                    dists, positions = np.atleast_1d(dists), np.atleast_1d(positions)
+                    IDs = positions if self._ids is None else self._ids[positions]
+                    alive = self._alive[IDs]
+                    if np.sum(alive) >= k or kq == n:
+                        break
+                    kq = min(4*kq, n)
+                IDs, dists = IDs[alive], dists[alive]
+
+            # Search the buffer
+            if self.size > self._nindexed:
+                diffs = self._points[self._nindexed:self.size] - z
+                if self.boxsize is not None:
+                    periodic = self.boxsize > 0
+                    boxsize = self.boxsize[periodic]
+                    diffs[:, periodic] -= boxsize * np.round(diffs[:, periodic] / boxsize)
+                alive = np.flatnonzero(self._alive[self._nindexed:self.size])
+                IDs = np.concatenate((IDs, self._nindexed + alive))
+                dists = np.concatenate((dists, np.sqrt(np.sum(diffs[alive] * diffs[alive], axis=1))))
+
+            # Keep the k best within max_cost
+            costs = dists**2
+            order = np.argsort(costs)[:k]
+            order = order[costs[order] <= max_cost]
+            return (IDs[order], costs[order])
+
+#################################################
+
+    def _query_alive(self, z):
+        """
+        Returns the ID of the nearest point in the k-d tree to the
+        whitened point z that isn't removed, and its whitened distance,
+        as a tuple (ID, dist). Asks the k-d tree for more and more
+        neighbors until one of them isn't removed.
+
+        """
+        n = self._kdtree.n
+        k = 2
+        while True:
+            k = min(k, n)
+            dists, positions = self._kdtree.query(z, k=k, eps=self.eps)
+            dists, positions = np.atleast_1d(dists), np.atleast_1d(positions)
+            IDs = positions if self._ids is None else self._ids[positions]
+            alive = np.flatnonzero(self._alive[IDs])
+            if len(alive):
+                return (int(IDs[alive[0]]), dists[alive[0]])
+            if k == n:
+                return (-1, np.inf)
+            k *= 4
+
+#################################################
+
+    def _whiten(self, X):
+        """
+        Returns the whitened rows of the array of states X,
+        with periodic dimensions wrapped into [0, period).
+
+        """
+        Z = np.dot(X, self.W.T)
+        if self.boxsize is not None:
+            periodic = self.boxsize > 0
+            boxsize = self.boxsize[periodic]
+            Zp = np.mod(Z[:, periodic], boxsize)
+            Z[:, periodic] = np.where(Zp >= boxsize, Zp - boxsize, Zp)
+        return Z
+
+################################################# HELPERS
+
+def whitening_factor(S):
+    """
+    Returns a matrix W such that S = W.T * W, with as many rows
+    as the rank of S. The Cholesky factor is used when S is positive
+    definite, and an eigendecomposition is used when it is singular.
+
+    """
+    S = np.asarray(S, dtype=np.float64)
+    try:
+        return npl.cholesky(S).T
+    except npl.LinAlgError:
+        pass
+    eigvals, eigvecs = npl.eigh((S + S.T) / 2)
+    tol = 1E-10 * max(np.max(np.abs(eigvals)), 1)
+    if np.any(eigvals < -tol):
+        raise ValueError("The cost-to-go matrix S must be positive semidefinite.")
+    keep = eigvals > tol
+    if not np.any(keep):
+        return np.zeros((1, len(S)))
+    return np.sqrt(eigvals[keep])[:, np.newaxis] * eigvecs[:, keep].T
+
+
+def periodic_whitening_factor(S, periods):
+    """
+    Returns a matrix W such that S = W.T * W, and an array of the
+    period of each row of W (0 for not periodic), as a tuple (W, boxsize).
+    Each periodic state dimension gets its own row of W, so S must not
+    couple periodic dimensions to any other dimension.
+
+    """
+    S = np.asarray(S, dtype=np.float64)
+    periods = np.asarray(periods, dtype=np.float64)
+    periodic = periods > 0
+    offdiag = S - np.diag(np.diag(S))
+    if np.any(offdiag[periodic]) or np.any(offdiag[:, periodic]):
+        raise ValueError("Periodic dimensions must not be coupled to other dimensions by S.")
+
+    # Factor of the non-periodic block
+    rows = []; boxsize = []
+    if not np.all(periodic):
+        W_rest = whitening_factor(S[np.ix_(~periodic, ~periodic)])
+        W = np.zeros((len(W_rest), len(S)))
+        W[:, ~periodic] = W_rest
+        rows.append(W)
+        boxsize.extend([0] * len(W))
+
+    # Scaled periodic dimensions
+    for i in np.flatnonzero(periodic):
+        if S[i, i] < 0:
+            raise ValueError("The cost-to-go matrix S must be positive semidefinite.")
+        if S[i, i] > 0:
+            W = np.zeros((1, len(S)))
+            W[0, i] = np.sqrt(S[i, i])
+            rows.append(W)
+            boxsize.append(W[0, i] * periods[i])
+
+    if not rows:
+        return (np.zeros((1, len(S))), None)
+    if not np.any(boxsize):
+        return (np.vstack(rows), None)
+    return (np.vstack(rows), np.array(boxsize))
@@ -0,0 +1,186 @@
+"""
+Class for planning with several independent lqRRTs at once on a pool of processes.
+
+Every update grows one tree per worker from the same seed state toward the
+same goal, but each draws from its own random number stream (see
+Planner.spawn_seeds), and the best of their plans is kept: the soonest one
+that reached the goal region, or if none did, the one that ends nearest the
+guide. Since the trees share nothing while they grow, each one takes a core
+of its own and no time is spent coordinating them.
+
+The worker processes are started once, with a copy of the template planner
+as it was then, and are reused by every update. Only the goal is sent to them
+with each update, so to change any other setting of the template, close this
+and make a new one. On platforms that spawn rather than fork processes, the
+template has to be pickled (see Planner.__getstate__), so its system functions
+must be module-level functions (like the ones in the demos' behaviors).
+
+"""
+
+################################################# DEPENDENCIES
+
+from __future__ import division
+import time
+import multiprocessing
+
+import numpy as np
+
+################################################# PRIMARY CLASS
+
+class ParallelPlanner(object):
+    """
+    To initialize, provide...
+
+    planner: The Planner instance to use as the template for every tree.
+             The winning plan of each update is committed to it, so its
+             get_state(t), get_effort(t), x_seq, u_seq, T, plan_reached_goal,
+             and stats describe the winner just as if it had planned it itself.
+             Its tree is left alone, since the winning tree stays in its worker.
+
+    nworkers: Number of worker processes. Defaults to None (one per CPU).
+
+    stop_on_first: If True, once any tree finishes with a plan that reached
+                   the goal region, the rest are stopped and their best plans
+                   so far are compared as they are. Defaults to False (every
+                   tree plans for its full budget).
+
+    After each update, the outcome of every tree is kept in the list results
+    as a dictionary with its 'reached', 'T', 'cost' (cost-to-go from the end of
+    its plan to the guide), 'size' (tree size), and 'stats'. The wall-clock
+    seconds the whole update took are kept in wall_time.
+
+    """
+    def __init__(self, planner, nworkers=None, stop_on_first=False):
+        if nworkers is None:
+            nworkers = multiprocessing.cpu_count()
+        if int(nworkers) < 1:
+            raise ValueError("The number of workers must be at least 1.")
+        self.planner = planner
+        self.nworkers = int(nworkers)
+        self.stop_on_first = bool(stop_on_first)
+        self.results = []
+        self.wall_time = 0
+
+        # Flags shared with every worker
+        self._stop = multiprocessing.Event()
+        self._kill = multiprocessing.Event()
+        self.pool = multiprocessing.Pool(self.nworkers, _init_worker, (planner, self._stop, self._kill))
+
+    def update_plan(self, x0, sample_space, goal_bias=0,
+                    guide=None, finish_on_goal=False, specific_time=None, ntrees=None):
+        """
+        Grows ntrees trees (defaults to one per worker) at once, as if by
+        the template's update_plan (see its docstring for the arguments),
+        and commits the best of their plans to the template. Each tree
+        uses the standard sampler. Returns True if the winning tree
+        finished fully, or False if the update was killed (in which case
+        nothing is committed) or if no goal has been set yet.
+
+        """
+        if self.planner.goal is None:
+            print("No goal has been set yet!")
+            return False
+        if ntrees is None:
+            ntrees = self.nworkers
+        self._stop.clear()
+        self._kill.clear()
+
+        # Plan with every tree, stopping the rest early if asked once one reaches the goal
+        start_time = time.time()
+        jobs = [(seed, self.planner.goal, x0, sample_space, goal_bias, guide, finish_on_goal, specific_time)
+                for seed in self.planner.spawn_seeds(ntrees)]
+        results = []
+        for result in self.pool.imap_unordered(_plan, jobs):
+            results.append(result)
+            if self.stop_on_first and result is not None and result['reached']:
+                self._stop.set()
+        self.wall_time = time.time() - start_time
+
+        # Abrupt termination
+        if self._kill.is_set() or any(result is None for result in results):
+            if self.planner.printing:
+                print("Plan update terminated abruptly!")
+            self._kill.clear()
+            return False
+
+        # Soonest plan that reached the goal, otherwise the one that ends nearest the guide
+        best = min(results, key=lambda result: (not result['reached'], result['T'] if result['reached'] else result['cost']))
+        with self.planner.lock:
+            self.planner.x_seq = best['x_seq']
+            self.planner.u_seq = best['u_seq']
+            self.planner.t_seq = np.arange(len(best['x_seq'])) * self.planner.dt
+            self.planner.T = best['T']
+            self.planner.plan_reached_goal = best['reached']
+            self.planner.stats = best['stats']
+            self.planner._prepare_interpolators()
+        self.results = [dict((key, result[key]) for key in ('reached', 'T', 'cost', 'size', 'stats'))
+                        for result in results]
+        if self.planner.printing:
+            print("Trees reached goal: {0}/{1}\nETA: {2} s".format(sum(result['reached'] for result in results),
+                                                                   len(results), np.round(best['T'], 2)))
+        return best['clean']
+
+#################################################
+
+    def kill_update(self):
+        """
+        Raises a flag that will cause an abrupt termination of the update_plan routine.
+
+        """
+        self._kill.set()
+
+    def close(self):
+        """
+        Stops the worker processes. This can't be used after closing.
+
+        """
+        self.pool.terminate()
+        self.pool.join()
+
+################################################# WORKERS
+
+_worker = {}
+
+def _init_worker(planner, stop, kill):
+    """
+    Keeps the worker's copy of the template planner and the shared flags.
+
+    """
+    planner.printing = False
+    _worker['planner'] = planner
+    _worker['stop'] = stop
+    _worker['kill'] = kill
+
+
+def _plan(job):
+    """
+    Grows one tree for the given job and returns a dictionary describing its
+    best plan, or None if it was killed. The job is a tuple of the tree's
+    seed, the goal, and the rest of update_plan's arguments.
+
+    """
+    planner = _worker['planner']
+    seed, goal, x0, sample_space, goal_bias, guide, finish_on_goal, specific_time = job
+    planner.set_seed(seed)
+    planner.set_goal(goal)
+    planner.start(x0, sample_space, goal_bias, guide, None, finish_on_goal, specific_time)
+
+    # Step until over, checking on the shared flags in between
+    stopped = False
+    while not planner.step():
+        if _worker['kill'].is_set():
+            return None
+        if _worker['stop'].is_set():
+            stopped = True
+            break
+
+    # A stopped tree is compared as it is, without the close-out
+    if stopped:
+        x_seq, u_seq, reached = planner.best_plan()
+        T = len(x_seq) * planner.dt
+    else:
+        planner.finalize()
+        x_seq, u_seq, reached, T = planner.x_seq, planner.u_seq, planner.plan_reached_goal, planner.T
+    return {'x_seq': np.array(x_seq), 'u_seq': np.array(u_seq), 'reached': reached, 'T': T,
+            'cost': planner._guide_costs(np.array(x_seq)[-1:])[0][0], 'size': planner.tree.size,
+            'stats': planner.stats, 'clean': planner.tree.size <= planner.max_nodes}
@@ -10,12 +10,16 @@ To get the state or effort at some time t, use the functions get_state(t) and ge
 
 from __future__ import division
 import time
+import threading
 
 import numpy as np
 import numpy.linalg as npl
 
-from tree import Tree
+from tree import Tree, RolloutBuffer
 from constraints import Constraints
+from neighbors import NearestIndex
+from samplers import RejectionSampler, HaltonSampler
+from multiprocessing.pool import ThreadPool
 
 # Check scipy version for assume_sorted argument in interp1d
 import scipy.interpolate
@@ -83,25 +87,197 @@ class Planner:
     sys_time: Function that returns the real-world system time.
               Defaults to the Python time library's time().
 
+    min_iterations: The least number of planning iterations the tree will grow
+                    for, on top of min_time. Defaults to 0.
+
+    max_iterations: The max number of planning iterations the tree will grow for,
+                    like max_time. Defaults to np.inf.
+
+    use_clock: If False, the planner never looks at sys_time to decide anything,
+               so its runs depend only on the work done and not on the machine.
+               The min_time, max_time and specific_time are then ignored, and
+               planning is only limited by the iteration and node budgets (the
+               seconds spent are still measured for self.stats). Defaults to True.
+
+    arrive_steps: Number of simulation steps after which a force-arrive steer
+                  (see finish_on_goal in update_plan) gives up. Defaults to 0,
+                  meaning it gives up after half of min_time (at least 0.1 s) of
+                  sys_time instead, or without the clock, after 1000 steps.
+
     printing: Bool that specifies if internal stuff should be printed.
 
+    lazy_lqr: Bool that declares that lqr(x, u) only depends on x.
+              If True, the tree doesn't store an (S, K) for every node
+              and instead recomputes it from the node state when needed,
+              which saves a lot of memory for big trees.
+
+    nn_method: Strategy for finding the nearest node to each sample.
+               With 'brute', the cost-to-go to every node is computed.
+               With 'kdtree', node states are kept in a k-d tree whitened
+               by the S that lqr returns at the seed, which is much faster
+               for big trees. This is only exact if S doesn't depend on
+               the state, so any sample whose S differs from the seed's
+               falls back to the brute force search. Both methods respect
+               the periods declared in the constraints, but 'kdtree' needs
+               S to not couple periodic dimensions to any other dimension.
+
+    nn_eps: Approximation factor for the 'kdtree' nn_method. If nonzero,
+            the node chosen for extension is only guaranteed to be within
+            (1+nn_eps) of the true nearest node's whitened distance, but the
+            search is faster. RRT exploration doesn't need exact nearest
+            nodes, so a value around 1 is a good trade for trees with tens
+            of thousands of nodes. Defaults to 0 (exact).
+
+    batch_size: Number of random samples drawn per planning iteration.
+                With more than 1, the nearest nodes to all the samples are
+                found together (one vectorized cost-to-go computation or
+                one k-d tree query) and all the resulting extensions are
+                added to the tree at once. Nodes added within a batch can't
+                be extended by the other samples of that same batch.
+                Defaults to 1 (one sample at a time).
+
+    dynamics_batch: Optional batched version of dynamics. It takes an (N, nstates)
+                    array of states X, an (N, ncontrols) array of efforts U, and
+                    the timestep dt, and returns the (N, nstates) array of next states.
+
+    lqr_batch: Optional batched version of lqr. It takes arrays X and U like
+               dynamics_batch and returns a tuple (S, K) where K is an
+               (N, ncontrols, nstates) array of policies. S is not used.
+
+    erf_batch: Optional batched version of erf. It takes two (N, nstates) arrays
+               of states Xgoal and X and returns the (N, nstates) array of errors.
+               If not given, erf is applied row by row (unless erf is the
+               default subtraction, which works on whole arrays already).
+
+    lazy_check: If nonzero, the tree is grown with lazy collision checking. While
+                growing, only every lazy_check-th step of each new edge (and its
+                last step) is checked for feasibility. The rest of an edge is only
+                checked once a path through it is about to become the plan. Edges
+                that turn out to be infeasible are pruned along with everything
+                that grew from them. Only applies with a fixed horizon.
+                Defaults to 0 (every step is checked right away).
+
+    rewire: If nonzero, the tree is improved RRT*-style as it grows. Each new node
+            looks at its rewire nearest nodes (by cost-to-go) and takes whichever
+            of them reaches it soonest from the seed as its parent, and then each
+            of those nodes is rewired through the new node if that gets it there
+            sooner. A connection only counts if steering gets within connect_tol of
+            the node. The rewired node then moves to the end of its new edge, and
+            the edges of everything that grew from it are re-simulated from there
+            with their same efforts (pruning any that become infeasible), so every
+            plan is still exactly what the dynamics do. Nodes on the current plan
+            are not rewired. This makes planning time left after a first solution
+            keep shortening the plan, at the cost of up to 2*rewire extra extensions
+            per new node. Only applies with a fixed horizon. Defaults to 0 (off).
+
+    rewire_cost: Nodes with a cost-to-go bigger than this are not considered
+                 for rewiring. Defaults to np.inf.
+
+    connect_tol: The state error array or scalar within which steering has to get
+                 to an existing node to connect to it (when rewiring, or joining the
+                 trees of a BidirectionalPlanner). Unlike error_tol, it must be finite,
+                 since the node and everything past it get shifted by up to that much.
+                 Defaults to 0.05.
+
+    bound: If True, once a plan reaches the goal, the search is bounded by its ETA.
+           Every node whose arrival time (timesteps from the seed times dt) means a
+           plan through it can't be faster than the current one is pruned, along
+           with everything that grew from it, and new extensions that would end
+           up the same way are not added. Pruned nodes are no longer found by the
+           nearest-node search, so the rest of min_time goes to nodes that can
+           still improve the plan. Defaults to True.
+
+    max_speed: If nonzero, the sampler of update_plan becomes informed once
+               a plan reaches the goal. The position_dims of each sample are then
+               drawn uniformly from the ellipse (or ellipsoid) of positions that a path
+               from the seed to the goal region could pass through at no more than
+               max_speed while still arriving sooner than the current plan. It must
+               really bound the system's speed along those dimensions, or part of
+               the space that could improve the plan is never sampled. Samples still
+               honor the sample_space, goal_bias, and the feasibility check. Has no
+               effect if the goal_buffer is infinite along any of the position_dims.
+               Defaults to 0 (off).
+
+    position_dims: List of the indices of the state dimensions that are positions,
+                   for informed sampling. Defaults to [0, 1].
+
+    sampling: Which standard sampler update_plan uses (see samplers.py), either
+              'uniform' for uniform random samples or 'halton' for a scrambled
+              Halton sequence, which covers the sample_space more evenly when
+              only a few hundred samples fit in the planning time.
+              Defaults to 'uniform'.
+
+    sample_block: Number of random samples the standard sampler of update_plan
+                  draws and checks for feasibility at once (see samplers.py).
+                  With an is_feasible_batch in the constraints, each block takes
+                  one call. Defaults to 64.
+
+    threads: Number of threads that grow the one tree together. Each planning
+             iteration, every thread takes batch_size of the random samples
+             (all drawn beforehand, in order) and finds their nearest nodes,
+             steers toward them, and adds the results, while the others do
+             the same. The tree is only locked to find nearest nodes and to
+             add new ones. Steering holds the GIL except inside NumPy, so this
+             only pays off when the batched system functions (or a batched
+             feasibility check) spend their time in big array operations.
+             All system functions must be safe to call from several threads
+             at once. More than 1 can't be used with a horizon of 0, since
+             that heuristic adapts the horizon between extensions.
+             Defaults to 1 (the caller's thread does everything).
+
+    seed: Seed for the planner's own random number generator, self.rng, which all
+          of its sampling draws from instead of the global np.random. It can be
+          an int or a list of ints (each in [0, 2**32)). Two planners with the same
+          seed and settings grow the same trees for the same update_plan calls, as
+          long as they take the same number of iterations (for example, with a
+          sys_time that counts calls rather than real time). If None, a seed is
+          drawn from the OS. Either way, the seed used is kept in self.seed.
+          Independent seeds for parallel workers come from spawn_seeds.
+
+    pure_callbacks: If True, the user guarantees that dynamics, lqr, erf (and their
+                    batched versions) never modify the arrays given to them, so the
+                    planner skips all the defensive copies it makes before calling them.
+                    Defaults to False.
+
+    If both dynamics_batch and lqr_batch are given, the extensions toward a batch
+    of samples (see batch_size) and the close-out candidate extensions are all
+    simulated together as arrays instead of one at a time. The batched functions
+    must compute the same thing as their regular versions, row by row. They are
+    not used when horizon is 0, since that heuristic adapts between extensions.
+
     """
     def __init__(self, dynamics, lqr, constraints,
                  horizon, dt=0.05, FPR=0, CPF=2,
                  error_tol=0.05, erf=np.subtract,
                  min_time=0.5, max_time=1, max_nodes=1E5,
-                 goal0=None, sys_time=time.time, printing=True):
+                 goal0=None, sys_time=time.time, printing=True,
+                 min_iterations=0, max_iterations=np.inf, use_clock=True, arrive_steps=0,
+                 lazy_lqr=False, nn_method='brute', nn_eps=0, batch_size=1,
+                 dynamics_batch=None, lqr_batch=None, erf_batch=None, pure_callbacks=False,
+                 lazy_check=0, rewire=0, rewire_cost=np.inf, connect_tol=0.05, bound=True,
+                 max_speed=0, position_dims=[0, 1], sampling='uniform', sample_block=64,
+                 seed=None, threads=1):
 
-        self.set_system(dynamics, lqr, constraints, erf)
+        self.set_system(dynamics, lqr, constraints, erf, lazy_lqr,
+                        dynamics_batch, lqr_batch, erf_batch, pure_callbacks)
 
         self.set_resolution(horizon, dt, FPR, CPF, error_tol)
 
-        self.set_runtime(min_time, max_time, max_nodes, sys_time)
+        self.set_runtime(min_time, max_time, max_nodes, sys_time,
+                         min_iterations, max_iterations, use_clock, arrive_steps)
+
+        self.set_search(nn_method, nn_eps, batch_size, lazy_check, rewire, rewire_cost, bound,
+                        max_speed, position_dims, sampling, sample_block, threads, connect_tol)
 
         self.set_goal(goal0)
 
+        self.set_seed(seed)
+
         self.printing = printing
         self.killed = False
+        self.planning = False
+        self.lock = threading.RLock()
+        self._future = None
 
 #################################################
 
@@ -121,19 +297,27 @@ class Planner:
         It can be a scalar from 0 (none of the time) to 1 (all the time)
         or a list of scalars corresponding to each state dimension.
 
+        The standard sampler draws and checks sample_block samples at a
+        time, and is kept as self.sampler. If the given xrand_gen is itself
+        a sampler from samplers.py (like a GridSampler), it is kept as
+        self.sampler instead, made to draw from self.rng, and informed by
+        max_speed just like the standard one. Otherwise self.sampler is None.
+
         Alternatively, you can give a function xrand_gen which takes the
         current planner instance (self) and outputs the random sample state.
         Doing this will override both sample_space and goal_bias, which you
         can set to arbitrary values only if you provide an xrand_gen.
 
-        After min_time seconds, the fastest available path from x0 to
-        the current goal is returned and the functions get_state(t)
-        and get_effort(t) are modified to interpolate this new path.
+        After min_time seconds (and min_iterations), the fastest available
+        path from x0 to the current goal is returned and the functions
+        get_state(t) and get_effort(t) are modified to interpolate this new path.
 
-        If no path was found yet, the search continues until max_time or
-        until the node limit is breached. After the limit, a warning is
-        printed and the path that gets nearest to the guide is
-        used instead. If guide is left None, it defaults to goal.
+        If no path was found yet, the search continues until max_time, or
+        max_iterations, or until the node limit is breached. Without the
+        clock (see use_clock), only the iteration and node budgets count.
+        After the limit, a warning is printed and the path that gets
+        nearest to the guide is used instead. If guide is left None, it
+        defaults to goal.
 
         If finish_on_goal is set to True, once the plan makes it to the goal
         region (goal plus buffer), it will attempt to steer one more path
@@ -143,59 +327,172 @@ class Planner:
         time (instead of using the global min_time and max_time), pass it
         in as specific_time in seconds.
 
+        Counters describing the search are kept in the dictionary self.stats,
+        which is reset at the start of every update. It has the number of
+        planning loop iterations, the seconds spent planning so far, the
+        seconds it took to first reach the goal ('first_plan_time', which
+        stays None until then), the fraction of random samples rejected by
+        the standard sampler as infeasible or outside the sample_space
+        ('rejection_rate'), the number of nodes pruned as infeasible by lazy
+        checking ('pruned'), and the number of nodes pruned and extensions
+        skipped because they couldn't beat the current plan ('bound_pruned'
+        and 'bound_skipped').
+
         This function returns True if it finished fully, or False if it was
         haulted. It can hault if it is killed or if the tree exceeds max_nodes,
         or if no goal has been set yet.
 
+        This is the same as calling start, then step until it returns True,
+        and then finalize (unless killed). Use those directly to plan a little
+        at a time and do other things in between.
+
+        """
+        # Plan in one go
+        if not self.start(x0, sample_space, goal_bias, guide, xrand_gen, finish_on_goal, specific_time):
+            return False
+        return self._run_query()
+
+    def update_plan_async(self, x0, sample_space, goal_bias=0,
+                          guide=None, xrand_gen=None,
+                          finish_on_goal=False, specific_time=None):
+        """
+        Starts an update_plan (see its docstring for the arguments), and
+        then runs the rest of it on a worker thread, immediately returning
+        a PlanFuture for checking on it. Meanwhile, get_state(t) and
+        get_effort(t) keep interpolating the last plan until the new one is
+        swapped in when the update finishes (take the pair from interpolators
+        to be sure that both are for the same plan). Only one update can be
+        in flight at a time.
+
+        """
+        # Claim the one slot before touching the tree, so that concurrent callers can't both start
+        with self.lock:
+            if self._future is not None and not self._future.done():
+                raise ValueError("An update is already in flight. Wait for it or cancel it first.")
+            future = PlanFuture(self)
+            self._future = future
+        try:
+            started = self.start(x0, sample_space, goal_bias, guide, xrand_gen, finish_on_goal, specific_time)
+        except Exception:
+            future._finish(None)
+            self._future = None
+            raise
+        if not started:
+            future._finish(False)
+            return future
+        worker = threading.Thread(target=future._run)
+        worker.daemon = True
+        worker.start()
+        return future
+
+    def _run_query(self):
+        """
+        Steps the started query until it is over and finalizes it,
+        returning what update_plan returns.
+
+        """
+        while not self.step():
+            pass
+
+        # Abrupt termination
+        if not self.killed:
+            self.finalize()
+        if self.killed or self.tree.size > self.max_nodes:
+            if self.printing:
+                print("Plan update terminated abruptly!")
+            self.killed = False
+            return False
+        else:
+            return True
+
+    def start(self, x0, sample_space, goal_bias=0,
+              guide=None, xrand_gen=None,
+              finish_on_goal=False, specific_time=None):
+        """
+        Begins a new planning query, with a new tree grown from the seed x0,
+        but without planning yet. The arguments are as in update_plan.
+        Then call step or step_for until they return True (or for as long
+        as you want), check on the plan with best_plan whenever you like,
+        and call finalize to end the query. In between, the planner can be
+        left alone without losing anything. Returns False if no goal has
+        been set yet (and doesn't begin the query), otherwise True.
+
         """
         # Safety first!
         x0 = np.array(x0, dtype=np.float64)
         if self.goal is None:
             print("No goal has been set yet!")
-            self.get_state = lambda t: x0
-            self.get_effort = lambda t: np.zeros(self.ncontrols)
+            get_state = lambda t: x0
+            get_effort = lambda t: np.zeros(self.ncontrols)
+            with self.lock:
+                self.get_state, self.get_effort = get_state, get_effort
+                self.interpolators = (get_state, get_effort)
             return False
 
         # Store timing
         if specific_time is None:
-            min_time = self.min_time
-            max_time = self.max_time
+            self._min_time = self.min_time
+            self._max_time = self.max_time
         else:
-            min_time = specific_time
-            max_time = specific_time
+            self._min_time = specific_time
+            self._max_time = specific_time
+        self._finish_on_goal = finish_on_goal
+
+        # The clock only counts if using it (samplers give up on it too, or after
+        # a streak of empty blocks without it, since iterations can't advance then)
+        out_of_time = lambda: self.use_clock and self.stats['time'] >= self._max_time
+        max_refills = None if self.use_clock else 100
 
         # Reset the tree
-        self.tree = Tree(x0, self.lqr(x0, np.zeros(self.ncontrols)))
+        if self.lazy_lqr:
+            lqr_policy = lambda x: self.lqr(x, np.zeros(self.ncontrols))
+        else:
+            lqr_policy = None
+        self.tree = Tree(x0, self.lqr(x0, np.zeros(self.ncontrols)), lqr_policy=lqr_policy)
+
+        # Reset the nearest-node index
+        self.index = None
+        if self.nn_method == 'kdtree':
+            try:
+                self.index = NearestIndex(self.lqr(x0, np.zeros(self.ncontrols))[0],
+                                          periods=self.constraints.periods, eps=self.nn_eps)
+                self.index.insert(x0)
+            except ValueError as error:
+                if self.printing:
+                    print("Cannot use kdtree search ({}), using brute force instead.".format(error))
+
+        # Informed sampling only works if the goal region is bounded in position
+        dims = self.position_dims
+        if self.max_speed and not np.any(np.isinf(np.array(self.constraints.goal_buffer)[dims])):
+            informed = lambda n: self._sample_informed(x0, n) if self.plan_reached_goal else None
+        else:
+            informed = None
 
         # If not given an xrand_gen function, make the standard one
+        self.sampler = None
         if xrand_gen is None:
 
-            # Properly cast the given goal bias
-            if goal_bias is None:
-                goal_bias = [0] * self.nstates
-            elif hasattr(goal_bias, '__contains__'):
-                if len(goal_bias) != self.nstates:
-                    raise ValueError("Expected goal_bias to be scalar or have same length as state.")
-            else:
-                goal_bias = [goal_bias] * self.nstates
-
-            # Properly cast the given sample space and extract statistics
-            sample_space = np.array(sample_space, dtype=np.float64)
-            if sample_space.shape != (self.nstates, 2):
-                raise ValueError("Expected sample_space to be list of nstates tuples.")
-            sampling_centers = np.mean(sample_space, axis=1)
-            sampling_spans = np.diff(sample_space).flatten()
-
             # Standard sampling
-            def xrand_gen(planner):
-                while time_elapsed < max_time:
-                    xrand = sampling_centers + sampling_spans*(np.random.sample(self.nstates)-0.5)
-                    for i, choice in enumerate(np.greater(goal_bias, np.random.sample())):
-                        if choice:
-                            xrand[i] = self.goal[i]
-                    if self.constraints.is_feasible(xrand, np.zeros(self.ncontrols)):
-                        return xrand
-                return self.goal
+            if self.sampling == 'halton':
+                sampler_class = HaltonSampler
+            else:
+                sampler_class = RejectionSampler
+            self.sampler = sampler_class(sample_space, goal_bias, self.constraints,
+                                         block_size=self.sample_block,
+                                         informed=informed, informed_dims=dims,
+                                         give_up=out_of_time, max_refills=max_refills, rng=self.rng)
+            xrand_gen = self.sampler
+
+        # A given sampler (like a GridSampler) is treated like the standard one,
+        # and its pool was drawn for some other query
+        elif isinstance(xrand_gen, RejectionSampler):
+            self.sampler = xrand_gen
+            self.sampler.informed = informed
+            self.sampler.informed_dims = dims
+            self.sampler.give_up = out_of_time
+            self.sampler.max_refills = max_refills
+            self.sampler.rng = self.rng
+            self.sampler.flush()
 
         # Otherwise, use given sampling function
         else:
@@ -213,89 +510,129 @@ class Planner:
             print("\n...planning...")
         self.plan_reached_goal = False
         self.T = np.inf
-        time_elapsed = 0
-        time_start = self.sys_time()
-
-        # Planning loop!
-        while True:
-
-            # Random sample state
-            xrand = xrand_gen(self)
-
-            # The "nearest" node to xrand has the least cost-to-go of all nodes
-            nearestID = np.argmin(self._costs_to_go(xrand))
-
-            # Candidate extension to the tree
-            xnew_seq, unew_seq = self._steer(nearestID, xrand, force_arrive=False)
-
-            # If steer produced any feasible results, extend tree
-            if len(xnew_seq) > 0:
-
-                # Add the new node to the tree
-                xnew = np.copy(xnew_seq[-1])
-                self.tree.add_node(nearestID, xnew, self.lqr(xnew, np.copy(unew_seq[-1])), xnew_seq, unew_seq)
-
-                # Check if the newest node reached the goal region
-                if self._in_goal(xnew):
-
-                    # Raise flag
-                    self.plan_reached_goal = True
+        self._informed = None
+        if self.sampler is not None:
+            self.sampler.reset_counts()
+        self._xrand_gen = xrand_gen
+        self.stats = {'iterations': 0, 'time': 0, 'first_plan_time': None, 'rejection_rate': 0,
+                      'pruned': 0, 'bound_pruned': 0, 'bound_skipped': 0}
+        self._time_start = self.sys_time()
+        self.planning = True
+        return True
+
+    def step(self, n=1):
+        """
+        Runs up to n more iterations of the current query's planning loop.
+        Returns True once the query's budget (see update_plan) says planning
+        is over, or if the planner was killed, and otherwise False. Stepping
+        further is allowed, but the budget will keep saying it is over.
 
-                    # Climb tree to construct sequence of states for this path
-                    node_seq = self.tree.climb(self.tree.size-1)
-                    x_seq, u_seq = self.tree.trajectory(node_seq)
+        """
+        if not self.planning:
+            raise ValueError("There is no query to step. Call start first.")
+
+        for i in xrange(n):
+
+            # Other threads (see update_plan_async) can look in between iterations
+            with self.lock:
+                # Extend the tree toward random samples
+                for ID in self._grow(self._xrand_gen):
+
+                    # Improve the tree around the new node, if rewiring
+                    changedIDs = [ID]
+                    if self.rewire and not self.rfactor and self.tree.active[ID]:
+                        changedIDs.extend(self._rewire(ID))
+
+                    # Check if the new node (or any node that got sooner) reached the goal region
+                    for changedID in changedIDs:
+                        if self.tree.active[changedID] and self._in_goal(self.tree.state[changedID]):
+                            self._consider_plan(changedID)
+
+                # For checking if we should stop planning
+                time_elapsed = self.sys_time() - self._time_start
+                self.stats['iterations'] += 1
+                self.stats['time'] = time_elapsed
+                if self.sampler is not None:
+                    self.stats['rejection_rate'] = self.sampler.rejection_rate
+                past_min = (time_elapsed >= self._min_time or not self.use_clock) and \
+                           self.stats['iterations'] >= self.min_iterations
+                past_max = (self.use_clock and time_elapsed >= self._max_time) or \
+                           self.stats['iterations'] >= self.max_iterations
+                if self.killed or (self.plan_reached_goal and past_min) or past_max or self.tree.size > self.max_nodes:
+                    return True
+        return False
+
+    def step_for(self, seconds):
+        """
+        Steps the current query for about the given number of seconds of
+        sys_time (at least one iteration), or until step says it is over.
+        Returns the same thing as step.
 
-                    # Expected time to complete this plan
-                    T = len(x_seq) * self.dt
+        """
+        start_time = self.sys_time()
+        while not self.step():
+            if self.sys_time() - start_time >= seconds:
+                return False
+        return True
 
-                    # Retain this plan if it is faster than the previous one
-                    if T < self.T:
-                        self.T = T
-                        self.node_seq = node_seq
-                        self.x_seq = x_seq
-                        self.u_seq = u_seq
-                        self.t_seq = np.arange(len(self.x_seq)) * self.dt
-                        if self.printing:
-                            print("Found plan at elapsed time: {} s".format(np.round(time_elapsed, 6)))
+    def best_plan(self):
+        """
+        Returns the best plan of the current query so far as a tuple
+        (x_seq, u_seq, reached). If no plan has reached the goal yet
+        (reached is False), it is the path to the node nearest the guide,
+        without the extra steer toward the guide that finalize tries.
+        With lazy checking, only its fully feasible part is returned.
 
-            # For checking if we should stop planning
-            time_elapsed = self.sys_time() - time_start
+        """
+        # The tree can't change partway through (see update_plan_async)
+        with self.lock:
+            if self.plan_reached_goal:
+                return self.x_seq, self.u_seq, True
+            node_seq = self.tree.climb(np.argmin(self._guide_costs()[0]))
+            if self.lazy_check:
+                node_seq = node_seq[:self._verify(node_seq)]
+            x_seq, u_seq = self.tree.trajectory(node_seq)
+            return x_seq, u_seq, False
+
+    def finalize(self):
+        """
+        Ends the current query, making its best plan the one that
+        get_state(t) and get_effort(t) interpolate (see update_plan).
+        Can be called at any point in the query.
 
-            # Abrupt termination
-            if self.killed:
-                break
+        """
+        if not self.planning:
+            raise ValueError("There is no query to finalize. Call start first.")
+        # The tree can't change partway through (see update_plan_async)
+        with self.lock:
+            self.planning = False
 
             # Close-out for reached-goal
-            elif self.plan_reached_goal and time_elapsed >= min_time:
-                if finish_on_goal:
+            if self.plan_reached_goal:
+                if self._finish_on_goal:
                     # Steer to exact goal
                     xgoal_seq, ugoal_seq = self._steer(self.node_seq[-1], self.goal, force_arrive=True)
                     # If it works, tack it onto the plan
                     if len(xgoal_seq) > 0:
-                        self.tree.add_node(self.node_seq[-1], self.goal, None, xgoal_seq, ugoal_seq)
+                        self._add_node(self.node_seq[-1], self.goal, None, xgoal_seq, ugoal_seq)
                         self.node_seq.append(self.tree.size-1)
-                        self.x_seq.extend(xgoal_seq)
-                        self.u_seq.extend(ugoal_seq)
+                        self.x_seq = np.concatenate((self.x_seq, xgoal_seq))
+                        self.u_seq = np.concatenate((self.u_seq, ugoal_seq))
                         self.t_seq = np.arange(len(self.x_seq)) * self.dt
                 # Over and out!
                 if self.printing:
                     print("Tree size: {0}\nETA: {1} s".format(self.tree.size, np.round(self.T, 2)))
-                self._prepare_interpolators()
-                break
 
             # Close-out for didn't-reach-goal
-            elif time_elapsed >= max_time or self.tree.size > self.max_nodes:
+            else:
                 # Find close node that has the most potential to steer to the guide state
-                Sgoal = self.lqr(self.xguide, np.zeros(self.ncontrols))[0]
-                for i, g in enumerate(self.constraints.goal_buffer):
-                    if np.isinf(g):
-                        Sgoal[:, i] = 0
-                goaldiffs = self.tree.state - self.xguide
-                closestIDs = np.argsort(np.sum(np.tensordot(goaldiffs, Sgoal, axes=1) * goaldiffs, axis=1))
+                goalcosts, Sgoal = self._guide_costs()
+                closestIDs = np.argsort(goalcosts)
                 best_dist = np.inf
                 self.horizon_iters *= self.CPF
-                for i, ID in enumerate(closestIDs[:np.ceil(0.02*self.tree.size)]):
-                    xcheck_seq, ucheck_seq = self._steer(ID, self.xguide, force_arrive=False)
+                candidateIDs = closestIDs[:int(np.ceil(0.02*self.tree.size))]
+                candidate_seqs = self._steer_many(candidateIDs, np.tile(self.xguide, (len(candidateIDs), 1)))
+                for ID, (xcheck_seq, ucheck_seq) in zip(candidateIDs, candidate_seqs):
                     if len(xcheck_seq) > 1:
                         diff = xcheck_seq[-1] - self.xguide
                         dist = diff.dot(Sgoal.dot(diff))
@@ -306,10 +643,13 @@ class Planner:
                             best_ucheck_seq = ucheck_seq
                 self.set_resolution()
                 if not np.isinf(best_dist):
-                    self.tree.add_node(best_ID, best_xcheck_seq[-1], None, best_xcheck_seq, best_ucheck_seq)
+                    self._add_node(best_ID, best_xcheck_seq[-1], None, best_xcheck_seq, best_ucheck_seq)
                     self.node_seq = self.tree.climb(self.tree.size-1)
                 else:
                     self.node_seq = self.tree.climb(closestIDs[0])
+                # With lazy checking, only keep the part of the path that is fully feasible
+                if self.lazy_check:
+                    self.node_seq = self.node_seq[:self._verify(self.node_seq)]
                 # Construct plan
                 self.x_seq, self.u_seq = self.tree.trajectory(self.node_seq)
                 self.T = len(self.x_seq) * self.dt
@@ -317,34 +657,506 @@ class Planner:
                 # Over and out!
                 if self.printing:
                     print("Didn't reach goal.\nTree size: {0}\nETA: {1} s".format(self.tree.size, np.round(self.T, 2)))
-                self._prepare_interpolators()
-                break
+            self._prepare_interpolators()
 
-        if self.killed or self.tree.size > self.max_nodes:
+#################################################
+
+    def _grow(self, xrand_gen):
+        """
+        Extends the tree toward batch_size random samples
+        (per thread) from xrand_gen. Returns a list of the
+        IDs of the nodes that were added.
+
+        """
+        # Steps between feasibility checks of new edges (lazy checking needs a fixed horizon)
+        stride = 1 if self.rfactor else max(self.lazy_check, 1)
+
+        # Batches of random sample states, one per thread, extended toward all at once
+        if self.threads > 1:
+            xrands = np.array([xrand_gen(self) for i in xrange(self.threads*self.batch_size)])
+            newIDs = self._thread_pool.map(lambda X: self._extend(X, stride), np.array_split(xrands, self.threads))
+            return sorted(sum(newIDs, []))
+
+        # One sample at a time
+        if self.batch_size == 1:
+
+            # Random sample state
+            xrand = xrand_gen(self)
+
+            # The "nearest" node to xrand has the least cost-to-go of all nodes
+            nearestID = self._nearest(xrand)
+
+            # Candidate extension to the tree
+            xnew_seq, unew_seq = self._steer(nearestID, xrand, force_arrive=False, stride=stride)
+
+            # If steer produced any feasible results that could still beat the plan, extend tree
+            if len(xnew_seq) > 0 and not self._bounded(nearestID, len(xnew_seq)):
+                xnew = xnew_seq[-1]
+                if self.lazy_lqr:
+                    lqrnew = None
+                else:
+                    lqrnew = self.lqr(self._copy(xnew), self._copy(unew_seq[-1]))
+                self._add_node(nearestID, xnew, lqrnew, xnew_seq, unew_seq, verified=stride == 1)
+                return [self.tree.size-1]
+            return []
+
+        # Batch of random sample states
+        xrands = np.array([xrand_gen(self) for i in xrange(self.batch_size)])
+        return self._extend(xrands, stride)
+
+    def _extend(self, xrands, stride):
+        """
+        Extends the tree toward each row of the array xrands from its
+        nearest node, with the given stride between feasibility checks.
+        Returns a list of the IDs of the nodes that were added. The tree
+        is only locked to find the nearest nodes and to add the new ones,
+        so several threads can do this at once (see threads).
+
+        """
+        # All their nearest nodes at once
+        with self.tree.lock:
+            nearestIDs = self._nearest_many(xrands)
+
+        # Candidate extensions to the tree, keeping the ones with feasible results that could still beat the plan
+        seqs = self._steer_many(nearestIDs, xrands, stride)
+        with self.tree.lock:
+            keep = [len(xnew_seq) > 0 and not self._bounded(nearestID, len(xnew_seq))
+                    for nearestID, (xnew_seq, unew_seq) in zip(nearestIDs, seqs)]
+        new = ([], [], [], [], [])
+        for nearestID, (xnew_seq, unew_seq), kept in zip(nearestIDs, seqs, keep):
+            if kept:
+                xnew = xnew_seq[-1]
+                if self.lazy_lqr:
+                    lqrnew = None
+                else:
+                    lqrnew = self.lqr(self._copy(xnew), self._copy(unew_seq[-1]))
+                for feature, value in zip(new, (nearestID, xnew, lqrnew, xnew_seq, unew_seq)):
+                    feature.append(value)
+
+        # Extend tree with all of them in one go
+        return self._add_nodes(*new, verified=stride == 1)
+
+#################################################
+
+    def _rewire(self, ID):
+        """
+        Given the ID of a new node, reparents it to whichever of its
+        nearby nodes reaches it soonest, and then reparents each of those
+        nearby nodes to it if that gets them there sooner (unless they are
+        on the current plan). Returns a list of the IDs of all nodes whose
+        cost-to-come went down.
+
+        """
+        x = self.tree.state[ID]
+        nearIDs = [nearID for nearID in self._near(x, self.rewire+1, self.rewire_cost) if nearID != ID]
+        if not nearIDs:
+            return []
+        planIDs = set(self.node_seq) if self.plan_reached_goal else set()
+        improvedIDs = []
+
+        # Choose the parent that gets to the new node soonest
+        pID = self.tree.pID[ID]
+        best_cost = self.tree.cost[ID]
+        best_pID = None
+        for nearID, (x_seq, u_seq) in zip(nearIDs, self._steer_many(nearIDs, np.tile(x, (len(nearIDs), 1)))):
+            cost = self.tree.cost[nearID] + len(x_seq)
+            if nearID != pID and cost < best_cost and self._reached(x, x_seq):
+                best_cost = cost
+                best_pID = nearID
+                best_x_seq = x_seq
+                best_u_seq = u_seq
+        if best_pID is not None:
+            improvedIDs.extend(self._reparent(ID, best_pID, best_x_seq, best_u_seq))
+
+        # Rewire the nearby nodes through the new node wherever that gets them there sooner
+        X = np.array(self.tree.state[nearIDs])
+        for nearID, xnear, (x_seq, u_seq) in zip(nearIDs, X, self._steer_many([ID]*len(nearIDs), X)):
+            cost = self.tree.cost[ID] + len(x_seq)
+            if nearID != 0 and nearID not in planIDs and self.tree.active[nearID] and \
+               cost < self.tree.cost[nearID] and self._reached(xnear, x_seq):
+                improvedIDs.extend(self._reparent(nearID, ID, x_seq, u_seq))
+        return improvedIDs
+
+    def _reparent(self, ID, pID, x_seq, u_seq):
+        """
+        Rewires the node with the given ID to the parent pID through the
+        given (feasible) edge, which moves the node to the end of that edge.
+        Then the edges of its subtree are re-simulated from there with their
+        same efforts, so they are still what the dynamics do, and fully
+        checked for feasibility. Any that fail are pruned with their subtrees
+        (and already pruned ones are left alone). Returns an array of the IDs
+        of the subtree that are still active.
+
+        """
+        with self.tree.lock:
+            IDs = self.tree.rewire(ID, pID, x_seq, u_seq)
+            IDs = IDs[self.tree.active[IDs]]
+            self._set_lqr(ID, u_seq[-1])
+            for cID in IDs[1:]:
+                self.tree.reroll(cID, self._reroll(self.tree.state[self.tree.pID[cID]], self.tree.u_seq[cID]))
+                self._set_lqr(cID, self.tree.u_seq[cID][-1])
+            if self.index is not None:
+                self.index.move(IDs, self.tree.state[IDs])
+
+            # Prune whatever the new edges made infeasible
+            rerolled = IDs[1:]
+            if len(rerolled):
+                feasible = self.constraints.feasible_mask(*self.tree.trajectory(rerolled))
+                if not np.all(feasible):
+                    ends = np.cumsum([len(self.tree.x_seq[cID]) for cID in rerolled])
+                    infeasible = [cID for cID, start, end in zip(rerolled, np.concatenate(([0], ends[:-1])), ends)
+                                  if not np.all(feasible[start:end])]
+                    self._prune(infeasible)
+            return IDs[self.tree.active[IDs]]
+
+    def _reroll(self, x, u_seq):
+        """
+        Returns the array of states (one per row) that the dynamics
+        go through from the state x under the given sequence of efforts.
+
+        """
+        x_seq = np.zeros((len(u_seq), self.nstates))
+        for i, u in enumerate(u_seq):
+            x = self.dynamics(self._copy(x), self._copy(u), self.dt)
+            x_seq[i] = x
+        return x_seq
+
+    def _set_lqr(self, ID, u):
+        """
+        Recomputes the stored lqr of the node with the given ID for its
+        current state and the given effort (unless using lazy_lqr).
+
+        """
+        if not self.lazy_lqr:
+            self.tree.lqr.set(ID, self.lqr(self._copy(self.tree.state[ID]), self._copy(u)))
+
+    def _reached(self, x, x_seq):
+        """
+        Returns True if the given sequence of states
+        ends within connect_tol of the state x.
+
+        """
+        return len(x_seq) > 0 and np.all(np.abs(self.erf(self._copy(x), self._copy(x_seq[-1]))) <= self.connect_tol)
+
+#################################################
+
+    def _consider_plan(self, ID):
+        """
+        Given the ID of a node in the goal region, retains the
+        plan that ends at that node if it is faster than the
+        current plan.
+
+        """
+        # Climb tree to construct sequence of states for this path
+        node_seq = self.tree.climb(ID)
+        x_seq, u_seq = self.tree.trajectory(node_seq)
+
+        # Expected time to complete this plan
+        T = len(x_seq) * self.dt
+
+        # With lazy checking, a path only counts once it is verified fully feasible
+        if self.lazy_check and T < self.T and self._verify(node_seq) < len(node_seq):
+            return
+
+        # Raise flag
+        if not self.plan_reached_goal:
+            self.stats['first_plan_time'] = self.stats['time']
+        self.plan_reached_goal = True
+
+        # Retain this plan if it is faster than the previous one
+        if T < self.T:
+            self.T = T
+            self.node_seq = node_seq
+            self.x_seq = x_seq
+            self.u_seq = u_seq
+            self.t_seq = np.arange(len(self.x_seq)) * self.dt
             if self.printing:
-                print("Plan update terminated abruptly!")
-            self.killed = False
-            return False
-        else:
+                print("Found plan at elapsed time: {} s".format(np.round(self.stats['time'], 6)))
+            if self.bound:
+                self._bound()
+
+    def _bounded(self, ID, nsteps):
+        """
+        Returns True if a node nsteps timesteps past the node with
+        the given ID can't be on a plan faster than the current one
+        (when bounding), and counts it as a skipped extension.
+
+        """
+        if self.bound and self.plan_reached_goal and self.tree.cost[ID] + nsteps + 1 >= len(self.x_seq):
+            self.stats['bound_skipped'] += 1
             return True
+        return False
+
+    def _bound(self):
+        """
+        Prunes every node that can't be on a plan faster than the current
+        one, except for the nodes of the current plan itself. A plan through
+        a node has at least one more state than the node's cost-to-come, and
+        costs only grow from parent to child.
+
+        """
+        IDs = np.flatnonzero(self.tree.active & (self.tree.cost + 1 >= len(self.x_seq)))
+        IDs = IDs[(IDs > 0) & ~np.in1d(IDs, self.node_seq)]
+        if len(IDs):
+            self._prune(IDs, 'bound_pruned')
+
+#################################################
+
+    def _guide_costs(self, X=None):
+        """
+        Returns the array of costs-to-go from every node to the guide
+        state (inf for pruned nodes), using the guide's cost-to-go matrix
+        with the dimensions that have no goal buffer ignored, along with
+        that matrix. If an array of states X is given, the costs-to-go
+        are from its rows instead of from the nodes.
+
+        """
+        Sgoal = np.array(self.lqr(self.xguide, np.zeros(self.ncontrols))[0], dtype=np.float64)
+        for i, g in enumerate(self.constraints.goal_buffer):
+            if np.isinf(g):
+                Sgoal[:, i] = 0
+        if X is not None:
+            goaldiffs = self.constraints.wrap(np.asarray(X, dtype=np.float64) - self.xguide)
+            return np.sum(np.tensordot(goaldiffs, Sgoal, axes=1) * goaldiffs, axis=1), Sgoal
+        goaldiffs = self.constraints.wrap(self.tree.state - self.xguide)
+        goalcosts = np.sum(np.tensordot(goaldiffs, Sgoal, axes=1) * goaldiffs, axis=1)
+        if self.tree.npruned:
+            goalcosts[~self.tree.active] = np.inf
+        return goalcosts, Sgoal
+
+    def _sample_informed(self, x0, n):
+        """
+        Returns an (n, len(position_dims)) array of uniform random
+        samples of the position_dims from the
+        ellipsoid of positions that a path from x0 to the goal region
+        could pass through at no more than max_speed while arriving
+        sooner than the current plan. Returns None if the ellipsoid
+        is degenerate (max_speed is too small for the current plan).
+
+        """
+        # The ellipsoid only changes when the plan does
+        if self._informed is None or self._informed[0] != self.T:
+            dims = self.position_dims
+            focus0 = x0[dims]
+            focus1 = np.array(self.goal, dtype=np.float64)[dims]
+            dmin = npl.norm(focus1 - focus0)
+            dmax = self.max_speed*self.T + npl.norm(np.array(self.constraints.goal_buffer)[dims])
+            if dmax <= dmin:
+                transform = None
+            else:
+                # Rotation taking the first axis to the direction between foci
+                if dmin > 0:
+                    U, s, Vt = npl.svd(np.outer((focus1 - focus0)/dmin, np.eye(len(dims))[0]))
+                    signs = np.ones(len(dims))
+                    signs[-1] = npl.det(U)*npl.det(Vt)
+                    rotation = U.dot(np.diag(signs)).dot(Vt)
+                else:
+                    rotation = np.eye(len(dims))
+                radii = np.append(dmax/2, [np.sqrt(dmax**2 - dmin**2)/2]*(len(dims)-1))
+                transform = rotation * radii
+            self._informed = (self.T, (focus0 + focus1)/2, transform)
+
+        # Uniform samples of the unit ball, stretched into the ellipsoid
+        T, center, transform = self._informed
+        if transform is None:
+            return None
+        balls = self.rng.normal(size=(n, len(center)))
+        balls *= (self.rng.random_sample((n, 1))**(1/len(center))) / npl.norm(balls, axis=1)[:, np.newaxis]
+        return center + balls.dot(transform.T)
+
+#################################################
+
+    def _nearest(self, x):
+        """
+        Returns the ID of the node with the least cost-to-go to x,
+        using the nearest-node index if it applies to x's S.
+
+        """
+        S = self.lqr(x, np.zeros(self.ncontrols))[0]
+        if self.index is not None and self.index.matches(S):
+            return self.index.nearest(x)[0]
+        return np.argmin(self._costs_to_go(x, S))
 
 #################################################
 
-    def _costs_to_go(self, x):
+    def _costs_to_go(self, x, S=None):
         """
         Returns an array of costs to go to x for each node in the
         current tree, in the same ordering as the nodes. This cost
         is  (v-x).T * S * (v-x)  for each node state v where S is
-        found by LQR about x, not v.
+        found by LQR about x, not v (unless S is given). Pruned
+        nodes get an infinite cost.
+
+        """
+        if S is None:
+            S = self.lqr(x, np.zeros(self.ncontrols))[0]
+        diffs = self.constraints.wrap(self.tree.state - x)
+        costs = np.sum(np.tensordot(diffs, S, axes=1) * diffs, axis=1)
+        if self.tree.npruned:
+            costs[~self.tree.active] = np.inf
+        return costs
+
+    def _near(self, x, k, max_cost=np.inf):
+        """
+        Returns an array of the IDs of the (up to) k active nodes with
+        the least cost-to-go to x that is at most max_cost, sorted from
+        least cost-to-go, using the nearest-node index if it applies.
 
         """
         S = self.lqr(x, np.zeros(self.ncontrols))[0]
-        diffs = self.tree.state - x
-        return np.sum(np.tensordot(diffs, S, axes=1) * diffs, axis=1)
+        if self.index is not None and self.index.matches(S):
+            return self.index.nearest_k(x, k, max_cost)[0]
+        costs = self._costs_to_go(x, S)
+        if k < len(costs):
+            IDs = np.argpartition(costs, k)[:k]
+            IDs = IDs[np.argsort(costs[IDs])]
+        else:
+            IDs = np.argsort(costs)
+        return IDs[np.isfinite(costs[IDs]) & (costs[IDs] <= max_cost)]
+
+#################################################
+
+    def _nearest_many(self, X):
+        """
+        Returns an array of the IDs of the nodes with the least
+        cost-to-go to each row of the array of states X.
+
+        """
+        S = [self.lqr(x, np.zeros(self.ncontrols))[0] for x in X]
+        if self.index is not None and all(self.index.matches(Si) for Si in S):
+            return self.index.nearest_many(X)[0]
+        if all(Si is S[0] or np.array_equal(Si, S[0]) for Si in S):
+            return np.argmin(self._costs_to_go_many(X, S[0]), axis=1)
+        return np.array([np.argmin(self._costs_to_go(x, Si)) for x, Si in zip(X, S)])
+
+#################################################
+
+    def _costs_to_go_many(self, X, S, chunk_floats=2**20):
+        """
+        Returns a (len(X), tree.size) array of the costs to go
+        from each node to each row of the array of states X,
+        all using the same cost-to-go matrix S. The nodes are
+        processed in chunks of about chunk_floats differences.
+
+        """
+        states = self.tree.state
+        costs = np.zeros((len(X), len(states)))
+        chunk = max(1, chunk_floats // (len(X) * self.nstates))
+        for i in xrange(0, len(states), chunk):
+            diffs = self.constraints.wrap(states[np.newaxis, i:i+chunk] - X[:, np.newaxis])
+            costs[:, i:i+chunk] = np.sum(np.dot(diffs, S) * diffs, axis=2)
+        if self.tree.npruned:
+            costs[:, ~self.tree.active] = np.inf
+        return costs
 
 #################################################
 
-    def _steer(self, ID, xtar, force_arrive=False):  #<<< need to numpy this function for final speedup!
+    def _steer_many(self, IDs, Xtar, stride=1):
+        """
+        Steers from each of the given node IDs toward the corresponding
+        row of the array Xtar, with force_arrive False and the given
+        stride between feasibility checks (see _steer). Returns a list of
+        (x_seq, u_seq) tuples, one per ID, like _steer returns. Uses the
+        batched steering engine when the batched system functions are set.
+        Unlike with _steer, the returned arrays are the caller's to keep.
+
+        """
+        if self.dynamics_batch is not None and self.lqr_batch is not None and not self.rfactor:
+            return self._steer_batch(IDs, Xtar, stride)
+        seqs = []
+        for ID, xtar in zip(IDs, Xtar):
+            x_seq, u_seq = self._steer(ID, xtar, force_arrive=False, stride=stride)
+            seqs.append((np.copy(x_seq), np.copy(u_seq)))
+        return seqs
+
+#################################################
+
+    def _steer_batch(self, IDs, Xtar, stride=1):
+        """
+        Does the same as calling _steer (with force_arrive False and a
+        fixed horizon) for each of the given node IDs toward each row of
+        the array Xtar, but propagates all of the extensions together as
+        (N, nstates) arrays through the batched system functions. Rollouts
+        are masked out as they finish or become infeasible. Feasibility is
+        only checked every stride steps, and on each rollout's last step.
+
+        Returns a list of (x_seq, u_seq) tuples, one per ID, where each
+        sequence is an array with one state or effort per row.
+
+        """
+        # Set up
+        N = len(IDs)
+        X = np.array(self.tree.state[IDs])
+        if self.lazy_lqr:
+            K = np.array(self.lqr_batch(self._copy(X), np.zeros((N, self.ncontrols)))[1])
+        else:
+            K = np.array([self.tree.lqr[ID][1] for ID in IDs])
+        x_hist = np.zeros((self.horizon_iters, N, self.nstates))
+        u_hist = np.zeros((self.horizon_iters, N, self.ncontrols))
+        lengths = np.zeros(N, dtype=np.int64)
+        safe = np.zeros(N, dtype=np.int64)
+        active = np.arange(N)
+
+        # Simulate
+        i = 0
+        while True:
+
+            # Compute efforts using local LQR policies
+            E = self._erf_many(Xtar[active], X[active])
+            U = np.einsum('nij,nj->ni', K[active], E)
+
+            # Step forward dynamics
+            Xnext = self.dynamics_batch(X[active], self._copy(U), self.dt)
+
+            # Horizon, or tolerable convergence criteria
+            i += 1
+            finished = np.all(np.abs(E) <= self.error_tol, axis=1) | (i > self.horizon_iters)
+
+            # Check for feasibility, retaining only part of the known feasible part of infeasible paths
+            if stride == 1:
+                check = np.ones(len(active), dtype=bool)
+                feasible = self.constraints.feasible_mask(Xnext, U)
+            else:
+                check = finished | (i % stride == 0)
+                feasible = np.ones(len(active), dtype=bool)
+                feasible[check] = self.constraints.feasible_mask(Xnext[check], U[check])
+            failed = active[~feasible]
+            lengths[failed] = (self.FPR * safe[failed]).astype(np.int64)
+
+            # Record the rollouts that keep going
+            going = feasible & ~finished
+            checked = active[going & check]
+            active = active[going]
+            if not len(active):
+                break
+            X[active] = Xnext[going]
+            x_hist[i-1, active] = Xnext[going]
+            u_hist[i-1, active] = U[going]
+            lengths[active] += 1
+            safe[checked] = lengths[checked]
+
+            # Get next control policies
+            K[active] = self.lqr_batch(X[active], U[going])[1]
+
+        return [(x_hist[:n, k], u_hist[:n, k]) for k, n in enumerate(lengths)]
+
+#################################################
+
+    def _erf_many(self, Xgoal, X):
+        """
+        Returns the array of errors between each
+        row of the arrays of states Xgoal and X.
+
+        """
+        if self.erf_batch is not None:
+            return self.erf_batch(Xgoal, X)
+        if self.erf is np.subtract:
+            return np.subtract(Xgoal, X)
+        return np.array([self.erf(xgoal, x) for xgoal, x in zip(Xgoal, X)])
+
+#################################################
+
+    def _steer(self, ID, xtar, force_arrive=False, stride=1):  #<<< need to numpy this function for final speedup!
         """
         Starting from the given node ID's state, the system dynamics are
         forward simulated using the local LQR policy toward xtar.
@@ -353,47 +1165,65 @@ class Planner:
         is finished and the path returned is half what was generated.
 
         If force_arrive is set to True, then the simulation isn't finished
-        until xtar is achieved or until a physical timeout.
+        until xtar is achieved or until a timeout (see arrive_steps).
 
         If it is False, then the simulation will stop after self.horizon sim
         seconds or if the error drops below some reasonable self.error_tol.
-
-        Returns the sequences of states and efforts. Note that the initial
-        state is not included in the returned trajectory (to avoid tree overlap).
+        In that case with a fixed horizon, if the constraints have a batched
+        feasibility function, the whole rollout is checked in one call at the
+        end instead of step by step. The result is the same. Giving a stride
+        bigger than 1 (with a fixed horizon) only checks every stride-th step
+        and the last step, for lazy collision checking.
+
+        Returns the sequences of states and efforts as arrays with one
+        state or effort per row. Note that the initial state is not included
+        in the returned trajectory (to avoid tree overlap). The arrays are
+        views into the calling thread's reused rollout buffer, so they are only
+        valid until its next call to _steer; copy them to keep them longer.
 
         """
         # Set up
-        K = np.copy(self.tree.lqr[ID][1])
-        x = np.copy(self.tree.state[ID])
-        x_seq = []; u_seq = []
+        K = self.tree.lqr[ID][1]
+        x = self.tree.state[ID]
+        rollout = self._rollout()
+        n = 0
         last_emag = np.inf
+        defer = (self.constraints.is_feasible_batch is not None or stride > 1) and not force_arrive and not self.rfactor
 
         # Management
-        i = 0; elapsed_time = 0
-        start_time = self.sys_time()
+        i = 0
+        if force_arrive:
+            arrive_steps = self.arrive_steps
+            if not arrive_steps and not self.use_clock:
+                arrive_steps = 1000
+            if not arrive_steps:
+                start_time = self.sys_time()
 
         # Simulate
         while True:
 
             # Compute effort using local LQR policy
-            e = self.erf(np.copy(xtar), np.copy(x))
+            e = self.erf(self._copy(xtar), self._copy(x))
             u = K.dot(e)
 
             # Step forward dynamics
-            x = self.dynamics(np.copy(x), np.copy(u), self.dt)
+            x = self.dynamics(self._copy(x), self._copy(u), self.dt)
 
-            # Check for feasibility
-            if not self.constraints.is_feasible(x, u):
-                x_seq = x_seq[:int(self.FPR * len(x_seq))]
-                u_seq = u_seq[:int(self.FPR * len(u_seq))]
+            # Check for feasibility (unless deferred)
+            if not defer and not self.constraints.is_feasible(x, u):
+                n = int(self.FPR * n)
                 break
 
             # Check force-arrive finish criteria
             if force_arrive:
 
-                # Physical time limit
-                elapsed_time = self.sys_time() - start_time
-                if elapsed_time > np.clip(self.min_time/2, 0.1, np.inf):
+                # Time limit, in steps or physical
+                i += 1
+                if arrive_steps:
+                    timed_out = i >= arrive_steps
+                else:
+                    timed_out = self.sys_time() - start_time > np.clip(self.min_time/2, 0.1, np.inf)
+                if timed_out:
                     if self.printing:
                         print("(exact goal-convergence timed-out)")
                     break
@@ -410,7 +1240,7 @@ class Planner:
                 # "Reachability" heuristic
                 if self.rfactor:
                     if np.all(emag >= last_emag):
-                        x_seq = []; u_seq = []
+                        n = 0
                         self.horizon_iters = int(np.clip(self.horizon_iters/self.rfactor, 1, 1/self.dt))
                         break
                     if i == self.horizon_iters:
@@ -422,39 +1252,142 @@ class Planner:
                     break
 
             # Record
-            x_seq.append(x)
-            u_seq.append(u)
+            if n == len(rollout.x):
+                rollout.reserve(n+1)
+            rollout.x[n] = x
+            rollout.u[n] = u
+            n += 1
 
             # Get next control policy
             K = self.lqr(x, u)[1]
 
-        return (x_seq, u_seq)
+        # Deferred feasibility check, including the last step that wasn't recorded
+        if defer:
+            rollout.reserve(n+1)
+            rollout.x[n] = x
+            rollout.u[n] = u
+            steps = np.arange(n+1)
+            if stride > 1:
+                steps = np.union1d(steps[stride-1::stride], [n])
+            feasible = self.constraints.feasible_mask(rollout.x[steps], rollout.u[steps])
+            if not np.all(feasible):
+                # Only the steps up to the last one that passed are known to be feasible
+                j = np.argmin(feasible)
+                n = int(self.FPR * (steps[j-1]+1 if j else 0))
+
+        return (rollout.x[:n], rollout.u[:n])
+
+    def _rollout(self):
+        """
+        Returns the calling thread's RolloutBuffer for _steer,
+        since several threads can be steering at once (see threads).
+
+        """
+        rollout = getattr(self._local, 'rollout', None)
+        if rollout is None:
+            rollout = self._local.rollout = RolloutBuffer(self.nstates, self.ncontrols)
+        return rollout
+
+#################################################
+
+    def _add_node(self, pID, state, lqr, x_seq, u_seq, verified=True):
+        """
+        Adds a node to the tree and to the nearest-node index.
+
+        """
+        with self.tree.lock:
+            self.tree.add_node(pID, state, lqr, x_seq, u_seq, verified)
+            if self.index is not None:
+                self.index.insert(state)
+
+    def _add_nodes(self, pIDs, states, lqrs, x_seqs, u_seqs, verified=True):
+        """
+        Adds many nodes to the tree and to the nearest-node index
+        in one go. Returns a list of the IDs of the new nodes.
+
+        """
+        if not len(pIDs):
+            return []
+        # Both at once, so that the IDs match when several threads add nodes
+        with self.tree.lock:
+            self.tree.add_nodes(pIDs, states, lqrs, x_seqs, u_seqs, verified)
+            if self.index is not None:
+                self.index.extend(np.asarray(states))
+            return list(range(self.tree.size-len(pIDs), self.tree.size))
+
+#################################################
+
+    def _verify(self, node_seq):
+        """
+        Fully checks the feasibility of every edge along the given
+        sequence of node IDs that hasn't been verified yet. The first
+        edge found to be infeasible is pruned with its subtree. Returns
+        the number of leading nodes of node_seq that are verified
+        (so len(node_seq) means the whole path is feasible).
+
+        """
+        # Check all unverified edges with one batch of feasibility checks
+        unverified = [ID for ID in node_seq if not self.tree.verified[ID]]
+        if not unverified:
+            return len(node_seq)
+        x_seq, u_seq = self.tree.trajectory(unverified)
+        feasible = self.constraints.feasible_mask(x_seq, u_seq)
+
+        # Mark the feasible ones, up to the first infeasible one, which gets pruned
+        ends = np.cumsum([len(self.tree.x_seq[ID]) for ID in unverified])
+        for ID, start, end in zip(unverified, np.concatenate(([0], ends[:-1])), ends):
+            if not np.all(feasible[start:end]):
+                self._prune(ID)
+                return node_seq.index(ID)
+            self.tree.verified[ID] = True
+        return len(node_seq)
+
+    def _prune(self, ID, stat='pruned'):
+        """
+        Prunes the node with the given ID (or array of IDs) and its
+        subtree from the tree and from the nearest-node index, counting
+        the pruned nodes in the given entry of self.stats.
+
+        """
+        pruned = self.tree.prune(ID)
+        if self.index is not None:
+            self.index.remove(pruned)
+        self.stats[stat] += len(pruned)
 
 #################################################
 
     def _in_goal(self, x):
         """
         Returns True if some state x is in the goal region.
+        Periodic dimensions are compared by wrapped difference.
 
         """
-        return all(goal_span[0] < v < goal_span[1] for goal_span, v in zip(self.goal_region, x))
+        return np.all(np.abs(self.constraints.wrap(x - self.goal)) < self.constraints.goal_buffer)
 
 #################################################
 
     def _prepare_interpolators(self):
         """
         Updates the interpolator functions the user calls
-        to interpolate the current plan.
+        to interpolate the current plan. Both are built first and
+        then swapped in together while holding self.lock, so anyone
+        holding self.lock sees a matching pair. They are also swapped
+        in as the one tuple self.interpolators, so anyone taking them
+        from there sees a matching pair without the lock.
 
         """
         if len(self.x_seq) == 1:
-            self.get_state = lambda t: self.x_seq[0]
-            self.get_effort = lambda t: np.zeros(self.ncontrols)
+            x_final = self.x_seq[0]
+            get_state = lambda t: x_final
+            get_effort = lambda t: np.zeros(self.ncontrols)
         else:
-            self.get_state = interp1d(self.t_seq, np.array(self.x_seq), axis=0, assume_sorted=True,
-                                      bounds_error=False, fill_value=self.x_seq[-1][:])
-            self.get_effort = interp1d(self.t_seq, np.array(self.u_seq), axis=0, assume_sorted=True,
-                                      bounds_error=False, fill_value=self.u_seq[-1][:])
+            get_state = interp1d(self.t_seq, np.array(self.x_seq), axis=0, assume_sorted=True,
+                                 bounds_error=False, fill_value=self.x_seq[-1][:])
+            get_effort = interp1d(self.t_seq, np.array(self.u_seq), axis=0, assume_sorted=True,
+                                  bounds_error=False, fill_value=self.u_seq[-1][:])
+        with self.lock:
+            self.get_state, self.get_effort = get_state, get_effort
+            self.interpolators = (get_state, get_effort)
 
 #################################################
 
@@ -481,7 +1414,8 @@ class Planner:
 
 #################################################
 
-    def set_runtime(self, min_time=None, max_time=None, max_nodes=None, sys_time=None):
+    def set_runtime(self, min_time=None, max_time=None, max_nodes=None, sys_time=None,
+                    min_iterations=None, max_iterations=None, use_clock=None, arrive_steps=None):
         """
         See class docstring for argument definitions.
         Arguments not given are not modified.
@@ -505,6 +1439,24 @@ class Planner:
             else:
                 raise ValueError("Expected sys_time to be a function.")
 
+        if min_iterations is not None:
+            self.min_iterations = min_iterations
+
+        if max_iterations is not None:
+            self.max_iterations = max_iterations
+
+        if self.min_iterations > self.max_iterations:
+            raise ValueError("The min_iterations must be less than or equal to the max_iterations.")
+
+        if use_clock is not None:
+            self.use_clock = bool(use_clock)
+
+        if arrive_steps is not None:
+            if int(arrive_steps) >= 0:
+                self.arrive_steps = int(arrive_steps)
+            else:
+                raise ValueError("The arrive_steps must be nonnegative.")
+
 #################################################
 
     def set_resolution(self, horizon=None, dt=None, FPR=None, CPF=None, error_tol=None):
@@ -535,6 +1487,8 @@ class Planner:
             self.horizon_iters = int(self.horizon / self.dt)
             self.rfactor = 0
         elif self.horizon == 0:
+            if getattr(self, 'threads', 1) > 1:
+                raise ValueError("A horizon of 0 can't be used with more than 1 thread.")
             self.horizon_iters = 1
             self.rfactor = int(2)
         else:
@@ -542,11 +1496,15 @@ class Planner:
 
 #################################################
 
-    def set_system(self, dynamics=None, lqr=None, constraints=None, erf=None):
+    def set_system(self, dynamics=None, lqr=None, constraints=None, erf=None, lazy_lqr=None,
+                   dynamics_batch=None, lqr_batch=None, erf_batch=None, pure_callbacks=None):
         """
         See class docstring for argument definitions.
         Arguments not given are not modified.
         If dynamics gets modified, so must lqr (and vis versa).
+        The same goes for dynamics_batch and lqr_batch. Modifying
+        dynamics and lqr clears any batched versions not given along
+        with them, and modifying erf clears erf_batch unless given.
 
         """
         if dynamics is not None or lqr is not None:
@@ -558,12 +1516,25 @@ class Planner:
                 self.lqr = lqr
             else:
                 raise ValueError("Expected lqr to be a function.")
+            self.dynamics_batch = None
+            self.lqr_batch = None
+
+        if dynamics_batch is not None or lqr_batch is not None:
+            if hasattr(dynamics_batch, '__call__'):
+                self.dynamics_batch = dynamics_batch
+            else:
+                raise ValueError("Expected dynamics_batch to be a function.")
+            if hasattr(lqr_batch, '__call__'):
+                self.lqr_batch = lqr_batch
+            else:
+                raise ValueError("Expected lqr_batch to be a function.")
 
         if constraints is not None:
             if isinstance(constraints, Constraints):
                 self.constraints = constraints
                 self.nstates = self.constraints.nstates
                 self.ncontrols = self.constraints.ncontrols
+                self._local = threading.local()  # holds each thread's rollout buffer
             else:
                 raise ValueError("Expected constraints to be an instance of the Constraints class.")
 
@@ -572,9 +1543,181 @@ class Planner:
                 self.erf = erf
             else:
                 raise ValueError("Expected erf to be a function.")
+            self.erf_batch = None
+
+        if erf_batch is not None:
+            if hasattr(erf_batch, '__call__'):
+                self.erf_batch = erf_batch
+            else:
+                raise ValueError("Expected erf_batch to be a function.")
+
+        if lazy_lqr is not None:
+            self.lazy_lqr = bool(lazy_lqr)
+
+        if pure_callbacks is not None:
+            self.pure_callbacks = bool(pure_callbacks)
+            if self.pure_callbacks:
+                self._copy = lambda a: a
+            else:
+                self._copy = np.copy
 
         self.plan_reached_goal = False
 
+#################################################
+
+    def set_search(self, nn_method=None, nn_eps=None, batch_size=None, lazy_check=None,
+                   rewire=None, rewire_cost=None, bound=None, max_speed=None, position_dims=None,
+                   sampling=None, sample_block=None, threads=None, connect_tol=None):
+        """
+        See class docstring for argument definitions.
+        Arguments not given are not modified.
+
+        """
+        if nn_method is not None:
+            if nn_method in ['brute', 'kdtree']:
+                self.nn_method = nn_method
+            else:
+                raise ValueError("Expected nn_method to be 'brute' or 'kdtree'.")
+
+        if nn_eps is not None:
+            if nn_eps >= 0:
+                self.nn_eps = nn_eps
+            else:
+                raise ValueError("The nn_eps must be nonnegative.")
+
+        if batch_size is not None:
+            if int(batch_size) >= 1:
+                self.batch_size = int(batch_size)
+            else:
+                raise ValueError("The batch_size must be at least 1.")
+
+        if lazy_check is not None:
+            if int(lazy_check) >= 0:
+                self.lazy_check = int(lazy_check)
+            else:
+                raise ValueError("The lazy_check must be nonnegative.")
+
+        if rewire is not None:
+            if int(rewire) >= 0:
+                self.rewire = int(rewire)
+            else:
+                raise ValueError("The rewire must be nonnegative.")
+
+        if rewire_cost is not None:
+            if rewire_cost >= 0:
+                self.rewire_cost = rewire_cost
+            else:
+                raise ValueError("The rewire_cost must be nonnegative.")
+
+        if connect_tol is not None:
+            if np.shape(connect_tol) in [(), (self.nstates,)] and np.all(np.isfinite(connect_tol)):
+                self.connect_tol = np.abs(connect_tol).astype(np.float64)
+            else:
+                raise ValueError("The connect_tol must be finite, and scalar or length of state.")
+
+        if bound is not None:
+            self.bound = bool(bound)
+
+        if max_speed is not None:
+            if max_speed >= 0:
+                self.max_speed = max_speed
+            else:
+                raise ValueError("The max_speed must be nonnegative.")
+
+        if position_dims is not None:
+            position_dims = np.array(position_dims, dtype=np.int64).flatten()
+            if len(position_dims) and np.all(position_dims >= 0) and np.all(position_dims < self.nstates):
+                self.position_dims = position_dims
+            else:
+                raise ValueError("Expected position_dims to be a nonempty list of state indices.")
+
+        if sampling is not None:
+            if sampling in ['uniform', 'halton']:
+                self.sampling = sampling
+            else:
+                raise ValueError("Expected sampling to be 'uniform' or 'halton'.")
+
+        if sample_block is not None:
+            if int(sample_block) >= 1:
+                self.sample_block = int(sample_block)
+            else:
+                raise ValueError("The sample_block must be at least 1.")
+
+        if threads is not None:
+            if int(threads) > 1 and self.rfactor:
+                raise ValueError("More than 1 thread can't be used with a horizon of 0.")
+            if int(threads) >= 1:
+                if getattr(self, '_thread_pool', None) is not None:
+                    self._thread_pool.close()
+                self.threads = int(threads)
+                self._thread_pool = ThreadPool(self.threads) if self.threads > 1 else None
+            else:
+                raise ValueError("The threads must be at least 1.")
+
+#################################################
+
+    def set_seed(self, seed=None):
+        """
+        See class docstring for argument definitions.
+        Giving None means a new seed is drawn from the OS.
+        Either way, self.rng starts over from the seed.
+
+        """
+        if seed is None:
+            seed = np.random.RandomState().randint(0, 2**32, 4, dtype=np.int64)
+        seed = np.array(seed, dtype=np.int64).flatten()
+        if not len(seed) or np.any(seed < 0) or np.any(seed >= 2**32):
+            raise ValueError("Expected seed to be None, or an int or list of ints in [0, 2**32).")
+        self.seed = seed.tolist()
+        self.rng = np.random.RandomState(self.seed)
+        self._nspawned = 0
+
+    def spawn_seeds(self, n):
+        """
+        Returns a list of n new seeds for parallel workers, each of
+        which can be given to another Planner (or np.random.RandomState).
+        Each is this planner's seed with a running count appended, so
+        their streams are independent of self.rng and of each other,
+        and a planner with the same seed spawns the same ones.
+
+        """
+        seeds = [self.seed + [self._nspawned + i] for i in xrange(n)]
+        self._nspawned += n
+        return seeds
+
+#################################################
+
+    def __getstate__(self):
+        """
+        Returns what gets pickled: the planner's settings and its last plan,
+        but not the tree, sampler, or interpolators of its last query, nor
+        its lock. The random number generator is pickled as is, so give
+        each copy its own seed (see spawn_seeds) if they should differ.
+        All the system functions must be picklable (like module-level functions).
+
+        """
+        state = self.__dict__.copy()
+        for key in ('lock', '_future', 'get_state', 'get_effort', 'interpolators', '_copy', 'sampler', '_local',
+                    '_thread_pool', '_xrand_gen', 'tree', 'index', 'node_seq', '_informed'):
+            state.pop(key, None)
+        state['planning'] = False
+        return state
+
+    def __setstate__(self, state):
+        """
+        Restores a pickled planner (see __getstate__).
+
+        """
+        self.__dict__.update(state)
+        self.lock = threading.RLock()
+        self._future = None
+        self.sampler = None
+        self._copy = (lambda a: a) if self.pure_callbacks else np.copy
+        self._local = threading.local()
+        self._thread_pool = ThreadPool(self.threads) if self.threads > 1 else None
+        if hasattr(self, 't_seq'):
+            self._prepare_interpolators()
+
 #################################################
 
     def kill_update(self):
@@ -606,3 +1749,109 @@ class Planner:
             self.tree.visualize(dx, dy, node_seq=self.node_seq)
         else:
             print("There is no plan to visualize!")
+
+################################################# ASYNC HANDLE
+
+class PlanFuture(object):
+    """
+    Handle on an update_plan running on a worker thread,
+    as returned by Planner.update_plan_async.
+
+    """
+    def __init__(self, planner):
+        self.planner = planner
+        self._finished = threading.Event()
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self._result = None
+        self._error = None
+        self._callbacks = []
+
+    def done(self):
+        """
+        Returns True once the update has finished (or failed).
+
+        """
+        return self._finished.is_set()
+
+    def result(self, timeout=None):
+        """
+        Waits up to timeout seconds (forever if None) for the update to
+        finish and returns what update_plan returned, or None if it is
+        still running. If update_plan raised an error, it is raised here.
+
+        """
+        if not self._finished.wait(timeout):
+            return None
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    def best_so_far(self):
+        """
+        Returns the planner's best_plan while the update is running,
+        as a tuple (x_seq, u_seq, reached), without waiting for it.
+
+        """
+        return self.planner.best_plan()
+
+    def cancel(self):
+        """
+        Kills the update if it is still running, so it ends soon
+        and its result is False. Returns True if it was still running.
+
+        """
+        with self._lock:
+            if self.done():
+                return False
+            self._cancelled = True
+            self.planner.kill_update()
+            return True
+
+    def cancelled(self):
+        """
+        Returns True if cancel stopped the update.
+
+        """
+        return self._cancelled
+
+    def add_done_callback(self, fn):
+        """
+        Calls fn with this PlanFuture once the update has finished, on
+        the thread that finished it (or right away if it already has).
+
+        """
+        with self._lock:
+            if not self.done():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+#################################################
+
+    def _run(self):
+        """
+        Runs the rest of the planner's started query and keeps what it returns.
+
+        """
+        try:
+            result = self.planner._run_query()
+        except Exception as error:
+            self._error = error
+            result = None
+        self._finish(result)
+
+    def _finish(self, result):
+        """
+        Keeps the given result, marks the update done,
+        and calls the done callbacks.
+
+        """
+        with self._lock:
+            self._result = result
+            # A cancel that came too late to be seen would leave the planner killed
+            if self._cancelled:
+                self.planner.unkill()
+            self._finished.set()
+        for fn in self._callbacks:
+            fn(self)
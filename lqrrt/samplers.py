@@ -0,0 +1,393 @@
+"""
+Classes for drawing the random sample states that motivate an lqrrt tree.
+
+An instance of any of these classes can be given to update_plan as its
+xrand_gen, since calling it with the planner returns the next sample.
+
+Rather than drawing and checking one sample at a time, the samplers draw
+a whole block of candidates at once, goal-bias them with one vectorized
+mask, filter them with one batch feasibility check (see Constraints), and
+then serve the survivors one by one from a pool until it has to be refilled.
+
+A GridSampler also knows which cells of an occupancy grid are free, and
+draws the positions of its candidates from those cells only, so far fewer
+of them are rejected in cluttered spaces.
+
+A HaltonSampler draws its candidates from a scrambled Halton sequence
+instead of uniformly at random. The sequence covers the sample space far
+more evenly than random samples do when there are only a few hundred of
+them, as in a short replan.
+
+"""
+
+################################################# DEPENDENCIES
+
+from __future__ import division
+import time
+import threading
+
+import numpy as np
+
+################################################# PRIMARY CLASS
+
+class RejectionSampler(object):
+    """
+    To initialize, provide...
+
+    sample_space: List of n tuples where n is the number of states;
+                  [(min1, max1), (min2, max2)...]. Candidates are
+                  drawn uniformly from this box.
+
+    goal_bias: The fraction of the time the goal is sampled. It can be
+               a scalar from 0 (none of the time) to 1 (all the time) or
+               a list of scalars corresponding to each state dimension.
+               Giving None means no goal bias.
+
+    constraints: The Constraints instance whose feasibility check (with
+                 zero effort) each sample must pass.
+
+    block_size: Number of candidates drawn every time the pool runs out.
+                Defaults to 64.
+
+    informed: Optional function that takes a number n and returns an
+              (n, len(informed_dims)) array to use for the informed_dims
+              of n candidates instead of their box values (or None to keep
+              the box values). Candidates it puts outside the sample_space
+              are rejected. Since it depends on the planner's current plan,
+              the pool is thrown out whenever the planner's ETA changes.
+
+    informed_dims: List of the state dimensions filled in by informed.
+
+    give_up: Optional function that returns True when no more time should
+             be spent looking for a feasible sample, in which case the goal
+             itself is returned.
+
+    max_refills: Optional number of blocks in a row that can come up with
+                 no feasible candidates before the goal itself is returned.
+                 Defaults to None (no limit).
+
+    rng: The random number generator to draw from, like an instance of
+         np.random.RandomState. Defaults to None (the global np.random).
+
+    The number of candidates drawn and rejected so far are kept in
+    ndrawn and nrejected, and rejection_rate is their ratio.
+
+    """
+    def __init__(self, sample_space, goal_bias, constraints, block_size=64,
+                 informed=None, informed_dims=None, give_up=None, max_refills=None,
+                 rng=None):
+        # Guards the pool, since set_grid (or set_space) may flush it while planning draws from it
+        self._pool_lock = threading.RLock()
+
+        if goal_bias is None:
+            goal_bias = 0
+        self.set_space(sample_space, goal_bias, constraints)
+
+        if int(block_size) >= 1:
+            self.block_size = int(block_size)
+        else:
+            raise ValueError("The block_size must be at least 1.")
+
+        if informed is not None and informed_dims is None:
+            raise ValueError("Expected informed_dims to go with the informed function.")
+        self.informed = informed
+        self.informed_dims = informed_dims
+        self.give_up = give_up
+        self.max_refills = max_refills
+
+        if rng is None:
+            self.rng = np.random
+        else:
+            self.rng = rng
+
+        self.reset_counts()
+
+    def __call__(self, planner):
+        """
+        Returns the next random sample state for the given planner.
+
+        """
+        with self._pool_lock:
+            # Samples informed by an old plan are out of date
+            if self.informed is not None and planner.T != self._T:
+                self.flush()
+                self._T = planner.T
+
+            refills = 0
+            while self._next >= len(self._pool):
+                if (self.give_up is not None and self.give_up()) or refills == self.max_refills:
+                    return planner.goal
+                self._refill(planner.goal)
+                refills += 1
+            self._next += 1
+            return self._pool[self._next-1]
+
+    def set_space(self, sample_space=None, goal_bias=None, constraints=None):
+        """
+        See class docstring for argument definitions.
+        Arguments not given are not modified.
+
+        """
+        if constraints is not None:
+            self.constraints = constraints
+            self.nstates = constraints.nstates
+
+        # Properly cast the given goal bias
+        if goal_bias is not None:
+            if hasattr(goal_bias, '__contains__'):
+                if len(goal_bias) != self.nstates:
+                    raise ValueError("Expected goal_bias to be scalar or have same length as state.")
+            else:
+                goal_bias = [goal_bias] * self.nstates
+            self.goal_bias = np.array(goal_bias, dtype=np.float64)
+
+        # Properly cast the given sample space and extract statistics
+        if sample_space is not None:
+            sample_space = np.array(sample_space, dtype=np.float64)
+            if sample_space.shape != (self.nstates, 2):
+                raise ValueError("Expected sample_space to be list of nstates tuples.")
+            self.centers = np.mean(sample_space, axis=1)
+            self.spans = np.diff(sample_space).flatten()
+
+        self.flush()
+
+    def flush(self):
+        """
+        Throws out all samples left in the pool.
+
+        """
+        with self._pool_lock:
+            self._pool = np.zeros((0, self.nstates))
+            self._next = 0
+            self._T = None
+
+    def reset_counts(self):
+        """
+        Zeros ndrawn and nrejected.
+
+        """
+        self.ndrawn = 0
+        self.nrejected = 0
+
+    @property
+    def rejection_rate(self):
+        """
+        Fraction of all drawn candidates that were rejected.
+
+        """
+        if self.ndrawn:
+            return self.nrejected / self.ndrawn
+        return 0
+
+#################################################
+
+    def _refill(self, goal):
+        """
+        Draws a block of candidates toward the given goal
+        and pools the ones that pass the feasibility check.
+
+        """
+        X = self._draw(self.block_size)
+
+        # Informed dimensions, keeping only candidates still in the sample space
+        if self.informed is not None:
+            dims = self.informed_dims
+            Y = self.informed(self.block_size)
+            if Y is not None:
+                X[:, dims] = Y
+                X = X[np.all(np.abs(Y - self.centers[dims]) <= self.spans[dims]/2, axis=1)]
+
+        # Each candidate goes to the goal along the dimensions whose bias beats its draw
+        choices = np.greater(self.goal_bias, self.rng.random_sample((len(X), 1)))
+        X = np.where(choices, goal, X)
+
+        # Feasible ones go in the pool
+        self._pool = X[self.constraints.feasible_mask(X, np.zeros((len(X), self.constraints.ncontrols)))]
+        self._next = 0
+        self.ndrawn += self.block_size
+        self.nrejected += self.block_size - len(self._pool)
+
+    def _draw(self, n):
+        """
+        Returns an (n, nstates) array of candidates
+        drawn uniformly from the sample space.
+
+        """
+        return self.centers + self.spans*(self.rng.random_sample((n, self.nstates)) - 0.5)
+
+################################################# GRID SAMPLER
+
+class GridSampler(RejectionSampler):
+    """
+    A RejectionSampler whose candidates have their positions drawn
+    uniformly from the free cells of an occupancy grid that lie in
+    the sample space, rather than from the whole box.
+
+    To initialize, provide the same arguments as a RejectionSampler, and...
+
+    position_dims: The two state dimensions that the grid's columns and
+                   rows run along, in that order. Defaults to [0, 1].
+
+    Then give it each new grid with set_grid. Until it has a grid (or if
+    no free cell lies in the sample space) the whole box is sampled. When
+    informed gives the position_dims (as a planner with a max_speed arranges),
+    those positions are used instead of the grid's.
+    The seconds taken by the last set_grid are kept in build_time.
+
+    """
+    def __init__(self, sample_space, goal_bias, constraints, block_size=64,
+                 informed=None, informed_dims=None, give_up=None, max_refills=None,
+                 rng=None, position_dims=[0, 1]):
+        if len(position_dims) != 2:
+            raise ValueError("Expected position_dims to have the two grid dimensions.")
+        self.position_dims = np.array(position_dims, dtype=np.int64)
+        self._grid = None
+        self.build_time = 0
+        super(GridSampler, self).__init__(sample_space, goal_bias, constraints, block_size,
+                                          informed, informed_dims, give_up, max_refills, rng)
+
+    def set_space(self, sample_space=None, goal_bias=None, constraints=None):
+        """
+        See class docstring for argument definitions.
+        Arguments not given are not modified.
+
+        """
+        super(GridSampler, self).set_space(sample_space, goal_bias, constraints)
+        if sample_space is not None and self._grid is not None:
+            free, origin, cpm, cells, inside = self._grid
+            self._grid = (free, origin, cpm, cells, self._select(free.shape, origin, cpm, cells))
+
+    def set_grid(self, free, origin, cpm):
+        """
+        Gives the sampler a new grid. The free argument is a 2D bool array
+        indexed [row, col] that is True for each cell a vehicle position can
+        be drawn from (so it should already be dilated by the footprint).
+        The origin is the position of the outer corner of cell [0, 0], and
+        cpm is the number of cells per unit length. If the grid has the same
+        shape, origin, and cpm as the last one, only the cells that changed
+        are updated.
+
+        """
+        start = time.time()
+        free = np.array(free, dtype=bool)
+        origin = np.array(origin, dtype=np.float64)
+        if free.ndim != 2 or origin.shape != (2,):
+            raise ValueError("Expected free to be a 2D array and origin to have 2 elements.")
+
+        # Same layout, so just patch the cells that changed
+        if self._grid is not None and free.shape == self._grid[0].shape and \
+           np.all(origin == self._grid[1]) and cpm == self._grid[2]:
+            changed = np.flatnonzero(free != self._grid[0])
+            if not len(changed):
+                self.build_time = time.time() - start
+                return
+            now_free = free.flat[changed]
+            blocked, freed = changed[~now_free], changed[now_free]
+            cells = _patch(self._grid[3], blocked, freed)
+            inside = _patch(self._grid[4], self._select(free.shape, origin, cpm, blocked),
+                            self._select(free.shape, origin, cpm, freed))
+
+        # Otherwise index the whole grid
+        else:
+            cells = np.flatnonzero(free)
+            inside = self._select(free.shape, origin, cpm, cells)
+
+        # Swap in all at once, since planning may be drawing samples meanwhile
+        with self._pool_lock:
+            self._grid = (free, origin, cpm, cells, inside)
+            self.flush()
+        self.build_time = time.time() - start
+
+#################################################
+
+    def _select(self, shape, origin, cpm, cells):
+        """
+        Returns the subset of the given free cells (flat indices
+        into a grid of the given shape) that touch the sample space.
+
+        """
+        dims = self.position_dims
+        lo = np.floor(cpm*(self.centers[dims] - self.spans[dims]/2 - origin))
+        hi = np.floor(cpm*(self.centers[dims] + self.spans[dims]/2 - origin))
+        rows, cols = np.divmod(cells, shape[1])
+        return cells[(cols >= lo[0]) & (cols <= hi[0]) & (rows >= lo[1]) & (rows <= hi[1])]
+
+    def _draw(self, n):
+        """
+        Returns an (n, nstates) array of candidates drawn uniformly from
+        the sample space, but with positions drawn uniformly from its free cells.
+
+        """
+        X = super(GridSampler, self)._draw(n)
+        if self._grid is None or not len(self._grid[4]):
+            return X
+        free, origin, cpm, cells, inside = self._grid
+        rows, cols = np.divmod(inside[self.rng.randint(0, len(inside), n)], free.shape[1])
+        dims = self.position_dims
+        positions = origin + (np.column_stack((cols, rows)) + self.rng.random_sample((n, 2)))/cpm
+        X[:, dims] = np.clip(positions, self.centers[dims] - self.spans[dims]/2, self.centers[dims] + self.spans[dims]/2)
+        return X
+
+################################################# HALTON SAMPLER
+
+class HaltonSampler(RejectionSampler):
+    """
+    A RejectionSampler whose candidates come from a scrambled Halton
+    sequence over the sample space, rather than uniformly at random.
+    Each state dimension uses the next prime base, and the nonzero digits
+    of each base are scrambled by a random permutation chosen when the
+    sampler is made. The goal bias is still applied at random.
+
+    To initialize, provide the same arguments as a RejectionSampler.
+
+    """
+    def __init__(self, sample_space, goal_bias, constraints, block_size=64,
+                 informed=None, informed_dims=None, give_up=None, max_refills=None,
+                 rng=None):
+        super(HaltonSampler, self).__init__(sample_space, goal_bias, constraints, block_size,
+                                            informed, informed_dims, give_up, max_refills, rng)
+        self.bases = _primes(self.nstates)
+        self._perms = [np.append(0, 1 + self.rng.permutation(base-1)) for base in self.bases]
+        self._count = 1  # the first point is all zeros for every base
+
+    def _draw(self, n):
+        """
+        Returns an (n, nstates) array of the next n
+        points of the sequence over the sample space.
+
+        """
+        U = np.zeros((n, self.nstates))
+        for d, (base, perm) in enumerate(zip(self.bases, self._perms)):
+            I = np.arange(self._count, self._count+n)
+            scale = 1 / base
+            while np.any(I):
+                U[:, d] += perm[I % base] * scale
+                I //= base
+                scale /= base
+        self._count += n
+        return self.centers + self.spans*(U - 0.5)
+
+################################################# HELPERS
+
+def _patch(cells, removed, added):
+    """
+    Returns the sorted array of cells with the sorted arrays of cells
+    removed (all of which are in cells) and added (none of which are)
+    patched in, without re-sorting everything.
+
+    """
+    cells = np.delete(cells, np.searchsorted(cells, removed))
+    return np.insert(cells, np.searchsorted(cells, added), added)
+
+def _primes(n):
+    """
+    Returns a list of the first n prime numbers.
+
+    """
+    primes = []
+    candidate = 2
+    while len(primes) < n:
+        if all(candidate % prime for prime in primes):
+            primes.append(candidate)
+        candidate += 1
+    return primes
@@ -0,0 +1,170 @@
+"""
+Class for an occupancy grid in shared memory, for planners in other processes.
+
+One process (like the ROS node getting ogrid messages) writes each new grid
+once, and every process that was handed the SharedGrid when it was started
+(like the workers of a ParallelPlanner) reads it as a NumPy array that views
+the shared memory directly, so nothing is copied or pickled per update.
+
+There are two buffers. Each write fills the one that isn't the newest and
+then bumps the version counter, which is what makes it the newest. So read
+never returns a half-written grid, but the view it returns is only intact
+until the write after next starts filling that same buffer, which can be
+as soon as two ogrids later. Readers should therefore call read again for
+every query rather than hold on to the view, and can ask is_intact after
+using it to find out if it was overwritten meanwhile (in which case they
+should read and query again), or is_stale to find out if a newer grid has
+been written since.
+
+"""
+
+################################################# DEPENDENCIES
+
+from __future__ import division
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray, RawValue
+
+import numpy as np
+
+################################################# PRIMARY CLASS
+
+class SharedGrid(object):
+    """
+    To initialize, provide...
+
+    max_shape: Tuple (rows, cols) of the largest grid that will be written.
+               Smaller grids are fine, since each write records its shape.
+
+    dtype: The NumPy dtype the cells are kept as. Defaults to np.int8,
+           which holds OccupancyGrid message data as is.
+
+    Hand the instance to other processes when starting them (for example
+    through a module-level variable before a process pool is made, or as
+    an initializer argument). It can't be sent to them after that.
+
+    """
+    def __init__(self, max_shape, dtype=np.int8):
+        if len(max_shape) != 2 or min(max_shape) < 1:
+            raise ValueError("Expected max_shape to be a tuple of two positive sizes.")
+        self.max_shape = (int(max_shape[0]), int(max_shape[1]))
+        self.dtype = np.dtype(dtype)
+
+        # Two cell buffers with their [rows, cols, origin_x, origin_y, cpm]
+        nbytes = self.max_shape[0] * self.max_shape[1] * self.dtype.itemsize
+        self._raw = [RawArray('B', nbytes) for i in xrange(2)]
+        self._meta = [RawArray('d', 5) for i in xrange(2)]
+        self._version = RawValue('L', 0)
+        self._writing = RawValue('L', 0)
+        self._write_lock = multiprocessing.Lock()
+        self._views()
+
+    def write(self, grid, origin, cpm):
+        """
+        Makes the given 2D array the newest grid, with the given origin
+        (position of the outer corner of cell [0, 0]) and cpm (cells per
+        unit length). Returns the new version number.
+
+        """
+        grid = np.asarray(grid)
+        if grid.ndim != 2 or not grid.size or grid.shape[0] > self.max_shape[0] or grid.shape[1] > self.max_shape[1]:
+            raise ValueError("Expected grid to be a nonempty 2D array no bigger than max_shape.")
+        if len(origin) != 2:
+            raise ValueError("Expected origin to have 2 elements.")
+
+        # Fill the older buffer, then publish it by bumping the version
+        with self._write_lock:
+            version = int(self._version.value) + 1
+            i = version % 2
+            self._writing.value = version
+            self._cells[i][:grid.size] = grid.ravel()
+            self._meta[i][:] = [grid.shape[0], grid.shape[1], origin[0], origin[1], cpm]
+            self._version.value = version
+        return version
+
+    def withdraw(self):
+        """
+        Makes it known that there is no current grid (for example, because
+        the newest one didn't fit in max_shape), so that read returns None
+        for the grid, origin, and cpm, with a new version number, until the
+        next write. Returns the new version number.
+
+        """
+        with self._write_lock:
+            version = int(self._version.value) + 1
+            self._writing.value = version
+            self._meta[version % 2][:] = [0, 0, 0, 0, 0]
+            self._version.value = version
+        return version
+
+    def read(self):
+        """
+        Returns the newest grid as a read-only array viewing the shared
+        memory, along with its origin, cpm, and version number, as a tuple
+        (grid, origin, cpm, version). Before the first write, the grid,
+        origin, and cpm are None and the version is 0, and after a withdraw
+        they are None too, but with its version. The view is only good for
+        one query (see is_intact).
+
+        """
+        version = int(self._version.value)
+        if not version:
+            return (None, None, None, 0)
+        i = version % 2
+        rows, cols, origin_x, origin_y, cpm = self._meta[i]
+        rows, cols = int(rows), int(cols)
+        if not rows:
+            return (None, None, None, version)
+        grid = self._cells[i][:rows*cols].reshape((rows, cols))
+        grid.flags.writeable = False
+        return (grid, np.array([origin_x, origin_y]), cpm, version)
+
+    @property
+    def version(self):
+        """
+        Version number of the newest grid (0 before the first write).
+
+        """
+        return int(self._version.value)
+
+    def is_intact(self, version):
+        """
+        Returns True if the grid with the given version number has not
+        started being overwritten, so anything read from it so far is good.
+
+        """
+        return self._writing.value < version + 2
+
+    def is_stale(self, version):
+        """
+        Returns True if a newer grid has been written since
+        the one with the given version number was read.
+
+        """
+        return self._version.value != version
+
+#################################################
+
+    def __getstate__(self):
+        """
+        Returns what gets pickled when handing this to a new process.
+        The shared memory goes along, but not the array views of it.
+
+        """
+        state = self.__dict__.copy()
+        del state['_cells']
+        return state
+
+    def __setstate__(self, state):
+        """
+        Restores a SharedGrid in a new process (see __getstate__).
+
+        """
+        self.__dict__.update(state)
+        self._views()
+
+    def _views(self):
+        """
+        Makes the flat array views of the two cell buffers.
+
+        """
+        self._cells = [np.frombuffer(raw, dtype=self.dtype) for raw in self._raw]
@@ -5,17 +5,24 @@ Each node in the tree has:
 Managers
 - ID: integer (never specified by user)
 - pID: parent ID integer
+- depth: number of edges between the seed and the node
+- cost: number of timesteps along the edges between the seed and the node
+- active: False once the node has been pruned (with its subtree)
+- verified: whether the node's edge was fully checked for feasibility
 
 Values
 - state: array of state values
 - lqr: tuple of local cost-to-go and policy arrays (S, K)
 
 Edges
-- x_seq: list of state arrays from parent state to node state
-- u_seq: list of effort arrays from parent state to node state
+- x_seq: array of states from parent state to node state, one per row
+- u_seq: array of efforts from parent state to node state, one per row
 
 The ID corresponds to when the node was added (i.e. the third node
 added has an ID of 3). The seed node always has ID 0, and pID -1.
+A node can be rewired to a new parent later on, so its parent may
+then have a bigger ID than itself, and its state may shift to the
+end of its new edge (see rewire and reroll).
 The ID of the last node added to the tree is always mytree.size-1,
 where mytree.size is the number of nodes in the tree.
 
@@ -26,16 +33,43 @@ mytree. Or, mytree.x_seq[6][3] will return the fourth state vector on
 the edge connecting node ID6 to its parent (starting from the parent).
 IF YOU PULL OUT AN ARRAY LIKE IN THOSE EXAMPLES, IT PASSES BY REFERENCE.
 
+The state, pID, depth and cost features are stored in preallocated arrays
+that double in capacity whenever they fill up, so adding a node is
+O(1) amortized. The attributes mytree.state, mytree.pID, mytree.depth
+and mytree.cost are views of the live rows of those arrays. A view taken before the
+tree grows past its capacity will not see nodes added afterwards.
+
+The edges of all nodes are stored back to back in two big arrays (one
+for states and one for efforts), with each node remembering where its
+edge starts and how many rows it has. Indexing mytree.x_seq[ID] or
+mytree.u_seq[ID] returns a view of that node's rows. Rewiring a node
+appends its new edge and leaves the rows of the old one unused.
+
+The lqr feature stores each distinct S array only once and keeps the
+K arrays of all nodes in one big array, so mytree.lqr[ID] still returns
+the tuple (S, K). If the tree is given an lqr_policy function, nothing
+is stored per node and mytree.lqr[ID] recomputes the policy from the
+node's state instead. Either way, mytree.nbytes reports the memory used.
+
+Adding, rewiring, and pruning nodes all hold mytree.lock, so several
+threads can add nodes to the same tree. A thread that reads a feature of
+a node that is already in the tree needs no lock, since growing only
+replaces the arrays after copying them, but a thread that reads features
+of the whole tree (like mytree.state with mytree.active) while others
+are adding should hold mytree.lock so that they have the same size.
+
 """
 
 ################################################# DEPENDENCIES
 
 from __future__ import division
+import threading
+
 import numpy as np
 
 ################################################# PRIMARY CLASS
 
-class Tree:
+class Tree(object):
     """
     To initialize, provide...
 
@@ -46,8 +80,22 @@ class Tree:
               is, S solves the local Riccati equation and
               K = (R^-1)*(B^T)*(S) for effort jacobian B.
 
+    capacity: The number of nodes to preallocate storage for.
+              Storage doubles whenever it runs out, so this
+              only needs to be a reasonable first guess.
+
+    edge_length: The expected number of states per edge, used
+                 to preallocate the edge storage. Again, this
+                 only needs to be a reasonable first guess.
+
+    lqr_policy: Optional function that takes a state and returns
+                the (S, K) for that state. Only give this if the
+                policy is completely determined by the node state,
+                because then the lqr given to add_node is ignored
+                and recomputed on demand instead of being stored.
+
     """
-    def __init__(self, seed_state, seed_lqr):
+    def __init__(self, seed_state, seed_lqr, capacity=1024, edge_length=16, lqr_policy=None):
 
         # Store number of states
         self.nstates = len(seed_state)
@@ -60,40 +108,242 @@ class Tree:
             print("Continuing, assuming you don't care about the lqr or effort features...\n")
             self.ncontrols = 1
 
-        # Initialize state array
-        self.state = np.array(seed_state, dtype=np.float64).reshape(1, self.nstates)
+        # Initialize node arrays
+        self.capacity = max(int(capacity), 1)
+        self._state = np.zeros((self.capacity, self.nstates), dtype=np.float64)
+        self._pID = np.zeros(self.capacity, dtype=np.int64)
+        self._depth = np.zeros(self.capacity, dtype=np.int64)
+        self._cost = np.zeros(self.capacity, dtype=np.int64)
+        self._edge_start = np.zeros(self.capacity, dtype=np.int64)
+        self._edge_len = np.zeros(self.capacity, dtype=np.int64)
+        self._active = np.zeros(self.capacity, dtype=bool)
+        self._verified = np.zeros(self.capacity, dtype=bool)
+        self._state[0] = seed_state
+        self._pID[0] = -1
+        self._active[0] = True
+        self._verified[0] = True
+
+        # Initialize edge arrays, where the seed's edge is just the seed
+        self.edge_capacity = self.capacity * max(int(edge_length), 1)
+        self._x_edges = np.zeros((self.edge_capacity, self.nstates), dtype=np.float64)
+        self._u_edges = np.zeros((self.edge_capacity, self.ncontrols), dtype=np.float64)
+        self._x_edges[0] = seed_state
+        self._edge_len[0] = 1
+        self.edge_size = 1
+
+        # Edge accessors
+        self.x_seq = EdgeView(self, '_x_edges')
+        self.u_seq = EdgeView(self, '_u_edges')
+
+        # Initialize lqr storage
+        self.lqr = LQRStore(self, lqr_policy)
+        self.lqr.set(0, seed_lqr)
+
+        # Children of each node, for walking subtrees
+        self._children = [[]]
+
+        # Initialize number of nodes, and of pruned nodes
+        self.size = 1
+        self.npruned = 0
 
-        # Initialize all other feature lists
-        self.pID = [-1]
-        self.lqr = [seed_lqr]
-        self.x_seq = [[seed_state]]
-        self.u_seq = [[np.zeros(self.ncontrols)]]
+        # Held by everything that changes the tree
+        self.lock = threading.RLock()
 
-        # Initialize number of nodes
-        self.size = 1
+#################################################
+
+    def add_node(self, pID, state, lqr, x_seq, u_seq, verified=True):
+        """
+        Adds a node to the tree with the given features. Set verified
+        to False if the edge was not fully checked for feasibility.
+
+        """
+        with self.lock:
+            # Make sure the desired parent exists
+            if pID >= self.size or pID < 0:
+                raise ValueError("The given parent ID, {}, doesn't exist.".format(pID))
+
+            # Cast edge to arrays
+            x_seq = np.asarray(x_seq, dtype=np.float64).reshape(-1, self.nstates)
+            u_seq = np.asarray(u_seq, dtype=np.float64).reshape(-1, self.ncontrols)
+            nedge = len(x_seq)
+            if len(u_seq) != nedge:
+                raise ValueError("The given x_seq and u_seq must have the same length.")
+
+            # Make room if the arrays are full
+            if self.size == self.capacity:
+                self._grow()
+            if self.edge_size + nedge > self.edge_capacity:
+                self._grow_edges(nedge)
+
+            # Fill in the next row of the node arrays
+            self._state[self.size] = state
+            self._pID[self.size] = pID
+            self._depth[self.size] = self._depth[pID] + 1
+            self._cost[self.size] = self._cost[pID] + nedge
+            self._active[self.size] = True
+            self._verified[self.size] = verified
+
+            # Append edge to the edge arrays
+            self._x_edges[self.edge_size:self.edge_size+nedge] = x_seq
+            self._u_edges[self.edge_size:self.edge_size+nedge] = u_seq
+            self._edge_start[self.size] = self.edge_size
+            self._edge_len[self.size] = nedge
+            self.edge_size += nedge
+
+            # Store lqr
+            self.lqr.set(self.size, lqr)
+
+            # Remember it as a child
+            self._children.append([])
+            self._children[pID].append(self.size)
+
+            # Increment node count
+            self.size += 1
+
+#################################################
+
+    def add_nodes(self, pIDs, states, lqrs, x_seqs, u_seqs, verified=True):
+        """
+        Adds many nodes to the tree in one go. Each argument is a list
+        with one element per new node, holding what add_node would take,
+        except verified which is one bool for all of them. The parents
+        must already be in the tree before this is called.
+
+        """
+        with self.lock:
+            # Make sure the desired parents exist
+            pIDs = np.asarray(pIDs, dtype=np.int64)
+            if np.any(pIDs >= self.size) or np.any(pIDs < 0):
+                raise ValueError("The given parent IDs, {}, don't all exist.".format(pIDs))
+
+            # Cast edges to arrays
+            x_seqs = [np.asarray(x_seq, dtype=np.float64).reshape(-1, self.nstates) for x_seq in x_seqs]
+            u_seqs = [np.asarray(u_seq, dtype=np.float64).reshape(-1, self.ncontrols) for u_seq in u_seqs]
+            nedges = np.array([len(x_seq) for x_seq in x_seqs], dtype=np.int64)
+            if np.any(nedges != [len(u_seq) for u_seq in u_seqs]):
+                raise ValueError("Each given x_seq and u_seq must have the same length.")
+            nnew = len(pIDs)
+            nedge = np.sum(nedges)
+
+            # Make room if the arrays are full
+            while self.size + nnew > self.capacity:
+                self._grow()
+            if self.edge_size + nedge > self.edge_capacity:
+                self._grow_edges(nedge)
+
+            # Fill in the next rows of the node arrays
+            new = slice(self.size, self.size+nnew)
+            self._state[new] = states
+            self._pID[new] = pIDs
+            self._depth[new] = self._depth[pIDs] + 1
+            self._cost[new] = self._cost[pIDs] + nedges
+            self._active[new] = True
+            self._verified[new] = verified
+
+            # Append edges to the edge arrays
+            if nedge:
+                self._x_edges[self.edge_size:self.edge_size+nedge] = np.concatenate(x_seqs)
+                self._u_edges[self.edge_size:self.edge_size+nedge] = np.concatenate(u_seqs)
+            self._edge_start[new] = self.edge_size + np.cumsum(nedges) - nedges
+            self._edge_len[new] = nedges
+            self.edge_size += nedge
+
+            # Store lqrs
+            for ID, lqr in enumerate(lqrs, self.size):
+                self.lqr.set(ID, lqr)
+
+            # Remember them as children
+            self._children.extend([] for i in xrange(nnew))
+            for ID, pID in enumerate(pIDs, self.size):
+                self._children[pID].append(ID)
+
+            # Increment node count
+            self.size += nnew
+
+#################################################
+
+    def _grow(self):
+        """
+        Doubles the capacity of the node arrays.
+
+        """
+        self.capacity *= 2
+        for name in ('_state', '_pID', '_depth', '_cost', '_edge_start', '_edge_len', '_active', '_verified'):
+            _resize(self, name, self.capacity, self.size)
+        self.lqr._grow()
+
+    def _grow_edges(self, nedge):
+        """
+        Doubles the capacity of the edge arrays until
+        they can fit nedge more rows.
+
+        """
+        while self.edge_size + nedge > self.edge_capacity:
+            self.edge_capacity *= 2
+        for name in ('_x_edges', '_u_edges'):
+            _resize(self, name, self.edge_capacity, self.edge_size)
 
 #################################################
 
-    def add_node(self, pID, state, lqr, x_seq, u_seq):
+    @property
+    def state(self):
         """
-        Adds a node to the tree with the given features.
+        Array of node states, one row per node.
 
         """
-        # Make sure the desired parent exists
-        if pID >= self.size or pID < 0:
-            raise ValueError("The given parent ID, {}, doesn't exist.".format(pID))
+        return self._state[:self.size]
 
-        # Update state array
-        self.state = np.vstack((self.state, state))
+    @property
+    def pID(self):
+        """
+        Array of parent IDs, one element per node.
+
+        """
+        return self._pID[:self.size]
+
+    @property
+    def depth(self):
+        """
+        Array of node depths, one element per node.
+
+        """
+        return self._depth[:self.size]
+
+    @property
+    def cost(self):
+        """
+        Array of node costs-to-come (in timesteps), one element per node.
+
+        """
+        return self._cost[:self.size]
+
+    @property
+    def active(self):
+        """
+        Array of bools, one element per node, that
+        are False for nodes that have been pruned.
+
+        """
+        return self._active[:self.size]
+
+    @property
+    def verified(self):
+        """
+        Array of bools, one element per node, that are True
+        for nodes whose edges were fully checked for feasibility.
 
-        # Append all other feature lists
-        self.pID.append(pID)
-        self.lqr.append(lqr)
-        self.x_seq.append(x_seq)
-        self.u_seq.append(u_seq)
+        """
+        return self._verified[:self.size]
 
-        # Increment node count
-        self.size += 1
+    @property
+    def nbytes(self):
+        """
+        Number of bytes allocated for all node features.
+
+        """
+        arrays = (self._state, self._pID, self._depth, self._cost, self._edge_start, self._edge_len,
+                  self._active, self._verified, self._x_edges, self._u_edges)
+        return sum(arr.nbytes for arr in arrays) + self.lqr.nbytes
 
 #################################################
 
@@ -110,12 +360,125 @@ class Tree:
             raise ValueError("The given ID, {}, doesn't exist.".format(ID))
 
         # Follow parents backward and then reverse list
+        pID = self._pID
         IDs = []
         while ID != -1:
             IDs.append(ID)
-            ID = self.pID[ID]
+            ID = int(pID[ID])
         return IDs[::-1]
 
+#################################################
+
+    def prune(self, ID):
+        """
+        Marks the node with the given ID (or every node in a given
+        array of IDs) and all of its descendants as inactive. They stay
+        in the tree (so IDs don't change) but should no longer be extended.
+        Returns an array of the IDs that were newly pruned. The seed can't
+        be pruned.
+
+        """
+        with self.lock:
+            # Make sure the desired nodes exist
+            IDs = np.atleast_1d(ID)
+            if np.any(IDs >= self.size) or np.any(IDs <= 0):
+                raise ValueError("The given ID, {}, doesn't exist or is the seed.".format(ID))
+
+            # Deactivate
+            pruned = np.sort(self._subtree(ID))
+            pruned = pruned[self._active[pruned]]
+            self._active[pruned] = False
+            self.npruned += len(pruned)
+            return pruned
+
+#################################################
+
+    def rewire(self, ID, pID, x_seq, u_seq, verified=True):
+        """
+        Makes the node with the given ID a child of the node pID instead,
+        connected by the given new edge, and moves the node to the end of
+        that edge. Its lqr is not changed, and neither are the edges of its
+        children (see reroll). The depths and costs of the whole subtree are
+        updated. Returns an array of the IDs of the subtree, starting with ID
+        and with every node after its parent.
+
+        """
+        with self.lock:
+            # Make sure the nodes exist and the rewire doesn't make a loop
+            if ID >= self.size or ID <= 0:
+                raise ValueError("The given ID, {}, doesn't exist or is the seed.".format(ID))
+            if pID >= self.size or pID < 0:
+                raise ValueError("The given parent ID, {}, doesn't exist.".format(pID))
+            if ID in self.climb(pID):
+                raise ValueError("The given parent ID, {}, is in the subtree of {}.".format(pID, ID))
+
+            # Cast edge to arrays
+            x_seq = np.asarray(x_seq, dtype=np.float64).reshape(-1, self.nstates)
+            u_seq = np.asarray(u_seq, dtype=np.float64).reshape(-1, self.ncontrols)
+            nedge = len(x_seq)
+            if len(u_seq) != nedge:
+                raise ValueError("The given x_seq and u_seq must have the same length.")
+
+            # Append new edge to the edge arrays
+            if self.edge_size + nedge > self.edge_capacity:
+                self._grow_edges(nedge)
+            self._x_edges[self.edge_size:self.edge_size+nedge] = x_seq
+            self._u_edges[self.edge_size:self.edge_size+nedge] = u_seq
+            self._edge_start[ID] = self.edge_size
+            self._edge_len[ID] = nedge
+            self.edge_size += nedge
+            self._state[ID] = x_seq[-1]
+
+            # Move to the new parent's children
+            self._children[self._pID[ID]].remove(ID)
+            self._children[pID].append(ID)
+
+            # Shift the depths and costs of the subtree
+            IDs = self._subtree(ID)
+            self._depth[IDs] += self._depth[pID] + 1 - self._depth[ID]
+            self._cost[IDs] += self._cost[pID] + nedge - self._cost[ID]
+            self._pID[ID] = pID
+            self._verified[ID] = verified
+            return IDs
+
+    def reroll(self, ID, x_seq, verified=True):
+        """
+        Replaces the states along the edge leading to the node with the
+        given ID with the given ones (as many as before, for the same
+        efforts), and moves the node to the last of them. Its lqr is not
+        changed.
+
+        """
+        with self.lock:
+            if ID >= self.size or ID <= 0:
+                raise ValueError("The given ID, {}, doesn't exist or is the seed.".format(ID))
+            x_seq = np.asarray(x_seq, dtype=np.float64).reshape(-1, self.nstates)
+            if len(x_seq) != self._edge_len[ID]:
+                raise ValueError("The given x_seq must have as many states as the edge it replaces.")
+            start = self._edge_start[ID]
+            self._x_edges[start:start+len(x_seq)] = x_seq
+            self._state[ID] = x_seq[-1]
+            self._verified[ID] = verified
+
+    def _subtree(self, ID):
+        """
+        Returns an array of the IDs of the node with the given ID (or array
+        of IDs) and all of its descendants, each listed once. For one ID,
+        every node comes after its parent (and ID comes first).
+
+        """
+        # Walk down the children, breadth first
+        IDs = [int(i) for i in np.atleast_1d(ID)]
+        seen = set(IDs)
+        i = 0
+        while i < len(IDs):
+            for cID in self._children[IDs[i]]:
+                if cID not in seen:
+                    seen.add(cID)
+                    IDs.append(cID)
+            i += 1
+        return np.array(IDs, dtype=np.int64)
+
 #################################################
 
     def trajectory(self, IDs):
@@ -123,13 +486,16 @@ class Tree:
         Given a list of node IDs, the full sequence of
         states and efforts to go from IDs[0] to IDs[-1]
         are returned as a tuple (x_seq_full, u_seq_full).
+        Each is a new array with one state or effort per row.
 
         """
-        x_seq_full = []; u_seq_full = []
-        for ID in IDs:
-            x_seq_full.extend(self.x_seq[ID])
-            u_seq_full.extend(self.u_seq[ID])
-        return (x_seq_full, u_seq_full)
+        # Rows of the edge arrays belonging to each of the given nodes, in order
+        IDs = np.asarray(IDs, dtype=np.int64)
+        starts = self._edge_start[IDs]
+        lens = self._edge_len[IDs]
+        offsets = np.cumsum(lens) - lens
+        rows = np.arange(np.sum(lens)) + np.repeat(starts - offsets, lens)
+        return (self._x_edges[rows], self._u_edges[rows])
 
 #################################################
 
@@ -169,3 +535,169 @@ class Tree:
 
         print("Done! Close window to continue.\n")
         plt.show()
+
+################################################# HELPERS
+
+class EdgeView(object):
+    """
+    Read-only accessor for the edges of a tree, so that
+    <tree_instance>.x_seq[ID] gives an array view of the
+    rows of the edge leading to node ID.
+
+    """
+    def __init__(self, tree, name):
+        self.tree = tree
+        self.name = name
+
+    def __getitem__(self, ID):
+        if ID < 0:
+            ID += self.tree.size
+        if ID >= self.tree.size or ID < 0:
+            raise IndexError("The given ID, {}, doesn't exist.".format(ID))
+        start = self.tree._edge_start[ID]
+        return getattr(self.tree, self.name)[start:start+self.tree._edge_len[ID]]
+
+    def __len__(self):
+        return self.tree.size
+
+    def __iter__(self):
+        for ID in xrange(self.tree.size):
+            yield self[ID]
+
+
+class LQRStore(object):
+    """
+    Accessor and storage for the lqr feature of a tree, so that
+    <tree_instance>.lqr[ID] gives the tuple (S, K) of node ID,
+    or None if the node was added without an lqr.
+
+    Distinct S arrays are interned (stored once and shared by all
+    nodes that use them) and K arrays are stored as rows of one big
+    array. If a policy function is given, no lqr is stored at all and
+    policy(<tree_instance>.state[ID]) is returned instead.
+
+    """
+    def __init__(self, tree, policy=None):
+        self.tree = tree
+        self.policy = policy
+
+        # Interned S arrays, looked up by object ID or by contents
+        self._S = []
+        self._S_keys = {}
+
+        # Per-node S index (-1 for no lqr) and K arrays
+        self._S_index = np.zeros(tree.capacity, dtype=np.int32)
+        self._K = np.zeros((tree.capacity, tree.ncontrols, tree.nstates), dtype=np.float64)
+        if policy is not None:
+            self._S_index = self._S_index[:0]
+            self._K = self._K[:0]
+
+    def set(self, ID, lqr):
+        """
+        Stores the given lqr tuple (S, K), or None, for node ID.
+
+        """
+        if self.policy is not None:
+            return
+        if lqr is None:
+            self._S_index[ID] = -1
+            return
+        try:
+            S, K = lqr
+            self._K[ID] = np.reshape(K, (self.tree.ncontrols, self.tree.nstates))
+        except (TypeError, ValueError):
+            self._S_index[ID] = -1
+            return
+        self._S_index[ID] = self._intern(S)
+
+    def _intern(self, S):
+        """
+        Returns the index of the stored S array equal to the given one,
+        storing it first if it is new.
+
+        """
+        # Fast path for the very same object that was stored before
+        index = self._S_keys.get(id(S))
+        if index is not None:
+            return index
+
+        # Otherwise compare contents
+        S_arr = np.asarray(S)
+        key = (S_arr.shape, S_arr.dtype.str, S_arr.tobytes())
+        index = self._S_keys.get(key)
+        if index is None:
+            index = len(self._S)
+            self._S.append(S)
+            self._S_keys[key] = index
+            self._S_keys[id(S)] = index
+        return index
+
+    def _grow(self):
+        """
+        Matches the capacity of the per-node arrays to the tree's.
+
+        """
+        if self.policy is None:
+            _resize(self, '_S_index', self.tree.capacity, self.tree.size)
+            _resize(self, '_K', self.tree.capacity, self.tree.size)
+
+    @property
+    def nbytes(self):
+        """
+        Number of bytes allocated for storing lqr arrays.
+
+        """
+        return sum(np.asarray(S).nbytes for S in self._S) + self._S_index.nbytes + self._K.nbytes
+
+    def __getitem__(self, ID):
+        if ID < 0:
+            ID += self.tree.size
+        if ID >= self.tree.size or ID < 0:
+            raise IndexError("The given ID, {}, doesn't exist.".format(ID))
+        if self.policy is not None:
+            return self.policy(self.tree._state[ID])
+        index = self._S_index[ID]
+        if index < 0:
+            return None
+        return (self._S[index], self._K[ID])
+
+    def __len__(self):
+        return self.tree.size
+
+
+class RolloutBuffer(object):
+    """
+    Preallocated storage for the states and efforts of one rollout,
+    reused from rollout to rollout so that simulating an extension
+    doesn't allocate anything per step. The arrays x and u have one
+    row per timestep and are grown by doubling when a rollout needs
+    more rows than they have.
+
+    """
+    def __init__(self, nstates, ncontrols, length=64):
+        self.x = np.zeros((int(length), nstates), dtype=np.float64)
+        self.u = np.zeros((int(length), ncontrols), dtype=np.float64)
+
+    def reserve(self, length):
+        """
+        Makes sure the buffer has at least the given number of rows,
+        keeping the contents of the rows it already has.
+
+        """
+        if length > len(self.x):
+            capacity = max(int(length), 2*len(self.x))
+            used = len(self.x)
+            _resize(self, 'x', capacity, used)
+            _resize(self, 'u', capacity, used)
+
+
+def _resize(obj, name, capacity, used):
+    """
+    Replaces the array attribute obj.<name> with a zeroed array of
+    the given capacity (along the first axis), keeping the first used rows.
+
+    """
+    old = getattr(obj, name)
+    new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+    new[:used] = old[:used]
+    setattr(obj, name, new)
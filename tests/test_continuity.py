@@ -0,0 +1,72 @@
+"""
+Checks that the plans lqRRT returns are exactly what the dynamics do.
+
+Every state of a plan must be where the dynamics take the state before it
+under the plan's effort for that step, so a plan never jumps between states
+that the system can't actually get between. The planners run on the boat
+and puck problems of the benchmarks with the clock off, so the runs are
+repeatable.
+
+"""
+
+################################################# DEPENDENCIES
+
+from __future__ import division
+import os
+import sys
+
+import numpy as np
+
+import lqrrt
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+import problems
+
+################################################# HELPERS
+
+def jumps(planner, x_seq, u_seq):
+    """
+    Returns the number of steps k of the plan (x_seq, u_seq) where
+    x_seq[k+1] is not dynamics(x_seq[k], u_seq[k+1]).
+
+    """
+    njumps = 0
+    for k in xrange(len(x_seq)-1):
+        if not np.allclose(planner.dynamics(np.copy(x_seq[k]), np.copy(u_seq[k+1]), planner.dt),
+                           x_seq[k+1], rtol=0, atol=1E-9):
+            njumps += 1
+    return njumps
+
+def plan(**kwargs):
+    """
+    Returns a boat planner with the given settings
+    after one update without the clock.
+
+    """
+    planner = problems.make_planner(use_clock=False, max_iterations=300, batch_size=8, **kwargs)
+    planner.update_plan(problems.x0, problems.sample_space, goal_bias=problems.goal_bias)
+    return planner
+
+################################################# TESTS
+
+def test_default_plans_are_continuous():
+    planner = plan(seed=1)
+    assert jumps(planner, planner.x_seq, planner.u_seq) == 0
+
+def test_rewired_plans_are_continuous():
+    for seed in xrange(3):
+        planner = plan(rewire=5, seed=seed)
+        assert jumps(planner, planner.x_seq, planner.u_seq) == 0
+
+def test_rewired_trees_are_continuous():
+    planner = plan(rewire=5, seed=1)
+    for ID in np.flatnonzero(planner.tree.active):
+        x_seq, u_seq = planner.tree.trajectory(planner.tree.climb(ID))
+        assert jumps(planner, x_seq, u_seq) == 0
+
+def test_bidirectional_plans_are_continuous():
+    for seed in xrange(3):
+        planner = problems.make_puck_planner(use_clock=False, max_iterations=300, seed=seed)
+        bidirectional = lqrrt.BidirectionalPlanner(planner, problems.puck_reverse_dynamics, problems.puck_reverse_lqr)
+        bidirectional.update_plan(problems.puck_x0, problems.puck_sample_space, goal_bias=problems.puck_goal_bias)
+        assert jumps(planner, planner.x_seq, planner.u_seq) == 0